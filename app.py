@@ -1,40 +1,337 @@
 import time  # 用於計時
-from flask import Flask, request, abort, current_app
+from flask import Flask, request, abort, current_app, jsonify, Response, redirect, send_file
 from linebot.v3 import WebhookHandler
 from linebot.v3.messaging import (
-    Configuration, ApiClient, MessagingApi, MessagingApiBlob, ReplyMessageRequest,
+    Configuration, ApiClient, MessagingApi, ReplyMessageRequest,
     PushMessageRequest, TextMessage  # 移除了 ReplyMessageRequest，因為我們將主要用 Push
 )
 from linebot.v3.webhooks import MessageEvent, AudioMessageContent, FileMessageContent
-from whisper_helper import transcribe_audio
-from summarizer import summarize_text
+from summarizer import summarize_text, PROMPT_VERSION
+import multiprocessing
 import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 import uuid
-import threading # <--- 引入 threading 模組
+import gzip
+from job_queue import JobScheduler, QueueFullError, RecentIds, RetryLater
+from job_store import JobStore
+import metrics
+from metrics import stage_timer
+from result_cache import ResultCache, make_cache_key
+from transcript_store import CONTENT_TYPE as TRANSCRIPT_CONTENT_TYPE, LocalBlobBackend, S3BlobBackend, TranscriptStore
+from line_content import (
+    ContentDownloadError, ContentNotReadyError, ContentTooLargeError, download_message_content, jittered_backoff
+)
 
 # ... (其他載入和設定，保持不變) ...
 load_dotenv()
 app = Flask(__name__)
-configuration = Configuration(access_token=os.getenv("LINE_CHANNEL_ACCESS_TOKEN"))
+# LINE_API_BASE_URL 可指向 tools/fake_line.py 等本機的假服務，離線量測整條處理流程
+configuration = Configuration(
+    access_token=os.getenv("LINE_CHANNEL_ACCESS_TOKEN"),
+    host=os.getenv("LINE_API_BASE_URL", "https://api.line.me").rstrip('/'),
+)
 handler = WebhookHandler(os.getenv("LINE_CHANNEL_SECRET"))
+# transcription_pool 以 spawn 啟動的轉錄程序會重新 import 主程式（python app.py 或 worker.py，兩者都會 import 本檔），
+# 在 multiprocessing 的子程序中 import 時只需要定義，不能啟動任何背景服務或載入模型
+_is_spawned_child = multiprocessing.parent_process() is not None
 
 # ... (其他 import 和 app = Flask(__name__) 等初始化代碼)
 
 # --- 設定靜態檔案路徑 ---
 BASE_DIR = os.path.abspath(os.path.dirname(__file__))
 STATIC_FOLDER = os.path.join(BASE_DIR, 'static')
-TRANSCRIPTS_SUBFOLDER = 'transcripts' # 可以在 static 資料夾下再建一個 transcripts 子資料夾
+TRANSCRIPTS_SUBFOLDER = 'transcripts' # 舊版逐字稿直接存放在 static/transcripts，仍可下載，過期後由清理執行緒刪除
 TRANSCRIPTS_PATH = os.path.join(STATIC_FOLDER, TRANSCRIPTS_SUBFOLDER)
 
-# 確保儲存逐字稿的資料夾存在
-if not os.path.exists(TRANSCRIPTS_PATH):
-    os.makedirs(TRANSCRIPTS_PATH)
-    app.logger.info(f"已創建資料夾用於存放逐字稿: {TRANSCRIPTS_PATH}")
+# --- 背景工作排程器 ---
+# JOB_BACKEND=memory (預設)：在本程序內以固定數量的轉錄工作執行緒 + 有上限的佇列處理
+# JOB_BACKEND=sqlite：工作寫入 SQLite，由獨立的 worker.py 程序載入 Whisper 並處理，本程序只負責排隊
+JOB_BACKEND = os.getenv("JOB_BACKEND", "memory").lower()
+TRANSCRIBE_WORKERS = int(os.getenv("TRANSCRIBE_WORKERS", "1"))
+JOB_QUEUE_MAX_SIZE = int(os.getenv("JOB_QUEUE_MAX_SIZE", "50"))
+JOB_QUEUE_MAX_PER_USER = int(os.getenv("JOB_QUEUE_MAX_PER_USER", "10"))
+JOB_DB_PATH = os.getenv("JOB_DB_PATH", os.path.join(BASE_DIR, 'data', 'jobs.sqlite3'))
+QUEUE_FULL_MESSAGE = "目前排隊處理的音訊太多了，請稍後再傳送一次喔！🙏"
+
+# --- LINE API 用戶端 ---
+# 回覆與推送共用同一個 ApiClient (內部為 urllib3 連線池)，不必每次重新建立連線與 TLS 握手；
+# webhook 的確認回覆交給 reply_executor 在背景並行送出，/callback 不用等 LINE 的回應就能返回
+LINE_REPLY_CONCURRENCY = int(os.getenv("LINE_REPLY_CONCURRENCY", "8"))
+configuration.connection_pool_maxsize = LINE_REPLY_CONCURRENCY + TRANSCRIBE_WORKERS
+line_api_client = ApiClient(configuration)
+messaging_api = MessagingApi(line_api_client)
+reply_executor = ThreadPoolExecutor(max_workers=LINE_REPLY_CONCURRENCY, thread_name_prefix="line-reply")
+
+# LINE 重送 (redelivery) 的事件 webhookEventId 與 message_id 都不變，在這段時間內看過的就直接忽略
+WEBHOOK_DEDUP_TTL_SECONDS = float(os.getenv("WEBHOOK_DEDUP_TTL_SECONDS", "3600"))
+recent_webhook_events = RecentIds(ttl_seconds=WEBHOOK_DEDUP_TTL_SECONDS)
+
+# --- 下載設定 ---
+# 超過此大小的檔案在 webhook 階段就直接拒絕 (依 file_size)，下載時也會依 Content-Length / 實際大小中止
+MAX_AUDIO_FILE_MB = float(os.getenv("MAX_AUDIO_FILE_MB", "200"))
+MAX_AUDIO_FILE_BYTES = int(MAX_AUDIO_FILE_MB * 1024 * 1024)
+DOWNLOAD_MAX_ATTEMPTS = int(os.getenv("DOWNLOAD_MAX_ATTEMPTS", "6"))
+
+# --- 轉錄/摘要結果快取 ---
+# 以音訊內容的 SHA-256 為鍵，同一段語音被重複轉傳時直接回傳先前的結果
+RESULT_CACHE_DB_PATH = os.getenv("RESULT_CACHE_DB_PATH", os.path.join(BASE_DIR, 'data', 'result_cache.sqlite3'))
+RESULT_CACHE_MAX_MB = float(os.getenv("RESULT_CACHE_MAX_MB", "200"))
+RESULT_CACHE_TTL_DAYS = float(os.getenv("RESULT_CACHE_TTL_DAYS", "30"))
+result_cache = ResultCache(
+    RESULT_CACHE_DB_PATH,
+    max_bytes=int(RESULT_CACHE_MAX_MB * 1024 * 1024),
+    ttl_seconds=RESULT_CACHE_TTL_DAYS * 24 * 3600,
+)
+
+# --- 逐字稿儲存 ---
+# TRANSCRIPT_STORE_BACKEND=local (預設)：gzip 壓縮後分層存放在 TRANSCRIPT_STORE_DIR
+# TRANSCRIPT_STORE_BACKEND=s3：存放在 S3 相容的物件儲存，下載連結轉向預先簽署的網址 (需安裝 boto3)
+TRANSCRIPT_STORE_BACKEND = os.getenv("TRANSCRIPT_STORE_BACKEND", "local").lower()
+TRANSCRIPT_STORE_DIR = os.getenv("TRANSCRIPT_STORE_DIR", os.path.join(BASE_DIR, 'data', 'transcripts'))
+TRANSCRIPT_DB_PATH = os.getenv("TRANSCRIPT_DB_PATH", os.path.join(BASE_DIR, 'data', 'transcripts.sqlite3'))
+TRANSCRIPT_TTL_DAYS = float(os.getenv("TRANSCRIPT_TTL_DAYS", "90"))
+TRANSCRIPT_MAX_MB = float(os.getenv("TRANSCRIPT_MAX_MB", "1024"))
+TRANSCRIPT_SWEEP_INTERVAL_SECONDS = float(os.getenv("TRANSCRIPT_SWEEP_INTERVAL_SECONDS", "3600"))
+TRANSCRIPT_URL_EXPIRES_SECONDS = int(os.getenv("TRANSCRIPT_URL_EXPIRES_SECONDS", "3600"))
+if TRANSCRIPT_STORE_BACKEND == "s3":
+    transcript_backend = S3BlobBackend(
+        os.getenv("TRANSCRIPT_S3_BUCKET", "linebot-transcripts"),
+        prefix=os.getenv("TRANSCRIPT_S3_PREFIX", "transcripts/"),
+        endpoint_url=os.getenv("TRANSCRIPT_S3_ENDPOINT_URL") or None,
+        region_name=os.getenv("TRANSCRIPT_S3_REGION") or None,
+    )
+else:
+    transcript_backend = LocalBlobBackend(os.path.join(TRANSCRIPT_STORE_DIR, 'blobs'))
+transcript_store = TranscriptStore(
+    TRANSCRIPT_DB_PATH,
+    transcript_backend,
+    drafts_dir=os.path.join(TRANSCRIPT_STORE_DIR, 'drafts'),
+    max_bytes=int(TRANSCRIPT_MAX_MB * 1024 * 1024),
+    ttl_seconds=TRANSCRIPT_TTL_DAYS * 24 * 3600,
+    legacy_dir=TRANSCRIPTS_PATH,
+)
+if TRANSCRIPT_SWEEP_INTERVAL_SECONDS > 0 and not _is_spawned_child:
+    transcript_store.start_sweeper(TRANSCRIPT_SWEEP_INTERVAL_SECONDS)
+
+# --- 長音訊串流轉錄 ---
+# 超過此長度的音訊改用分段串流轉錄，邊轉錄邊寫入逐字稿並推送進度
+STREAMING_MIN_AUDIO_SECONDS = float(os.getenv("STREAMING_MIN_AUDIO_SECONDS", "600"))
+STREAM_PROGRESS_STEP_PERCENT = int(os.getenv("STREAM_PROGRESS_STEP_PERCENT", "20"))
+
+# --- 模型載入與暖機 ---
+# Whisper 模型在第一次需要時才載入；WHISPER_WARMUP=1 時會在啟動後於背景載入並跑一次空白推論，
+# webhook 不必等模型載入完成就能開始接收並排隊工作
+WHISPER_WARMUP = os.getenv("WHISPER_WARMUP", "1") == "1"
+# 設為 1 時，/readyz 要等模型暖機完成才回報就緒（適合只負責轉錄、不接收 webhook 的部署）
+READYZ_REQUIRE_MODEL = os.getenv("READYZ_REQUIRE_MODEL", "0") == "1"
+
+job_scheduler = None
+job_store = None
+if JOB_BACKEND == "sqlite":
+    job_store = JobStore(JOB_DB_PATH)
+    app.logger.info(f"使用持久化工作佇列: {JOB_DB_PATH} (請另外啟動 worker.py 處理工作)")
+else:
+    job_scheduler = JobScheduler(
+        num_workers=TRANSCRIBE_WORKERS,
+        max_queue_size=JOB_QUEUE_MAX_SIZE,
+        max_per_user=JOB_QUEUE_MAX_PER_USER,
+        name="transcribe",
+    )
+    if not _is_spawned_child:
+        job_scheduler.start()
+
+def warm_up_model_in_background():
+    """在背景執行緒中載入 Whisper 模型並暖機，不阻塞程序啟動。"""
+    def run():
+        try:
+            import whisper_helper
+            whisper_helper.warm_up()
+            app.logger.info("Whisper 模型已載入並完成暖機")
+        except Exception as e:
+            app.logger.error(f"Whisper 模型暖機失敗，將在第一個工作時重新嘗試載入: {e}", exc_info=True)
+
+    thread = threading.Thread(target=run, name="whisper-warmup", daemon=True)
+    thread.start()
+    return thread
+
+def get_model_status():
+    """
+    回傳目前 Whisper 模型的狀態，不會觸發模型載入。
+    尚未 import whisper_helper（還沒有任何工作或暖機）時回傳 not_loaded。
+    """
+    whisper_helper = sys.modules.get("whisper_helper")
+    if whisper_helper is None or not hasattr(whisper_helper, "model_status"):
+        return "not_loaded"
+    return whisper_helper.model_status()
+
+# 以 debug 模式直接執行 app.py 時，Werkzeug 的 reloader 父程序只負責監看檔案，不處理請求，不需要載入模型
+_is_reloader_parent = __name__ == "__main__" and os.environ.get("WERKZEUG_RUN_MAIN") != "true"
+if job_scheduler is not None and WHISPER_WARMUP and not _is_reloader_parent and not _is_spawned_child:
+    warm_up_model_in_background()
+
+# --- 監控指標 ---
+# 佇列深度與執行中的工作數在輸出 /metrics 時才讀取
+def get_queue_stats():
+    if job_store is not None:
+        return job_store.stats()
+    return job_scheduler.stats()
+
+metrics.QUEUE_DEPTH.set_function(lambda: get_queue_stats()["queue_depth"])
+metrics.ACTIVE_WORKERS.set_function(lambda: get_queue_stats()["active"])
+
+def enqueue_audio_job(event_data):
+    """
+    將音訊處理工作放入目前設定的工作佇列。
+
+    Returns:
+        目前排隊中的工作數量。
+
+    Raises:
+        QueueFullError: 佇列已滿。
+    """
+    user_id = event_data['source']['userId']
+    event_data.setdefault('enqueuedAt', time.time()) # 用來計算排隊等待與端到端的耗時
+    if job_store is not None:
+        return job_store.enqueue(
+            event_data['message']['id'], user_id, event_data,
+            max_pending=JOB_QUEUE_MAX_SIZE, max_per_user=JOB_QUEUE_MAX_PER_USER,
+        )
+    return job_scheduler.submit(user_id, process_audio_in_background, event_data, current_app.app_context())
+
+def build_transcript_url(transcript_id):
+    """根據 YOUR_PUBLIC_BASE_URL 組出逐字稿的公開下載連結，未設定時回傳 None。"""
+    base_url = os.getenv("YOUR_PUBLIC_BASE_URL")
+    if not base_url:
+        return None
+    base_url = base_url.rstrip('/') # 移除末尾可能的斜線
+    return f"{base_url}/transcripts/{transcript_id}"
+
+def push_text_message(user_id, text):
+    with stage_timer("push"):
+        messaging_api.push_message(
+            PushMessageRequest(
+                to=user_id,
+                messages=[TextMessage(text=text)]
+            )
+        )
+
+def reply_text_in_background(reply_token, text, user_id, description):
+    """把回覆交給 reply_executor 在背景送出，不等待 LINE 的回應；失敗只記錄錯誤。"""
+    def send():
+        try:
+            with stage_timer("ack"):
+                messaging_api.reply_message(
+                    ReplyMessageRequest(
+                        reply_token=reply_token,
+                        messages=[TextMessage(text=text)]
+                    )
+                )
+            app.logger.info(f"已向用戶 {user_id} 發送{description}")
+        except Exception as e:
+            app.logger.error(f"發送{description}失敗 (用戶 {user_id}): {e}", exc_info=True)
+
+    reply_executor.submit(send)
+
+def is_duplicate_event(event):
+    """
+    判斷是否為已經處理過的重複事件（LINE 在逾時或錯誤後重送的 webhook）。
+
+    以 webhookEventId 與 message_id 兩者判斷：任一個在 WEBHOOK_DEDUP_TTL_SECONDS 內出現過就視為重複。
+    兩者在這裡就先記錄下來，讓同時送達的重複事件不會都被排入佇列；之後排入佇列失敗時
+    必須呼叫 forget_event()，否則 LINE 重送的事件會被當成重複而丟掉。
+    """
+    is_redelivery = bool(event.delivery_context and event.delivery_context.is_redelivery)
+    new_event = recent_webhook_events.add(f"event:{event.webhook_event_id}")
+    new_message = recent_webhook_events.add(f"message:{event.message.id}")
+    if new_event and new_message:
+        if is_redelivery:
+            # 本程序沒看過（例如重新啟動過）；使用 JOB_BACKEND=sqlite 時，JobStore 仍會依 message_id 忽略重複的工作
+            app.logger.info(f"收到重送的事件 {event.webhook_event_id} (message_id: {event.message.id})，先前沒有處理紀錄，照常處理")
+        return False
+    metrics.WEBHOOK_DUPLICATES.inc()
+    app.logger.info(f"忽略重複的事件 {event.webhook_event_id} (message_id: {event.message.id}, 重送: {is_redelivery})")
+    return True
+
+def forget_event(event):
+    """撤銷 is_duplicate_event() 的紀錄，讓 LINE 重送同一個事件時可以重新排入佇列。"""
+    recent_webhook_events.discard(f"event:{event.webhook_event_id}")
+    recent_webhook_events.discard(f"message:{event.message.id}")
+
+def enqueue_event_job(event, event_data):
+    """
+    將事件的音訊工作排入佇列；排入失敗 (QueueFullError 以外的錯誤，例如 SQLite 被鎖住) 時撤銷重複事件的紀錄
+    並拋出例外，讓 /callback 回應錯誤、由 LINE 重送。
+    """
+    try:
+        return enqueue_audio_job(event_data)
+    except QueueFullError:
+        raise # 已回覆用戶佇列已滿，LINE 不會重送，不需要撤銷紀錄
+    except Exception:
+        forget_event(event)
+        raise
+
+def transcribe_with_progress(audio, user_id, transcript_id, transcript_url):
+    """
+    以串流模式轉錄長音訊：每轉錄完一段就附加寫入逐字稿草稿，並在進度每跨過
+    STREAM_PROGRESS_STEP_PERCENT 時推送進度訊息給用戶。
+
+    串流途中遇到暫時性錯誤（例如記憶體不足）時，改以 transcribe_audio 的降級重試轉錄整段音訊。
+
+    Returns:
+        TranscriptionResult。
+    """
+    from whisper_helper import (
+        SAMPLE_RATE, TranscriptionResult, is_transient_error, transcribe_audio, transcribe_audio_stream
+    )
+
+    start_time = time.time()
+    audio_seconds = len(audio) / SAMPLE_RATE
+    try:
+        text = _stream_transcript(transcribe_audio_stream(audio), user_id, transcript_id, transcript_url)
+    except Exception as e:
+        if not is_transient_error(e):
+            app.logger.error(f"背景：串流轉錄失敗: {e}", exc_info=True)
+            return TranscriptionResult("error", "語音轉文字服務暫時無法使用。", error=str(e),
+                                       audio_seconds=audio_seconds, elapsed_seconds=time.time() - start_time)
+        app.logger.warning(f"背景：串流轉錄時發生暫時性錯誤 ({e})，改用降級設定重新轉錄整段音訊")
+        return transcribe_audio(audio)
+    status = "ok" if text.strip() else "no_speech"
+    return TranscriptionResult(status, text, audio_seconds=audio_seconds, elapsed_seconds=time.time() - start_time,
+                               model="stream")
+
+def _stream_transcript(chunks, user_id, transcript_id, transcript_url):
+    texts = []
+    next_progress = STREAM_PROGRESS_STEP_PERCENT
+    with transcript_store.open_draft(transcript_id) as tf:
+        for chunk_text, done_seconds, total_seconds in chunks:
+            if chunk_text:
+                texts.append(chunk_text)
+                tf.write(chunk_text + "\n")
+                tf.flush()
+
+            percent = int(done_seconds / total_seconds * 100)
+            if percent < next_progress or percent >= 100:
+                continue
+            progress_text = f"逐字稿進度：已完成約 {percent}% ({done_seconds / 60:.0f}/{total_seconds / 60:.0f} 分鐘)，請再稍候一下...⏳"
+            if transcript_url and next_progress == STREAM_PROGRESS_STEP_PERCENT:
+                progress_text += f"\n\n已完成的部分可以先從這裡查看（會持續更新）：\n{transcript_url}"
+            next_progress = (percent // STREAM_PROGRESS_STEP_PERCENT + 1) * STREAM_PROGRESS_STEP_PERCENT
+            try:
+                push_text_message(user_id, progress_text)
+                app.logger.info(f"背景：已推送轉錄進度 {percent}% 給用戶 {user_id}")
+            except Exception as e:
+                app.logger.error(f"背景：推送轉錄進度給用戶 {user_id} 失敗: {e}", exc_info=True)
+    return "\n".join(texts)
 
 # ... (您的 configuration 和 handler 初始化代碼) ...
-# 這個函式將包含您原本 handle_audio 的主要邏輯，並在背景執行緒中運行
+# 這個函式將包含您原本 handle_audio 的主要邏輯，並由工作佇列的背景執行緒執行
 def process_audio_in_background(event_data, flask_app_context):
+    # 延遲載入 Whisper：使用 JOB_BACKEND=sqlite 時，Web 程序不需要把模型載入記憶體
+    from whisper_helper import transcribe_audio, load_audio, SAMPLE_RATE, ASR_CONFIG_ID
+
     with flask_app_context:
         user_id = event_data['source']['userId']
         message_id = event_data['message']['id']
@@ -42,125 +339,155 @@ def process_audio_in_background(event_data, flask_app_context):
         
         app.logger.info(f"背景處理開始 - 用戶: {user_id}, 訊息ID: {message_id}, 檔案名: {original_file_name}")
         
-        unique_file_prefix = str(uuid.uuid4())
-        temp_audio_path = f"temp_audio_{unique_file_prefix}.m4a" # 臨時音訊檔路徑
-        
-        # 逐字稿檔案將儲存在 static/transcripts/ 目錄下
-        transcript_filename_only = f"transcript_{unique_file_prefix}.txt" # 只有檔名
-        transcript_file_local_path = os.path.join(TRANSCRIPTS_PATH, transcript_filename_only) # 完整的本地路徑
+        audio_suffix = os.path.splitext(original_file_name)[1].lower() or ".m4a" # 只有在無法從記憶體解碼時才會用到
+
+        # 逐字稿存放在 transcript_store，下載連結為 /transcripts/<transcript_id>
+        transcript_id = uuid.uuid4().hex
         
         final_message_to_user = "抱歉，處理您的請求時發生了未知的錯誤。"
         analysis_duration_text = ""
         transcript_url = None # 初始化逐字稿 URL
 
-        audio_data_bytes = None
-        api_response_status_for_logging = None
+        audio_content = None
+        download_error_message = None
 
         try:
-            # --- 1. 下載音訊 (您的重試邏輯保持不變) ---
-            with ApiClient(configuration) as api_client_blob:
-                messaging_api_blob = MessagingApiBlob(api_client_blob)
-                app.logger.info(f"背景：開始下載 message_id: {message_id} 的內容 (含重試機制)")
-                
-                MAX_RETRIES = 5
-                retry_delay_seconds = 3
-
-                for attempt in range(MAX_RETRIES):
-                    app.logger.info(f"背景：下載嘗試 {attempt + 1}/{MAX_RETRIES} for message_id: {message_id}")
-                    try:
-                        api_response = messaging_api_blob.get_message_content_with_http_info(message_id=message_id)
-                        api_response_status_for_logging = api_response.status_code
-                        
-                        if api_response.status_code == 200:
-                            if isinstance(api_response.data, bytes):
-                                audio_data_bytes = api_response.data
-                                app.logger.info(f"背景：成功下載音訊 (message_id: {message_id})")
-                                break 
-                            else:
-                                app.logger.error(f"背景：HTTP 200 但回傳的 data 不是 bytes 型態: {type(api_response.data)}. Message_id: {message_id}")
-                        elif api_response.status_code == 202:
-                            app.logger.info(f"背景：收到 HTTP 202 (Accepted) for message_id: {message_id}. 等待 {retry_delay_seconds} 秒後重試...")
-                            if attempt < MAX_RETRIES - 1:
-                                time.sleep(retry_delay_seconds)
-                                retry_delay_seconds = min(retry_delay_seconds * 2, 30)
-                            else:
-                                app.logger.error(f"背景：達到最大重試次數 ({MAX_RETRIES})，message_id: {message_id} 內容仍未準備好 (HTTP 202)。")
-                        else: 
-                            response_body_preview = api_response.data
-                            if isinstance(response_body_preview, bytes):
-                                try: response_body_preview = response_body_preview.decode('utf-8', errors='ignore')[:200]
-                                except Exception: pass
-                            app.logger.error(f"背景：下載音訊失敗 (message_id: {message_id})，HTTP 狀態碼: {api_response.status_code}, 回應 Body (預覽): {response_body_preview}")
-                            break 
-                    except Exception as e_sdk_attempt: 
-                        app.logger.error(f"背景：第 {attempt + 1} 次下載嘗試時發生 SDK 錯誤 (message_id: {message_id}): {e_sdk_attempt}", exc_info=True)
-                        if hasattr(e_sdk_attempt, 'status') and e_sdk_attempt.status:
-                             api_response_status_for_logging = e_sdk_attempt.status
-                        if attempt < MAX_RETRIES - 1:
-                            time.sleep(retry_delay_seconds)
-                            retry_delay_seconds = min(retry_delay_seconds * 2, 30)
-                        else:
-                            app.logger.error(f"背景：達到最大重試次數 ({MAX_RETRIES})，SDK 錯誤持續 for message_id: {message_id}。")
+            # --- 1. 串流下載音訊 ---
+            # 每次只嘗試下載一次；內容尚未準備好 (HTTP 202) 或暫時性錯誤時拋出 RetryLater，
+            # 讓工作延後重新排隊，等待期間不佔用工作執行緒
+            download_attempt = event_data.get('downloadAttempt', 0)
+            if download_attempt == 0 or 'downloadStartedAt' not in event_data:
+                event_data['downloadStartedAt'] = time.time()
+                if download_attempt == 0 and 'enqueuedAt' in event_data:
+                    metrics.observe_stage("queue_wait", event_data['downloadStartedAt'] - event_data['enqueuedAt'])
+            app.logger.info(f"背景：開始下載 message_id: {message_id} 的內容 (嘗試 {download_attempt + 1}/{DOWNLOAD_MAX_ATTEMPTS})")
+            try:
+                audio_content = download_message_content(
+                    message_id, configuration.access_token, max_bytes=MAX_AUDIO_FILE_BYTES
+                )
+                app.logger.info(f"背景：成功下載音訊 (message_id: {message_id}, 大小: {audio_content.size} bytes)")
+                # 包含等待 LINE 準備內容 (HTTP 202) 而延後重試的時間
+                metrics.observe_stage("download", time.time() - event_data['downloadStartedAt'])
+            except ContentTooLargeError as e:
+                app.logger.warning(f"背景：音訊內容超過大小上限 (message_id: {message_id}): {e}")
+                metrics.record_error("download")
+                metrics.JOBS.inc(result="too_large")
+                download_error_message = f"抱歉，您傳送的檔案超過 {MAX_AUDIO_FILE_MB:.0f} MB 的上限，目前無法處理喔。"
+            except (ContentNotReadyError, ContentDownloadError) as e:
+                retryable = isinstance(e, ContentNotReadyError) or e.retryable
+                if retryable and download_attempt + 1 < DOWNLOAD_MAX_ATTEMPTS:
+                    retry_delay_seconds = jittered_backoff(download_attempt)
+                    event_data['downloadAttempt'] = download_attempt + 1
+                    app.logger.info(f"背景：message_id: {message_id} 暫時無法下載 ({e})，{retry_delay_seconds:.1f} 秒後重新排隊")
+                    raise RetryLater(retry_delay_seconds, str(e))
+                app.logger.error(f"背景：最終下載音訊失敗 (message_id: {message_id}): {e}")
+                metrics.record_error("download")
+                metrics.JOBS.inc(result="download_failed")
+                error_detail = f" (API 狀態: {e.status})" if e.status else ""
+                download_error_message = f"抱歉，無法取得您傳送的音訊內容{error_detail}。可能檔案較大正在處理中或暫時無法存取，請稍後再試。"
             # --- 下載音訊部分結束 ---
 
-            if audio_data_bytes is None:
-                app.logger.error(f"背景：最終下載音訊失敗 (message_id: {message_id})。最後記錄的 API 狀態: {api_response_status_for_logging}")
-                error_detail = f" (API 狀態: {api_response_status_for_logging})" if api_response_status_for_logging else ""
-                final_message_to_user = f"抱歉，無法取得您傳送的音訊內容{error_detail}。可能檔案較大正在處理中或暫時無法存取，請稍後再試。"
-            elif isinstance(audio_data_bytes, bytes):
-                app.logger.info(f"背景：音訊內容已成功獲取，準備寫入檔案 (message_id: {message_id})")
-                with open(temp_audio_path, "wb") as f:
-                    f.write(audio_data_bytes)
-                app.logger.info(f"背景：音訊已儲存到 {temp_audio_path}")
+            # --- 查詢結果快取 ---
+            cache_key = None
+            cached_result = None
+            if audio_content is not None:
+                cache_key = make_cache_key(audio_content.sha256, ASR_CONFIG_ID, PROMPT_VERSION)
+                cached_result = result_cache.get(cache_key)
 
+            if audio_content is None:
+                final_message_to_user = download_error_message
+            elif cached_result is not None:
+                app.logger.info(f"背景：命中結果快取 (message_id: {message_id}, sha256: {audio_content.sha256})，略過轉錄與摘要")
+                metrics.JOBS.inc(result="cached")
+                cached_transcript_id = cached_result.transcript_id
+                if not cached_transcript_id or not transcript_store.exists(cached_transcript_id):
+                    # 先前的逐字稿已過期被清理 (或是舊版快取沒有 transcript_id)，用快取的內容重新存一份；內容相同時不會重複佔用空間
+                    transcript_store.put(transcript_id, cached_result.transcript)
+                    cached_transcript_id = transcript_id
+                    result_cache.put(cache_key, cached_result.transcript, cached_result.summary, cached_transcript_id)
+                transcript_url = build_transcript_url(cached_transcript_id)
+
+                message_parts = [cached_result.summary]
+                if transcript_url:
+                    message_parts.append(f"\n\n您可以點擊以下連結下載完整逐字稿：\n{transcript_url}")
+                else:
+                    message_parts.append("\n\n(逐字稿已產生但無法提供檔案下載連結，請確認 YOUR_PUBLIC_BASE_URL 設定)")
+                analysis_duration_text = "\n\n(這段音訊之前分析過，直接提供先前的結果 ⚡)"
+                message_parts.append(analysis_duration_text)
+                final_message_to_user = "".join(message_parts)
+            else:
+                app.logger.info(f"背景：音訊內容已成功獲取，直接從下載內容解碼 (message_id: {message_id})")
                 analysis_start_time = time.time() # 開始計時
-                text = transcribe_audio(temp_audio_path) # 獲取逐字稿
-                app.logger.info(f"背景：語音轉文字結果 (前100字): {text[:100]}...")
-                
-                is_transcription_error = "語音轉文字服務目前暫時無法使用" in text or \
-                                         "Expected key.size" in text or \
-                                         "Key and Value must have the same sequence length" in text
-                
-                if is_transcription_error:
-                    app.logger.warning(f"背景：Whisper 錯誤: {text}")
+                with stage_timer("decode"):
+                    audio = load_audio(audio_content.file, suffix=audio_suffix)
+                audio_content.close() # 解碼後不再需要原始內容，盡早釋放記憶體/暫存檔
+                audio_seconds = len(audio) / SAMPLE_RATE
+                whisper_start_time = time.perf_counter()
+                with stage_timer("whisper"):
+                    if audio_seconds >= STREAMING_MIN_AUDIO_SECONDS:
+                        # 長錄音：分段串流轉錄，讓用戶不用等到整份轉錄結束才看到東西
+                        app.logger.info(f"背景：音訊長度 {audio_seconds:.0f} 秒，使用串流模式轉錄")
+                        transcription = transcribe_with_progress(audio, user_id, transcript_id,
+                                                                 build_transcript_url(transcript_id))
+                    else:
+                        transcription = transcribe_audio(audio) # 獲取逐字稿
+                metrics.AUDIO_SECONDS.inc(audio_seconds)
+                if audio_seconds > 0:
+                    metrics.REALTIME_FACTOR.observe((time.perf_counter() - whisper_start_time) / audio_seconds)
+                text = transcription.text
+                app.logger.info(f"背景：語音轉文字結果 ({transcription.status}, 模型: {transcription.model}, "
+                                f"語言: {transcription.language}, 前100字): {text[:100]}...")
+
+                if transcription.status == "error":
+                    # 轉錄失敗：不儲存逐字稿、不呼叫 Gemini、不寫入快取
+                    app.logger.warning(f"背景：Whisper 錯誤 (可重試: {transcription.retryable}): {transcription.error}")
+                    metrics.record_error("whisper")
+                    metrics.JOBS.inc(result="transcription_error")
                     final_message_to_user = f"抱歉，語音轉錄似乎出了一點小問題：\n「{text}」"
                     analysis_end_time = time.time()
                     duration = analysis_end_time - analysis_start_time
                     analysis_duration_text = f"\n\n(處理耗時約 {duration:.1f} 秒)"
                     final_message_to_user += analysis_duration_text
+                elif transcription.status == "no_speech":
+                    # 整段都是靜音或雜音：模型已被略過，也不需要呼叫 Gemini 摘要
+                    app.logger.info(f"背景：message_id: {message_id} 的音訊中沒有偵測到語音，略過摘要")
+                    metrics.JOBS.inc(result="no_speech")
+                    duration = time.time() - analysis_start_time
+                    analysis_duration_text = f"\n\n(處理耗時約 {duration:.1f} 秒)"
+                    final_message_to_user = "這段音訊裡好像沒有聽到任何說話的聲音喔，請確認錄音內容後再傳一次試試看。🔇" + analysis_duration_text
                 else:
-                    # --- 儲存逐字稿到 static/transcripts 資料夾 ---
+                    # --- 儲存逐字稿 (壓縮後存入 transcript_store，串流模式的草稿會被取代) ---
                     try:
-                        with open(transcript_file_local_path, "w", encoding="utf-8") as tf:
-                            tf.write(text)
-                        app.logger.info(f"背景：逐字稿已儲存到本地檔案: {transcript_file_local_path}")
-                        
+                        with stage_timer("transcript_write"):
+                            transcript_store.put(transcript_id, text)
+                        app.logger.info(f"背景：逐字稿已儲存: {transcript_id}")
+
                         # 【核心修改】構造公開 URL
-                        base_url = os.getenv("YOUR_PUBLIC_BASE_URL") 
-                        if base_url:
-                            base_url = base_url.rstrip('/') # 移除末尾可能的斜線
-                            transcript_url = f"{base_url}/static/{TRANSCRIPTS_SUBFOLDER}/{transcript_filename_only}" # 使用純檔名
+                        transcript_url = build_transcript_url(transcript_id)
+                        if transcript_url:
                             app.logger.info(f"背景：逐字稿的公開 URL: {transcript_url}")
                         else:
-                            app.logger.warning("背景：環境變數 YOUR_PUBLIC_BASE_URL 未設定。逐字稿檔案已儲存於本地，但無法生成公開下載連結。")
-                            transcript_url = None # 確保 transcript_url 在此情況下為 None
+                            app.logger.warning("背景：環境變數 YOUR_PUBLIC_BASE_URL 未設定。逐字稿已儲存，但無法生成公開下載連結。")
                             
                     except Exception as e_file_save:
                         app.logger.error(f"背景：儲存或設定逐字稿 URL 失敗: {e_file_save}", exc_info=True)
                         transcript_url = None
 
                     # --- 文本摘要 ---
-                    summary = summarize_text(text) 
-                    app.logger.info(f"背景：摘要結果 (前100字): {summary[:100]}...")
+                    with stage_timer("gemini"):
+                        summary_result = summarize_text(text)
+                    summary = summary_result.text
+                    app.logger.info(f"背景：摘要結果 ({summary_result.status}, 前100字): {summary[:100]}...")
                     
                     analysis_end_time = time.time()
                     duration = analysis_end_time - analysis_start_time
                     analysis_duration_text = f"\n\n(分析處理時間：{duration:.1f} 秒)"
 
-                    is_summary_error = "摘要服務發生錯誤" in summary or "摘要服務暫時無法提供" in summary
-                    if is_summary_error:
-                        app.logger.warning(f"背景：Summarizer 錯誤: {summary}")
-                        message_parts = [f"語音轉錄完成，但摘要服務有點小狀況。{analysis_duration_text}"]
+                    if not summary_result.ok:
+                        app.logger.warning(f"背景：Summarizer 錯誤 (可重試: {summary_result.retryable}): {summary_result.error}")
+                        metrics.record_error("gemini")
+                        metrics.JOBS.inc(result="summary_error")
+                        message_parts = [f"語音轉錄完成，但摘要服務有點小狀況：{summary}{analysis_duration_text}"]
                         if transcript_url:
                             message_parts.append(f"\n\n您可以點擊連結下載完整逐字稿：\n{transcript_url}")
                         else:
@@ -168,6 +495,11 @@ def process_audio_in_background(event_data, flask_app_context):
                             message_parts.append("\n(因摘要失敗且無法提供檔案下載，僅顯示部分逐字稿)")
                         final_message_to_user = "".join(message_parts)
                     else: # 摘要成功
+                        metrics.JOBS.inc(result="success")
+                        # 只快取成功的結果，錯誤訊息不能被當成逐字稿/摘要重複使用
+                        saved_transcript_id = transcript_id if transcript_store.exists(transcript_id) else None
+                        result_cache.put(cache_key, text, summary, saved_transcript_id)
+
                         message_parts = [summary]
                         if transcript_url:
                             message_parts.append(f"\n\n您可以點擊以下連結下載完整逐字稿：\n{transcript_url}")
@@ -176,12 +508,12 @@ def process_audio_in_background(event_data, flask_app_context):
                             message_parts.append(f"\n\n(逐字稿已產生但無法提供檔案下載連結，請確認 YOUR_PUBLIC_BASE_URL 設定)")
                         message_parts.append(analysis_duration_text)
                         final_message_to_user = "".join(message_parts)
-            else: 
-                app.logger.error(f"背景：下載音訊時 get_message_content_with_http_info 返回了未預期的資料結構 (message_id: {message_id})")
-                final_message_to_user = "處理音訊檔案時發生了非預期的內部錯誤。"
         
+        except RetryLater:
+            raise # 交給工作佇列延後重新排隊，這次不推送任何訊息
         except Exception as e:
             app.logger.error(f"背景：處理語音或摘要時發生嚴重錯誤 (用戶 {user_id}, message_id: {message_id}): {e}", exc_info=True)
+            metrics.JOBS.inc(result="error")
             # ... (錯誤訊息設定邏輯)
             try:
                 if 'analysis_start_time' in locals() and analysis_start_time: # type: ignore
@@ -195,19 +527,14 @@ def process_audio_in_background(event_data, flask_app_context):
                  final_message_to_user = "哎呀，處理您的請求時遇到了一些技術問題，請稍後再試。"
 
         finally:
-            if os.path.exists(temp_audio_path):
-                os.remove(temp_audio_path)
-                app.logger.info(f"背景：臨時音訊檔案已刪除: {temp_audio_path}")
-        # 使用正確的變數名 transcript_file_local_path
-            if os.path.exists(transcript_file_local_path): 
-                try:
-                # 如果您希望用戶能 через URL 下載，這裡暫時不要刪除，或者有其他清理機制
-                # 如果您確定要在此處刪除，請取消下面 os.remove 的註解
-                # os.remove(transcript_file_local_path)
-                # app.logger.info(f"背景：本地逐字稿檔案已刪除: {transcript_file_local_path}")
-                    app.logger.info(f"背景：本地逐字稿檔案 {transcript_file_local_path} 已保留，供用戶下載 (或等待後續清理)。") # 如果不刪除，可以這樣記錄
-                except Exception as e_remove_transcript: # 如果嘗試刪除時出錯
-                    app.logger.error(f"背景：刪除本地逐字稿檔案 {transcript_file_local_path} 失敗: {e_remove_transcript}")
+            if audio_content is not None:
+                audio_content.close()
+            # 已儲存的逐字稿保留供用戶下載，過期後由 transcript_store 的清理執行緒刪除；
+            # 串流轉錄失敗或沒有語音時留下的草稿則直接刪除
+            try:
+                transcript_store.discard_draft(transcript_id)
+            except Exception as e_discard:
+                app.logger.error(f"背景：刪除逐字稿草稿 {transcript_id} 失敗: {e_discard}")
 
 
         # --- 推送最終訊息給用戶 ---
@@ -225,34 +552,104 @@ def process_audio_in_background(event_data, flask_app_context):
                     final_message_to_user = final_message_to_user[:4900] + "...\n（內容過長，部分訊息已截斷）"
                 app.logger.info(f"截斷後的訊息長度: {len(final_message_to_user)}")
             try:
-                with ApiClient(configuration) as api_client_push:
-                    push_api = MessagingApi(api_client_push)
-                    push_api.push_message(
-                        PushMessageRequest(
-                            to=user_id,
-                            messages=[TextMessage(text=final_message_to_user)]
-                        )
-                    )
-                    app.logger.info(f"背景：已成功推送訊息給用戶 {user_id}。訊息內容:\n{final_message_to_user}")
+                push_text_message(user_id, final_message_to_user)
+                app.logger.info(f"背景：已成功推送訊息給用戶 {user_id}。訊息內容:\n{final_message_to_user}")
             except Exception as e:
                 app.logger.error(f"背景：推送訊息給用戶 {user_id} 失敗: {e}", exc_info=True)
+        if 'enqueuedAt' in event_data:
+            # 從收到 webhook 到推送最終結果的端到端耗時
+            metrics.observe_stage("total", time.time() - event_data['enqueuedAt'])
 
 @app.route("/callback", methods=["POST"])
 def callback():
     signature = request.headers["X-Line-Signature"]
     body = request.get_data(as_text=True)
-    app.logger.info(f"Webhook 請求 Body: {body}")
+    app.logger.debug(f"Webhook 請求 Body: {body}")
 
     try:
-        # WebhookHandler 解析事件，並觸發對應的 @handler.add 裝飾的函數
-        # 我們讓 handler.handle 保持同步，但它呼叫的 handle_audio_event 將會啟動一個線程
-        handler.handle(body, signature)
+        # WebhookHandler 驗證簽章、解析批次中的所有事件，並逐一觸發對應的 @handler.add 裝飾的函數
+        # 各事件的處理函數只會把工作放進佇列、把確認回覆交給背景執行緒，不會等待任何 LINE API 的回應
+        with stage_timer("webhook"):
+            handler.handle(body, signature)
     except Exception as e:
         app.logger.error(f"處理 Webhook 時發生嚴重錯誤: {e}", exc_info=True)
         abort(400) # 如果 handle 過程本身出錯，例如簽名驗證失敗
     
     return "OK" # <<< 關鍵：快速返回 OK 給 LINE
 
+@app.route("/healthz", methods=["GET"])
+def healthz():
+    # 存活檢查：程序能回應請求即可，不檢查模型或外部服務
+    return jsonify({"status": "ok"})
+
+@app.route("/readyz", methods=["GET"])
+def readyz():
+    # 就緒檢查：工作佇列可用即代表 webhook 可以開始接收並排隊工作；模型狀態僅供參考，
+    # 除非設定 READYZ_REQUIRE_MODEL=1
+    checks = {"backend": JOB_BACKEND}
+    ready = True
+    try:
+        if job_store is not None:
+            job_store.stats()
+        checks["queue"] = "ok"
+    except Exception as e:
+        checks["queue"] = f"error: {e}"
+        ready = False
+
+    if job_scheduler is not None:
+        checks["model"] = get_model_status()
+        if READYZ_REQUIRE_MODEL and checks["model"] != "ready":
+            ready = False
+    else:
+        checks["model"] = "worker"  # 模型由獨立的 worker.py 程序載入
+
+    checks["status"] = "ready" if ready else "not_ready"
+    return jsonify(checks), 200 if ready else 503
+
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    # Prometheus 文字格式的監控指標：各階段耗時、錯誤數、處理的音訊秒數、即時率、佇列深度
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+@app.route("/cache/stats", methods=["GET"])
+def cache_stats():
+    return jsonify(result_cache.stats())
+
+@app.route("/transcripts/stats", methods=["GET"])
+def transcript_stats():
+    return jsonify(transcript_store.stats())
+
+@app.route("/transcripts/<transcript_id>", methods=["GET"])
+def download_transcript(transcript_id):
+    # 逐字稿以 gzip 存放：瀏覽器接受 gzip 時直接回傳壓縮內容 (Content-Encoding: gzip)，不接受時才在伺服器端解壓縮
+    stored = transcript_store.fetch(transcript_id, url_expires_seconds=TRANSCRIPT_URL_EXPIRES_SECONDS)
+    if stored is None:
+        abort(404)
+    if stored.redirect_url:
+        return redirect(stored.redirect_url) # S3：由物件儲存直接提供內容
+    if stored.draft_path:
+        # 串流轉錄中的草稿會持續更新，不能快取
+        response = send_file(stored.draft_path, mimetype=TRANSCRIPT_CONTENT_TYPE, max_age=0)
+        response.headers["Cache-Control"] = "no-cache"
+        return response
+
+    if stored.sha256 in request.if_none_match:
+        response = Response(status=304)
+    elif request.accept_encodings.quality("gzip") > 0:
+        response = Response(stored.gzip_data, mimetype=TRANSCRIPT_CONTENT_TYPE)
+        response.headers["Content-Encoding"] = "gzip"
+    else:
+        response = Response(gzip.decompress(stored.gzip_data), mimetype=TRANSCRIPT_CONTENT_TYPE)
+    response.set_etag(stored.sha256)
+    response.headers["Vary"] = "Accept-Encoding"
+    response.headers["Cache-Control"] = "public, max-age=86400"
+    return response
+
+@app.route("/queue/stats", methods=["GET"])
+def queue_stats():
+    # 佇列深度、執行中工作數與排隊等待時間，方便觀察是否需要增加工作執行緒
+    return jsonify(get_queue_stats())
+
 @handler.add(MessageEvent, message=AudioMessageContent)
 def handle_audio_event(event): # 這個函數由 Line SDK 同步調用
     reply_token = event.reply_token
@@ -260,35 +657,27 @@ def handle_audio_event(event): # 這個函數由 Line SDK 同步調用
     message_id = event.message.id
 
     app.logger.info(f"Webhook 收到來自用戶 {user_id} 的音訊訊息，message_id: {message_id}。")
+    if is_duplicate_event(event):
+        return
 
-    # --- 步驟 1: 立即回覆「處理中」訊息 ---
-    try:
-        with ApiClient(configuration) as api_client:
-            ack_messaging_api = MessagingApi(api_client)
-            ack_messaging_api.reply_message(
-                ReplyMessageRequest(
-                    reply_token=reply_token,
-                    messages=[TextMessage(text="收到您的語音訊息，我正在努力分析中，請稍候片刻...⏳")]
-                )
-            )
-        app.logger.info(f"已向用戶 {user_id} 發送確認收到的回覆")
-    except Exception as e:
-        app.logger.error(f"發送確認回覆失敗 (用戶 {user_id}): {e}", exc_info=True)
-        # 即使這個即時回覆失敗了，我們還是要繼續處理後續的任務
-
-    # 準備傳遞給背景執行緒的資料
+    # 準備傳遞給背景工作的資料
     event_data = {
         "source": {"userId": user_id},
         "message": {"id": message_id, "type": event.message.type},
     }
-    
-    flask_app_context = current_app.app_context()
 
-    # --- 步驟 2: 創建並啟動背景執行緒來處理耗時任務 ---
-    thread = threading.Thread(target=process_audio_in_background, args=(event_data, flask_app_context))
-    thread.start()
-    
-    app.logger.info(f"已為 message_id {message_id} 啟動背景處理執行緒。Webhook 將立即返回 OK。")
+    # --- 步驟 1: 將耗時任務放入工作佇列 ---
+    try:
+        queue_depth = enqueue_event_job(event, event_data)
+        ack_text = "收到您的語音訊息，我正在努力分析中，請稍候片刻...⏳"
+        app.logger.info(f"已將 message_id {message_id} 放入工作佇列 (目前佇列深度: {queue_depth})。Webhook 將立即返回 OK。")
+    except QueueFullError as e:
+        ack_text = QUEUE_FULL_MESSAGE
+        app.logger.warning(f"工作佇列已滿，拒絕 message_id {message_id}: {e}")
+
+    # --- 步驟 2: 在背景回覆「處理中」(或「忙碌中」) 訊息 ---
+    # 即使這個回覆失敗了，佇列中的工作還是會繼續處理
+    reply_text_in_background(reply_token, ack_text, user_id, "確認收到的回覆")
     # handle_audio_event 函數到此結束並快速返回，讓 /callback 路由可以快速回應 LINE
 
 @handler.add(MessageEvent, message=FileMessageContent)
@@ -299,50 +688,43 @@ def handle_file_message(event):
     file_name = event.message.file_name
     file_size = event.message.file_size
     app.logger.info(f"Webhook 收到來自用戶 {user_id} 的【檔案訊息】: {file_name}, 大小: {file_size} bytes, message_id: {message_id}")
+    if is_duplicate_event(event):
+        return
 
     # 判斷是否為我們想處理的音訊檔案類型
     allowed_audio_extensions = ['.m4a', '.mp3', '.wav', '.aac', '.amr'] 
     is_audio_file = any(file_name.lower().endswith(ext) for ext in allowed_audio_extensions)
 
-    if is_audio_file:
+    if is_audio_file and file_size and file_size > MAX_AUDIO_FILE_BYTES:
+        app.logger.info(f"檔案 {file_name} 大小 {file_size} bytes 超過上限 {MAX_AUDIO_FILE_BYTES} bytes，不進行下載。")
+        reply_text_in_background(
+            reply_token, f"抱歉，您傳送的檔案 '{file_name}' 超過 {MAX_AUDIO_FILE_MB:.0f} MB 的上限，目前無法處理喔。",
+            user_id, "檔案過大訊息",
+        )
+    elif is_audio_file:
         app.logger.info(f"檔案 {file_name} 被識別為音訊檔案，準備進行處理。")
 
-        # --- 立即回覆「處理中」 ---
-        try:
-            with ApiClient(configuration) as api_client:
-                ack_messaging_api = MessagingApi(api_client)
-                ack_messaging_api.reply_message(
-                    ReplyMessageRequest(
-                        reply_token=reply_token,
-                        messages=[TextMessage(text=f"收到您的音訊檔案 '{file_name}'，我正在努力分析中，請稍候...⏳")]
-                    )
-                )
-            app.logger.info(f"已向用戶 {user_id} 發送檔案接收確認")
-        except Exception as e:
-            app.logger.error(f"發送檔案接收確認回覆失敗 (用戶 {user_id}): {e}", exc_info=True)
-
         # --- 準備背景處理 ---
         event_data = {
             "source": {"userId": user_id},
             "message": {"id": message_id, "type": "file", "fileName": file_name}, 
         }
-        flask_app_context = current_app.app_context() # 確保 current_app 已從 flask import
-        thread = threading.Thread(target=process_audio_in_background, args=(event_data, flask_app_context))
-        thread.start()
-        app.logger.info(f"已為檔案訊息 message_id {message_id} ({file_name}) 啟動背景處理執行緒。")
+        try:
+            queue_depth = enqueue_event_job(event, event_data)
+            ack_text = f"收到您的音訊檔案 '{file_name}'，我正在努力分析中，請稍候...⏳"
+            app.logger.info(f"已將檔案訊息 message_id {message_id} ({file_name}) 放入工作佇列 (目前佇列深度: {queue_depth})。")
+        except QueueFullError as e:
+            ack_text = QUEUE_FULL_MESSAGE
+            app.logger.warning(f"工作佇列已滿，拒絕檔案訊息 message_id {message_id} ({file_name}): {e}")
+
+        # --- 在背景回覆「處理中」(或「忙碌中」) ---
+        reply_text_in_background(reply_token, ack_text, user_id, "檔案接收確認")
     else:
         app.logger.info(f"檔案 {file_name} 不是支援的音訊格式，不進行處理。")
-        try:
-            with ApiClient(configuration) as api_client:
-                error_messaging_api = MessagingApi(api_client)
-                error_messaging_api.reply_message(
-                    ReplyMessageRequest(
-                        reply_token=reply_token,
-                        messages=[TextMessage(text=f"抱歉，我目前只支援處理 {', '.join(allowed_audio_extensions)} 這些音訊檔案格式喔。\n您傳送的是：{file_name}")]
-                    )
-                )
-        except Exception as e:
-            app.logger.error(f"回覆檔案類型不支援訊息失敗: {e}", exc_info=True)
+        reply_text_in_background(
+            reply_token, f"抱歉，我目前只支援處理 {', '.join(allowed_audio_extensions)} 這些音訊檔案格式喔。\n您傳送的是：{file_name}",
+            user_id, "檔案類型不支援訊息",
+        )
 
 
 if __name__ == "__main__":
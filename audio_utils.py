@@ -0,0 +1,345 @@
+import io
+import os
+import subprocess
+import tempfile
+import threading
+
+import numpy as np
+
+SAMPLE_RATE = 16000  # Whisper 使用的取樣率
+FRAME_SECONDS = 0.03  # 計算能量時每個 frame 的長度
+PIPE_READ_SIZE = 1024 * 1024
+# ffmpeg 超過這個秒數還沒結束就強制終止，避免損壞的檔案讓工作執行緒永遠卡住
+FFMPEG_TIMEOUT_SECONDS = float(os.getenv("FFMPEG_TIMEOUT_SECONDS", "600"))
+
+
+class AudioDecodeError(Exception):
+    """ffmpeg 無法解碼音訊時拋出。"""
+
+
+class AudioDecodeTimeout(AudioDecodeError):
+    """ffmpeg 超過 FFMPEG_TIMEOUT_SECONDS 仍未結束、被強制終止時拋出。"""
+
+
+def _ffmpeg_command(source, sample_rate):
+    # 直接輸出 float32 PCM，NumPy 可以零轉換地包裝結果
+    return [
+        "ffmpeg", "-loglevel", "error", "-threads", "0",
+        "-i", source,
+        "-f", "f32le", "-ac", "1", "-acodec", "pcm_f32le", "-ar", str(sample_rate),
+        "pipe:1",
+    ]
+
+
+def _run_ffmpeg(cmd, chunks=None, timeout=None) -> np.ndarray:
+    """
+    執行 ffmpeg 並把 stdout 讀進一個 bytearray，最後以 np.frombuffer 包裝成 float32 陣列（不再複製）。
+
+    stdin 與 stderr 各由一條執行緒處理：損壞的檔案可能讓 ffmpeg 對每個 frame 都輸出錯誤訊息，
+    stderr 若沒有同時讀取，塞滿管線緩衝區後 ffmpeg 與本程序會互相等待。
+
+    Args:
+        cmd: ffmpeg 指令。
+        chunks: 要從 stdin 餵給 ffmpeg 的 bytes 片段；None 表示 ffmpeg 自行讀檔。
+        timeout: 最多執行幾秒，超過時終止 ffmpeg 並拋出 AudioDecodeError；None 表示使用 FFMPEG_TIMEOUT_SECONDS。
+    """
+    proc = subprocess.Popen(
+        cmd,
+        stdin=subprocess.PIPE if chunks is not None else subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+
+    def feed_stdin():
+        # ffmpeg 可能在讀完之前就因格式錯誤結束，BrokenPipe 交給 returncode 判斷
+        try:
+            for chunk in chunks:
+                proc.stdin.write(chunk)
+        except (BrokenPipeError, OSError):
+            pass
+        finally:
+            try:
+                proc.stdin.close()
+            except (BrokenPipeError, OSError):
+                pass
+
+    stderr_blocks = []
+
+    def drain_stderr():
+        for block in iter(lambda: proc.stderr.read(PIPE_READ_SIZE), b""):
+            stderr_blocks.append(block)
+
+    threads = [threading.Thread(target=drain_stderr, daemon=True)]
+    if chunks is not None:
+        threads.append(threading.Thread(target=feed_stdin, daemon=True))
+    for thread in threads:
+        thread.start()
+    timed_out = threading.Event()
+
+    def kill():
+        timed_out.set()
+        proc.kill()
+
+    watchdog = threading.Timer(FFMPEG_TIMEOUT_SECONDS if timeout is None else timeout, kill)
+    watchdog.daemon = True
+    watchdog.start()
+    try:
+        pcm = bytearray()
+        while True:
+            block = proc.stdout.read(PIPE_READ_SIZE)
+            if not block:
+                break
+            pcm += block
+        proc.wait()
+    finally:
+        watchdog.cancel()
+    for thread in threads:
+        thread.join()
+
+    stderr = b"".join(stderr_blocks).decode("utf-8", errors="ignore").strip()
+    if timed_out.is_set():
+        raise AudioDecodeTimeout(f"ffmpeg 解碼逾時，已終止: {stderr[-1000:]}")
+    if proc.returncode != 0:
+        raise AudioDecodeError(f"ffmpeg 解碼失敗 (code {proc.returncode}): {stderr[-1000:]}")
+    usable = len(pcm) - len(pcm) % 4
+    return np.frombuffer(pcm, dtype=np.float32, count=usable // 4)
+
+
+def decode_audio_file(path: str, sample_rate: int = SAMPLE_RATE) -> np.ndarray:
+    """以 ffmpeg 將音訊檔案解碼成單聲道 float32 波形。"""
+    return _run_ffmpeg(_ffmpeg_command(path, sample_rate))
+
+
+def decode_audio_stream(chunks, sample_rate: int = SAMPLE_RATE) -> np.ndarray:
+    """將 bytes 片段依序經由 stdin 餵給 ffmpeg 解碼，不落地成檔案。"""
+    return _run_ffmpeg(_ffmpeg_command("pipe:0", sample_rate), chunks)
+
+
+def _iter_fileobj(fileobj):
+    while True:
+        block = fileobj.read(PIPE_READ_SIZE)
+        if not block:
+            return
+        yield block
+
+
+def _needs_random_access(fileobj) -> bool:
+    """
+    判斷 MP4/M4A 容器的 moov atom 是否在 mdat 之後（LINE 常見的 .m4a 上傳）。
+    這類檔案 ffmpeg 無法從管線解碼，直接改用暫存檔，不必先白跑一次管線解碼。
+    只讀取各個頂層 box 的標頭，不會讀入音訊內容。
+    """
+    offset = 0
+    while True:
+        fileobj.seek(offset)
+        header = fileobj.read(8)
+        if len(header) < 8:
+            return False
+        size = int.from_bytes(header[:4], "big")
+        box_type = header[4:8]
+        if offset == 0 and box_type != b"ftyp":
+            return False  # 不是 MP4 容器
+        if box_type == b"moov":
+            return False
+        if box_type == b"mdat":
+            return True
+        if size == 1:
+            extended = fileobj.read(8)
+            if len(extended) < 8:
+                return False
+            size = int.from_bytes(extended, "big")
+        if size < 8:
+            return False  # size 0 表示延伸到檔尾，或是損壞的標頭
+        offset += size
+
+
+def decode_audio_fileobj(fileobj, suffix: str = ".m4a", sample_rate: int = SAMPLE_RATE) -> np.ndarray:
+    """
+    將可讀取的檔案物件（例如下載時使用的 SpooledTemporaryFile）中的音訊解碼成單聲道 float32 波形。
+
+    優先透過 stdin 管線交給 ffmpeg；moov atom 在檔尾的 MP4/M4A 需要隨機存取，一開始就改用
+    寫入系統暫存目錄的暫存檔。其他格式從管線解碼失敗時，同樣退回暫存檔。
+
+    Args:
+        fileobj: 可 seek 的二進位檔案物件，會從開頭讀取。
+        suffix: 使用暫存檔時的副檔名，讓 ffmpeg 能辨識格式。
+    """
+    if not _needs_random_access(fileobj):
+        fileobj.seek(0)
+        try:
+            return decode_audio_stream(_iter_fileobj(fileobj), sample_rate)
+        except AudioDecodeTimeout:
+            raise  # 改用暫存檔也只會再等一次
+        except AudioDecodeError as e:
+            print(f"無法從管線解碼音訊，改用暫存檔: {e}")
+
+    fileobj.seek(0)
+    fd, temp_path = tempfile.mkstemp(prefix="linebot_audio_", suffix=suffix)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for block in _iter_fileobj(fileobj):
+                f.write(block)
+        return decode_audio_file(temp_path, sample_rate)
+    finally:
+        os.remove(temp_path)
+
+
+def decode_audio_bytes(data, suffix: str = ".m4a", sample_rate: int = SAMPLE_RATE) -> np.ndarray:
+    """將記憶體中的音訊內容 (bytes / bytearray / memoryview) 解碼成單聲道 float32 波形。"""
+    return decode_audio_fileobj(io.BytesIO(data), suffix, sample_rate)
+
+
+def frame_rms(audio: np.ndarray, frame_length: int) -> np.ndarray:
+    """
+    以向量化方式計算每個 frame 的 RMS 能量。
+
+    Args:
+        audio: 一維 float32 波形。
+        frame_length: 每個 frame 的取樣點數，最後不足一個 frame 的尾巴會被忽略。
+
+    Returns:
+        長度為 len(audio) // frame_length 的 RMS 陣列。
+    """
+    n_frames = len(audio) // frame_length
+    if n_frames == 0:
+        return np.zeros(0, dtype=np.float32)
+    frames = audio[:n_frames * frame_length].reshape(n_frames, frame_length)
+    return np.sqrt(np.mean(np.square(frames, dtype=np.float32), axis=1))
+
+
+def find_split_points(audio: np.ndarray, chunk_seconds: float, search_seconds: float = 5.0,
+                      sample_rate: int = SAMPLE_RATE) -> list:
+    """
+    找出把長音訊切成約 chunk_seconds 一段的切點，切點盡量落在安靜處，避免把一句話切成兩半。
+
+    每個理想切點 (chunk_seconds 的整數倍) 前後 search_seconds 範圍內，選能量最低的 frame 作為實際切點。
+
+    Returns:
+        切點的取樣位置 list，包含開頭 0 與結尾 len(audio)。
+    """
+    total = len(audio)
+    chunk_samples = int(chunk_seconds * sample_rate)
+    if total <= chunk_samples:
+        return [0, total]
+
+    frame_length = int(FRAME_SECONDS * sample_rate)
+    rms = frame_rms(audio, frame_length)
+    search_frames = int(search_seconds / FRAME_SECONDS)
+
+    points = [0]
+    target = chunk_samples
+    while target < total - chunk_samples // 4:
+        center = target // frame_length
+        lo = max(points[-1] // frame_length + 1, center - search_frames)
+        hi = min(len(rms), center + search_frames + 1)
+        if lo < hi:
+            split = (lo + int(np.argmin(rms[lo:hi]))) * frame_length
+        else:
+            split = target
+        points.append(split)
+        target = split + chunk_samples
+    points.append(total)
+    return points
+
+
+class SpeechTimeline:
+    """
+    去除靜音後的波形與原始錄音之間的時間對照。
+
+    去除靜音後的波形是由原始錄音中的多個語音區段依序接起來的，
+    to_original() 可以把在去除靜音後波形上的時間換算回原始錄音的時間。
+    """
+
+    def __init__(self, spans, total_samples: int, sample_rate: int = SAMPLE_RATE):
+        self.sample_rate = sample_rate
+        self.total_samples = total_samples
+        self.starts = np.array([s for s, _ in spans], dtype=np.int64)
+        lengths = np.array([e - s for s, e in spans], dtype=np.int64)
+        # offsets[i] 為第 i 個語音區段在去除靜音後波形中的起點
+        self.offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+
+    @property
+    def speech_seconds(self) -> float:
+        return float(self.offsets[-1]) / self.sample_rate
+
+    @property
+    def original_seconds(self) -> float:
+        return self.total_samples / self.sample_rate
+
+    def to_original(self, seconds):
+        """
+        把去除靜音後波形上的時間（秒，可為 NumPy 陣列）換算成原始錄音中的時間。
+        """
+        if len(self.starts) == 0:
+            return np.zeros_like(np.asarray(seconds, dtype=np.float64)) if np.ndim(seconds) else 0.0
+        samples = np.asarray(seconds, dtype=np.float64) * self.sample_rate
+        index = np.clip(np.searchsorted(self.offsets, samples, side="right") - 1, 0, len(self.starts) - 1)
+        original = (self.starts[index] + (samples - self.offsets[index])) / self.sample_rate
+        return original if np.ndim(original) else float(original)
+
+
+def detect_speech(audio: np.ndarray, min_silence_seconds: float = 1.0, padding_seconds: float = 0.2,
+                  min_speech_seconds: float = 0.25, margin_db: float = 12.0, floor_db: float = -55.0,
+                  sample_rate: int = SAMPLE_RATE) -> list:
+    """
+    以 frame 能量偵測語音區段。
+
+    門檻由錄音本身的背景噪音 (能量第 10 百分位) 加上 margin_db 決定，但不會高於峰值 30 dB 以內，
+    也不會低於 floor_db。短於 min_speech_seconds 的雜音會被忽略，語音區段前後各保留 padding_seconds，
+    只有長於 min_silence_seconds 的靜音才會被切掉。
+
+    Returns:
+        語音區段的 (起點, 終點) 取樣位置 list；整段都沒有語音時回傳空 list。
+    """
+    frame_length = int(FRAME_SECONDS * sample_rate)
+    rms = frame_rms(audio, frame_length)
+    if len(rms) == 0:
+        return []
+    db = 20 * np.log10(rms + 1e-10)
+    noise_floor, peak = np.percentile(db, [10, 99])
+    if peak < floor_db:
+        return []
+    threshold = max(floor_db, min(noise_floor + margin_db, peak - 30.0))
+    voiced = db > threshold
+
+    # 找出連續有聲 frame 的起訖
+    edges = np.flatnonzero(np.diff(np.concatenate([[0], voiced.astype(np.int8), [0]])))
+    starts, ends = edges[0::2], edges[1::2]
+    keep = (ends - starts) >= max(1, int(min_speech_seconds / FRAME_SECONDS))
+    starts, ends = starts[keep], ends[keep]
+    if len(starts) == 0:
+        return []
+
+    pad = int(padding_seconds / FRAME_SECONDS)
+    starts = np.maximum(starts - pad, 0)
+    ends = np.minimum(ends + pad, len(rms))
+    # 間隔太短的區段合併，只切掉夠長的靜音
+    gap_is_long = (starts[1:] - ends[:-1]) >= int(min_silence_seconds / FRAME_SECONDS)
+    starts = starts[np.concatenate([[True], gap_is_long])]
+    ends = ends[np.concatenate([gap_is_long, [True]])]
+
+    spans = [(int(s) * frame_length, int(e) * frame_length) for s, e in zip(starts, ends)]
+    if spans[-1][1] >= len(rms) * frame_length:
+        # 最後一個 frame 之後不足一個 frame 的尾巴也一併保留
+        spans[-1] = (spans[-1][0], len(audio))
+    return spans
+
+
+def trim_silence(audio: np.ndarray, sample_rate: int = SAMPLE_RATE, **kwargs):
+    """
+    只保留語音區段，把長時間的靜音去掉後接成一段較短的波形。
+
+    Args:
+        audio: 一維 float32 波形。
+        **kwargs: 傳給 detect_speech 的參數。
+
+    Returns:
+        (去除靜音後的波形, SpeechTimeline)；沒有語音時波形長度為 0。
+    """
+    spans = detect_speech(audio, sample_rate=sample_rate, **kwargs)
+    timeline = SpeechTimeline(spans, len(audio), sample_rate)
+    if len(spans) == 1 and spans[0] == (0, len(audio)):
+        return audio, timeline
+    if not spans:
+        return np.zeros(0, dtype=np.float32), timeline
+    return np.concatenate([audio[s:e] for s, e in spans]), timeline
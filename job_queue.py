@@ -0,0 +1,242 @@
+import threading
+import time
+from collections import OrderedDict, deque
+
+
+class QueueFullError(Exception):
+    """佇列已滿（或該用戶排隊的工作過多）時由 submit() 拋出。"""
+
+
+class RetryLater(Exception):
+    """
+    工作函式拋出此例外表示「現在還不能做，delay_seconds 秒後再排一次」，
+    例如 LINE 的內容還在準備中。等待期間不佔用工作執行緒。
+    """
+
+    def __init__(self, delay_seconds, reason=""):
+        super().__init__(reason or f"{delay_seconds:.1f} 秒後重試")
+        self.delay_seconds = delay_seconds
+
+
+class RecentIds:
+    """
+    在 ttl_seconds 內記住看過的 id，用來忽略重複送達（LINE 重送）的 webhook 事件。
+    最多保留 max_size 個，超過時從最舊的開始丟棄。
+    """
+
+    def __init__(self, ttl_seconds=3600, max_size=100000):
+        self.ttl_seconds = ttl_seconds
+        self.max_size = max(1, int(max_size))
+        self._lock = threading.Lock()
+        self._seen = OrderedDict()  # id -> 第一次看到的時間，依時間先後排序
+
+    def add(self, item_id):
+        """
+        記錄 item_id。
+
+        Returns:
+            第一次看到時回傳 True，ttl_seconds 內重複出現時回傳 False。
+        """
+        now = time.monotonic()
+        with self._lock:
+            while self._seen:
+                seen_at = next(iter(self._seen.values()))
+                if now - seen_at <= self.ttl_seconds and len(self._seen) < self.max_size:
+                    break
+                self._seen.popitem(last=False)
+            if item_id in self._seen:
+                return False
+            self._seen[item_id] = now
+            return True
+
+    def discard(self, item_id):
+        """忘記 item_id（例如事件最後沒有成功排入佇列），之後再出現時不會被當成重複。"""
+        with self._lock:
+            self._seen.pop(item_id, None)
+
+
+class _Job:
+    __slots__ = ("user_id", "func", "args", "kwargs", "enqueued_at", "dispatched")
+
+    def __init__(self, user_id, func, args, kwargs):
+        self.user_id = user_id
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.enqueued_at = time.monotonic()
+        self.dispatched = False  # 是否已經被工作執行緒取出過（RetryLater 重新排隊的工作為 True）
+
+
+class JobScheduler:
+    """
+    固定數量工作執行緒 + 有上限的工作佇列。
+
+    - 工作執行緒數量固定，避免每個 webhook 事件都開一條新執行緒去搶同一個 Whisper 模型。
+    - 佇列總長度與每位用戶的排隊數量都有上限，超過時 submit() 會拋出 QueueFullError，
+      讓呼叫端可以回覆用戶「目前忙碌中，請稍後再試」。
+    - 每位用戶各有一個佇列，工作執行緒以輪詢 (round-robin) 的方式從不同用戶取工作，
+      單一用戶一次丟很多檔案時不會餓死其他用戶。
+    """
+
+    def __init__(self, num_workers=1, max_queue_size=50, max_per_user=10, name="job"):
+        self.num_workers = max(1, int(num_workers))
+        self.max_queue_size = max(1, int(max_queue_size))
+        self.max_per_user = max(1, int(max_per_user))
+        self.name = name
+
+        self._cond = threading.Condition()
+        self._user_queues = OrderedDict()  # user_id -> deque[_Job]，順序即輪詢順序
+        self._queued = 0
+        self._active = 0
+        self._workers = []
+        self._shutdown = False
+
+        # 統計數據
+        self._submitted = 0
+        self._rejected = 0
+        self._retried = 0
+        self._delayed = 0  # 等待重新排隊中的工作數
+        self._completed = 0
+        self._failed = 0
+        # 排隊等待時間只計算工作第一次被取出前的等待；RetryLater 重新排隊後的等待另外記在 retry_wait
+        self._first_dispatches = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+        self._recent_waits = deque(maxlen=200)
+        self._retry_dispatches = 0
+        self._total_retry_wait = 0.0
+
+    def start(self):
+        with self._cond:
+            if self._workers:
+                return
+            for i in range(self.num_workers):
+                worker = threading.Thread(target=self._worker_loop, name=f"{self.name}-worker-{i}", daemon=True)
+                worker.start()
+                self._workers.append(worker)
+        print(f"[{self.name}] 已啟動 {self.num_workers} 個工作執行緒，佇列上限 {self.max_queue_size}，每位用戶上限 {self.max_per_user}")
+
+    def submit(self, user_id, func, *args, **kwargs):
+        """
+        將工作放入佇列。
+
+        Raises:
+            QueueFullError: 佇列總長度或該用戶的排隊數量已達上限。
+        """
+        with self._cond:
+            if self._shutdown:
+                raise RuntimeError("JobScheduler 已關閉")
+            user_queue = self._user_queues.get(user_id)
+            if self._queued >= self.max_queue_size:
+                self._rejected += 1
+                raise QueueFullError(f"佇列已滿 ({self._queued}/{self.max_queue_size})")
+            if user_queue is not None and len(user_queue) >= self.max_per_user:
+                self._rejected += 1
+                raise QueueFullError(f"用戶 {user_id} 排隊中的工作過多 ({len(user_queue)}/{self.max_per_user})")
+
+            if user_queue is None:
+                user_queue = deque()
+                self._user_queues[user_id] = user_queue
+            user_queue.append(_Job(user_id, func, args, kwargs))
+            self._queued += 1
+            self._submitted += 1
+            queue_depth = self._queued
+            self._cond.notify()
+        return queue_depth
+
+    def _requeue(self, job):
+        # 延遲重試的工作已經被接受過，不再受佇列上限限制
+        with self._cond:
+            self._delayed -= 1
+            if self._shutdown:
+                return
+            job.enqueued_at = time.monotonic()
+            self._user_queues.setdefault(job.user_id, deque()).append(job)
+            self._queued += 1
+            self._cond.notify()
+
+    def _next_job(self):
+        # 呼叫時必須持有 self._cond
+        user_id, user_queue = self._user_queues.popitem(last=False)
+        job = user_queue.popleft()
+        if user_queue:
+            # 該用戶還有工作，排到輪詢順序的最後面
+            self._user_queues[user_id] = user_queue
+        self._queued -= 1
+        return job
+
+    def _worker_loop(self):
+        while True:
+            with self._cond:
+                while not self._user_queues and not self._shutdown:
+                    self._cond.wait()
+                if self._shutdown and not self._user_queues:
+                    return
+                job = self._next_job()
+                wait_seconds = time.monotonic() - job.enqueued_at
+                self._active += 1
+                if job.dispatched:
+                    self._retry_dispatches += 1
+                    self._total_retry_wait += wait_seconds
+                else:
+                    job.dispatched = True
+                    self._first_dispatches += 1
+                    self._total_wait += wait_seconds
+                    self._max_wait = max(self._max_wait, wait_seconds)
+                    self._recent_waits.append(wait_seconds)
+
+            print(f"[{self.name}] 開始執行用戶 {job.user_id} 的工作，排隊等待 {wait_seconds:.1f} 秒")
+            failed = False
+            retried = False
+            try:
+                job.func(*job.args, **job.kwargs)
+            except RetryLater as e:
+                retried = True
+                print(f"[{self.name}] 用戶 {job.user_id} 的工作將在 {e.delay_seconds:.1f} 秒後重新排隊: {e}")
+                with self._cond:
+                    self._retried += 1
+                    self._delayed += 1
+                timer = threading.Timer(e.delay_seconds, self._requeue, args=(job,))
+                timer.daemon = True
+                timer.start()
+            except Exception as e:
+                failed = True
+                print(f"[{self.name}] 工作執行失敗 (用戶 {job.user_id}): {e}")
+            finally:
+                with self._cond:
+                    self._active -= 1
+                    if failed:
+                        self._failed += 1
+                    elif not retried:
+                        self._completed += 1
+
+    def stats(self):
+        """回傳目前佇列深度、執行中數量與等待時間等統計數據。"""
+        with self._cond:
+            recent = sorted(self._recent_waits)
+            return {
+                "workers": self.num_workers,
+                "queue_depth": self._queued,
+                "queued_users": len(self._user_queues),
+                "active": self._active,
+                "submitted": self._submitted,
+                "rejected": self._rejected,
+                "retried": self._retried,
+                "delayed": self._delayed,
+                "completed": self._completed,
+                "failed": self._failed,
+                "avg_wait_seconds": (self._total_wait / self._first_dispatches) if self._first_dispatches else 0.0,
+                "max_wait_seconds": self._max_wait,
+                "p95_recent_wait_seconds": recent[min(len(recent) - 1, int(len(recent) * 0.95))] if recent else 0.0,
+                "avg_retry_wait_seconds": (
+                    (self._total_retry_wait / self._retry_dispatches) if self._retry_dispatches else 0.0
+                ),
+            }
+
+    def shutdown(self, wait=True):
+        with self._cond:
+            self._shutdown = True
+            self._cond.notify_all()
+        if wait:
+            for worker in self._workers:
+                worker.join()
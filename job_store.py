@@ -0,0 +1,263 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from job_queue import QueueFullError
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    message_id  TEXT PRIMARY KEY,
+    user_id     TEXT NOT NULL,
+    payload     TEXT NOT NULL,
+    status      TEXT NOT NULL DEFAULT 'pending',
+    attempts    INTEGER NOT NULL DEFAULT 0,
+    created_at  REAL NOT NULL,
+    updated_at  REAL NOT NULL,
+    run_after   REAL NOT NULL DEFAULT 0,
+    lease_until REAL,
+    worker_id   TEXT,
+    last_error  TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, run_after, created_at);
+CREATE INDEX IF NOT EXISTS idx_jobs_user ON jobs (user_id, status);
+"""
+
+
+class StoredJob:
+    __slots__ = ("message_id", "user_id", "payload", "attempts", "created_at")
+
+    def __init__(self, message_id, user_id, payload, attempts, created_at):
+        self.message_id = message_id
+        self.user_id = user_id
+        self.payload = payload
+        self.attempts = attempts
+        self.created_at = created_at
+
+
+class JobStore:
+    """
+    以 SQLite 實作的持久化工作佇列，以 LINE message_id 作為主鍵。
+
+    - Web 程序只負責 enqueue()，Whisper 模型由獨立的 worker 程序 (worker.py) 載入並 claim() 工作。
+    - claim() 在 BEGIN IMMEDIATE 交易中完成，同一台主機上的多個 worker 程序可以安全地同時取工作。
+    - 每個被取走的工作都有租約 (lease)，worker 當機或重新部署後，租約過期的工作會由
+      requeue_stale() 放回佇列重試，超過 max_attempts 次則標記為 failed，並回傳給呼叫端通知用戶。
+      執行中的 worker 會以 heartbeat() 延長租約，因此租約可以設得比最長的轉錄時間短。
+    """
+
+    def __init__(self, db_path, lease_seconds=120, max_attempts=3):
+        self.db_path = db_path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._local = threading.local()
+
+        db_dir = os.path.dirname(os.path.abspath(db_path))
+        if not os.path.exists(db_dir):
+            os.makedirs(db_dir)
+        self._conn().executescript(_SCHEMA)
+
+    def _conn(self):
+        # sqlite3 連線不能跨執行緒共用，每條執行緒各自持有一個連線
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def enqueue(self, message_id, user_id, payload, max_pending=None, max_per_user=None):
+        """
+        新增一筆待處理工作。相同 message_id 的工作只會存在一筆（重複送達的事件會被忽略）。
+
+        Returns:
+            目前排隊中的工作數量。
+
+        Raises:
+            QueueFullError: 排隊中的工作總數或該用戶的排隊數量已達上限。
+        """
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            pending = conn.execute("SELECT COUNT(*) FROM jobs WHERE status = 'pending'").fetchone()[0]
+            # 重複送達的事件不會新增工作，不受上限影響，否則會誤回覆用戶佇列已滿
+            if conn.execute("SELECT 1 FROM jobs WHERE message_id = ?", (message_id,)).fetchone() is not None:
+                conn.execute("COMMIT")
+                print(f"[job_store] message_id {message_id} 已在工作佇列中，忽略重複的工作")
+                return pending
+            if max_pending is not None and pending >= max_pending:
+                raise QueueFullError(f"佇列已滿 ({pending}/{max_pending})")
+            if max_per_user is not None:
+                user_pending = conn.execute(
+                    "SELECT COUNT(*) FROM jobs WHERE user_id = ? AND status = 'pending'", (user_id,)
+                ).fetchone()[0]
+                if user_pending >= max_per_user:
+                    raise QueueFullError(f"用戶 {user_id} 排隊中的工作過多 ({user_pending}/{max_per_user})")
+            conn.execute(
+                "INSERT INTO jobs (message_id, user_id, payload, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+                (message_id, user_id, json.dumps(payload, ensure_ascii=False), now, now),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return pending + 1
+
+    def claim(self, worker_id):
+        """
+        取出下一筆可執行的工作並標記為 running。
+
+        為了公平，優先挑選目前執行中工作最少的用戶，同一順位再依建立時間先後。
+
+        Returns:
+            StoredJob，沒有可執行的工作時回傳 None。
+        """
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                """
+                SELECT j.message_id, j.user_id, j.payload, j.attempts, j.created_at
+                FROM jobs j
+                WHERE j.status = 'pending' AND j.run_after <= ?
+                ORDER BY (SELECT COUNT(*) FROM jobs r WHERE r.user_id = j.user_id AND r.status = 'running'),
+                         j.created_at
+                LIMIT 1
+                """,
+                (now,),
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1, worker_id = ?, lease_until = ?, updated_at = ? "
+                "WHERE message_id = ?",
+                (worker_id, now + self.lease_seconds, now, row[0]),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return StoredJob(row[0], row[1], json.loads(row[2]), row[3] + 1, row[4])
+
+    def heartbeat(self, message_id, worker_id):
+        """延長執行中工作的租約，長時間的轉錄工作需要定期呼叫。"""
+        now = time.time()
+        self._conn().execute(
+            "UPDATE jobs SET lease_until = ?, updated_at = ? WHERE message_id = ? AND worker_id = ? AND status = 'running'",
+            (now + self.lease_seconds, now, message_id, worker_id),
+        )
+
+    def complete(self, message_id):
+        self._conn().execute(
+            "UPDATE jobs SET status = 'done', lease_until = NULL, updated_at = ? WHERE message_id = ?",
+            (time.time(), message_id),
+        )
+
+    def fail(self, message_id, error, retry_delay=30):
+        """
+        記錄工作失敗；尚未超過 max_attempts 時延遲 retry_delay 秒後重新排隊。
+
+        Returns:
+            已超過重試次數、被標記為 failed 時回傳 True（呼叫端應通知用戶）。
+        """
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "UPDATE jobs SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+                "run_after = ?, lease_until = NULL, last_error = ?, updated_at = ? WHERE message_id = ?",
+                (self.max_attempts, now + retry_delay, str(error)[:1000], now, message_id),
+            )
+            row = conn.execute("SELECT status FROM jobs WHERE message_id = ?", (message_id,)).fetchone()
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return row is not None and row[0] == "failed"
+
+    def retry_later(self, message_id, delay_seconds, payload):
+        """
+        將工作延後 delay_seconds 秒重新排隊（例如 LINE 內容尚未準備好）。
+        這不算一次失敗，因此會把 claim() 時增加的 attempts 扣回來；payload 會一併更新（記錄下載嘗試次數）。
+        """
+        now = time.time()
+        self._conn().execute(
+            "UPDATE jobs SET status = 'pending', attempts = MAX(attempts - 1, 0), run_after = ?, payload = ?, "
+            "lease_until = NULL, worker_id = NULL, updated_at = ? WHERE message_id = ?",
+            (now + delay_seconds, json.dumps(payload, ensure_ascii=False), now, message_id),
+        )
+
+    def requeue_stale(self):
+        """
+        將租約已過期（worker 當機、重新部署）的 running 工作放回佇列，超過重試次數的標記為 failed。
+
+        Returns:
+            (重新排隊的數量, 這次被標記為失敗的 StoredJob list)；呼叫端應通知這些工作的用戶。
+        """
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = conn.execute(
+                "SELECT message_id, user_id, payload, attempts, created_at FROM jobs "
+                "WHERE status = 'running' AND lease_until < ? AND attempts >= ?",
+                (now, self.max_attempts),
+            ).fetchall()
+            conn.execute(
+                "UPDATE jobs SET status = 'failed', last_error = 'lease expired', lease_until = NULL, updated_at = ? "
+                "WHERE status = 'running' AND lease_until < ? AND attempts >= ?",
+                (now, now, self.max_attempts),
+            )
+            requeued = conn.execute(
+                "UPDATE jobs SET status = 'pending', lease_until = NULL, worker_id = NULL, updated_at = ? "
+                "WHERE status = 'running' AND lease_until < ?",
+                (now, now),
+            ).rowcount
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return requeued, [StoredJob(r[0], r[1], json.loads(r[2]), r[3], r[4]) for r in rows]
+
+    def running_worker_ids(self):
+        """回傳目前持有 running 工作的 worker_id。"""
+        return {row[0] for row in self._conn().execute(
+            "SELECT DISTINCT worker_id FROM jobs WHERE status = 'running' AND worker_id IS NOT NULL"
+        )}
+
+    def expire_leases(self, worker_id_prefix):
+        """
+        讓 worker_id 以 worker_id_prefix 開頭的 running 工作租約立即過期（已確定該 worker 不在執行），
+        下一次 requeue_stale() 就會處理這些工作，不必等到租約自然過期。
+
+        Returns:
+            受影響的工作數量。
+        """
+        return self._conn().execute(
+            "UPDATE jobs SET lease_until = 0 WHERE status = 'running' AND substr(worker_id, 1, ?) = ?",
+            (len(worker_id_prefix), worker_id_prefix),
+        ).rowcount
+
+    def purge_finished(self, older_than_seconds=7 * 24 * 3600):
+        """刪除已完成或已失敗且超過保留期限的工作紀錄。"""
+        return self._conn().execute(
+            "DELETE FROM jobs WHERE status IN ('done', 'failed') AND updated_at < ?",
+            (time.time() - older_than_seconds,),
+        ).rowcount
+
+    def stats(self):
+        counts = dict(self._conn().execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+        oldest = self._conn().execute("SELECT MIN(created_at) FROM jobs WHERE status = 'pending'").fetchone()[0]
+        return {
+            "queue_depth": counts.get("pending", 0),
+            "active": counts.get("running", 0),
+            "completed": counts.get("done", 0),
+            "failed": counts.get("failed", 0),
+            "oldest_pending_wait_seconds": (time.time() - oldest) if oldest else 0.0,
+        }
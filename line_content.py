@@ -0,0 +1,129 @@
+import hashlib
+import os
+import random
+import tempfile
+
+import requests
+
+# LINE 的訊息內容 (音訊/檔案) 由 api-data.line.me 提供，與一般 Messaging API 不同網域
+LINE_DATA_API_BASE_URL = os.getenv("LINE_DATA_API_BASE_URL", "https://api-data.line.me").rstrip('/')
+DOWNLOAD_CHUNK_BYTES = 64 * 1024
+DOWNLOAD_TIMEOUT = (10, 60)  # (連線, 每次讀取) 秒數
+SPOOL_MEMORY_BYTES = int(float(os.getenv("DOWNLOAD_SPOOL_MEMORY_MB", "16")) * 1024 * 1024)
+
+# 共用一個 Session，重複使用與 LINE 之間的 HTTPS 連線
+_session = requests.Session()
+
+
+class ContentNotReadyError(Exception):
+    """LINE 回傳 HTTP 202，內容仍在準備中（大檔案常見），應稍後再試。"""
+
+    def __init__(self, message_id):
+        super().__init__(f"message_id {message_id} 的內容尚未準備好 (HTTP 202)")
+        self.status = 202
+
+
+class ContentTooLargeError(Exception):
+    """內容超過允許的大小上限。"""
+
+    def __init__(self, size, max_bytes):
+        super().__init__(f"內容大小 {size} bytes 超過上限 {max_bytes} bytes")
+        self.size = size
+        self.max_bytes = max_bytes
+
+
+class ContentDownloadError(Exception):
+    """下載失敗。retryable 表示是否值得重試（連線錯誤、429、5xx）。"""
+
+    def __init__(self, message, status=None, retryable=False):
+        super().__init__(message)
+        self.status = status
+        self.retryable = retryable
+
+
+class DownloadedContent:
+    """
+    已下載的訊息內容。
+
+    內容寫在 SpooledTemporaryFile 中：小檔案留在記憶體，超過 SPOOL_MEMORY_BYTES 時才落地到系統暫存目錄。
+    下載時同步計算 SHA-256，不需要再讀一次內容。
+    """
+
+    def __init__(self, file, size, sha256):
+        self.file = file
+        self.size = size
+        self.sha256 = sha256
+
+    def close(self):
+        self.file.close()
+
+
+def jittered_backoff(attempt, base_seconds=2.0, max_seconds=60.0):
+    """指數退避加上全隨機抖動 (full jitter)，避免大量重試同時打到 LINE。"""
+    return random.uniform(base_seconds, min(max_seconds, base_seconds * (2 ** attempt)))
+
+
+def download_message_content(message_id, access_token, max_bytes=None):
+    """
+    以串流方式下載 LINE 訊息內容。
+
+    這個函式只做一次下載嘗試，不會在內部 sleep；是否稍後重試由呼叫端決定，
+    等待期間不會佔用工作執行緒。
+
+    Args:
+        message_id: LINE 訊息 ID。
+        access_token: Channel access token。
+        max_bytes: 允許的最大內容大小，None 表示不限制。超過時會在讀完之前就中止下載。
+
+    Returns:
+        DownloadedContent
+
+    Raises:
+        ContentNotReadyError: HTTP 202。
+        ContentTooLargeError: 內容超過 max_bytes。
+        ContentDownloadError: 其他下載錯誤。
+    """
+    url = f"{LINE_DATA_API_BASE_URL}/v2/bot/message/{message_id}/content"
+    try:
+        response = _session.get(
+            url,
+            headers={"Authorization": f"Bearer {access_token}"},
+            stream=True,
+            timeout=DOWNLOAD_TIMEOUT,
+        )
+    except requests.RequestException as e:
+        raise ContentDownloadError(f"連線 LINE 失敗: {e}", retryable=True) from e
+
+    with response:
+        if response.status_code == 202:
+            raise ContentNotReadyError(message_id)
+        if response.status_code != 200:
+            preview = response.text[:200]
+            retryable = response.status_code == 429 or response.status_code >= 500
+            raise ContentDownloadError(
+                f"HTTP {response.status_code}: {preview}", status=response.status_code, retryable=retryable
+            )
+
+        content_length = response.headers.get("Content-Length")
+        if max_bytes is not None and content_length and int(content_length) > max_bytes:
+            raise ContentTooLargeError(int(content_length), max_bytes)
+
+        spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MEMORY_BYTES, prefix="linebot_content_")
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_BYTES):
+                size += len(chunk)
+                if max_bytes is not None and size > max_bytes:
+                    raise ContentTooLargeError(size, max_bytes)
+                digest.update(chunk)
+                spool.write(chunk)
+        except requests.RequestException as e:
+            spool.close()
+            raise ContentDownloadError(f"下載中斷: {e}", retryable=True) from e
+        except Exception:
+            spool.close()
+            raise
+
+    spool.seek(0)
+    return DownloadedContent(spool, size, digest.hexdigest())
@@ -0,0 +1,226 @@
+"""
+簡單的程序內監控指標（計數器、量表、直方圖），以 Prometheus 文字格式輸出。
+
+    from metrics import stage_timer, JOBS
+    with stage_timer("decode"):
+        audio = load_audio(...)
+    JOBS.inc(result="success")
+
+app.py 的 /metrics 路由與 worker.py 的 --metrics-port 會輸出 render() 的結果。
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+# 處理階段耗時的直方圖區間（秒），從 webhook 回覆到長錄音轉錄都涵蓋
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+# 即時率 (處理秒數 / 音訊秒數) 的直方圖區間
+RTF_BUCKETS = (0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1, 1.5, 2, 5)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(label_names, label_values, extra=None):
+    pairs = list(zip(label_names, label_values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+class _Metric:
+    type_name = ""
+
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        if set(labels) != set(self.label_names):
+            raise ValueError(f"{self.name} 需要的標籤為 {self.label_names}，收到 {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def _samples(self):
+        with self._lock:
+            return [(self.name, key, None, value) for key, value in sorted(self._values.items())]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.type_name}"]
+        for name, key, extra, value in self._samples():
+            lines.append(f"{name}{_format_labels(self.label_names, key, extra)} {_format_value(value)}")
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    """只會增加的累計數值，例如處理過的工作數。"""
+
+    type_name = "counter"
+
+    def inc(self, amount=1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+
+class Gauge(_Metric):
+    """
+    可增可減的目前數值，例如佇列深度。
+
+    set_function() 可以指定一個在輸出時才呼叫的函式，適合直接讀取其他元件的即時狀態。
+    """
+
+    type_name = "gauge"
+
+    def __init__(self, name, help_text, label_names=()):
+        super().__init__(name, help_text, label_names)
+        self._function = None
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = float(value)
+
+    def inc(self, amount=1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount=1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, function):
+        self._function = function
+
+    def _samples(self):
+        if self._function is None:
+            return super()._samples()
+        try:
+            value = float(self._function())
+        except Exception as e:
+            print(f"[metrics] 讀取 {self.name} 失敗: {e}")
+            return []
+        return [(self.name, (), None, value)]
+
+
+class Histogram(_Metric):
+    """分布統計，輸出各區間的累計次數、總和與次數。"""
+
+    type_name = "histogram"
+
+    def __init__(self, name, help_text, label_names=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, label_names)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            counts = state[0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    def _samples(self):
+        samples = []
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    samples.append((f"{self.name}_bucket", key, ("le", _format_value(bound)), cumulative))
+                samples.append((f"{self.name}_sum", key, None, total))
+                samples.append((f"{self.name}_count", key, None, count))
+        return samples
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def _get_or_create(self, cls, name, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"指標 {name} 已以不同型別註冊")
+            return metric
+
+    def counter(self, name, help_text, label_names=()):
+        return self._get_or_create(Counter, name, help_text, label_names)
+
+    def gauge(self, name, help_text, label_names=()):
+        return self._get_or_create(Gauge, name, help_text, label_names)
+
+    def histogram(self, name, help_text, label_names=(), buckets=LATENCY_BUCKETS):
+        return self._get_or_create(Histogram, name, help_text, label_names, buckets=buckets)
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(m.render() for m in metrics) + "\n"
+
+
+REGISTRY = Registry()
+
+# --- 共用指標 ---
+STAGE_SECONDS = REGISTRY.histogram(
+    "linebot_stage_duration_seconds",
+    "各處理階段耗時 (webhook、ack、queue_wait、download、decode、whisper、transcript_write、gemini、push、total)",
+    ["stage"],
+)
+STAGE_ERRORS = REGISTRY.counter("linebot_stage_errors_total", "各處理階段發生錯誤的次數", ["stage"])
+JOBS = REGISTRY.counter("linebot_jobs_total", "處理完成的音訊工作數，依結果分類", ["result"])
+WEBHOOK_DUPLICATES = REGISTRY.counter("linebot_webhook_duplicate_events_total", "被忽略的重複 webhook 事件數 (LINE 重送)")
+AUDIO_SECONDS = REGISTRY.counter("linebot_audio_seconds_total", "已轉錄的音訊總秒數")
+REALTIME_FACTOR = REGISTRY.histogram(
+    "linebot_whisper_realtime_factor", "Whisper 轉錄的即時率 (處理秒數 / 音訊秒數)", buckets=RTF_BUCKETS
+)
+QUEUE_DEPTH = REGISTRY.gauge("linebot_queue_depth", "排隊中等待處理的工作數")
+ACTIVE_WORKERS = REGISTRY.gauge("linebot_active_workers", "正在處理工作的工作執行緒數")
+
+
+@contextmanager
+def stage_timer(stage):
+    """
+    記錄區塊的耗時到 STAGE_SECONDS；區塊拋出例外時同時累加 STAGE_ERRORS。
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_ERRORS.inc(stage=stage)
+        raise
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage=stage)
+
+
+def observe_stage(stage, seconds):
+    STAGE_SECONDS.observe(seconds, stage=stage)
+
+
+def record_error(stage):
+    STAGE_ERRORS.inc(stage=stage)
+
+
+def render():
+    """以 Prometheus 文字格式 (text/plain; version=0.0.4) 輸出所有指標。"""
+    return REGISTRY.render()
@@ -0,0 +1,169 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    cache_key           TEXT PRIMARY KEY,
+    transcript          TEXT NOT NULL,
+    summary             TEXT NOT NULL,
+    transcript_id       TEXT,
+    size_bytes          INTEGER NOT NULL,
+    created_at          REAL NOT NULL,
+    last_access         REAL NOT NULL,
+    hit_count           INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_results_last_access ON results (last_access);
+"""
+
+
+class CachedResult:
+    __slots__ = ("transcript", "summary", "transcript_id")
+
+    def __init__(self, transcript, summary, transcript_id):
+        self.transcript = transcript
+        self.summary = summary
+        self.transcript_id = transcript_id
+
+
+def make_cache_key(audio_sha256, model_name, prompt_version):
+    """
+    組合快取鍵：音訊內容的 SHA-256 + Whisper 模型名稱 + 摘要 prompt 版本。
+    換模型或改 prompt 時舊的快取自然不會再被命中。
+    """
+    raw = f"{audio_sha256}:{model_name}:{prompt_version}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """
+    以音訊內容雜湊為鍵的轉錄/摘要結果快取（SQLite）。
+
+    同一段語音被重複轉傳時直接回傳先前的逐字稿與摘要，不再跑 Whisper 與 Gemini。
+    超過 ttl_seconds 的項目會被淘汰；總大小超過 max_bytes 時從最久沒被使用的項目開始淘汰。
+    """
+
+    def __init__(self, db_path, max_bytes=200 * 1024 * 1024, ttl_seconds=30 * 24 * 3600):
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+        db_dir = os.path.dirname(os.path.abspath(db_path))
+        if not os.path.exists(db_dir):
+            os.makedirs(db_dir)
+        self._migrate()
+        self._conn().executescript(_SCHEMA)
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def _migrate(self):
+        """
+        舊版的 results 表以 transcript_filename 欄位記錄 static/transcripts 中的檔名，
+        逐字稿改存到 transcript_store 後存放的是 transcript_id：把欄位改名，並清掉舊版的檔名。
+        """
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(results)").fetchall()]
+            if "transcript_filename" in columns:
+                conn.execute("ALTER TABLE results RENAME COLUMN transcript_filename TO transcript_id")
+                # 舊版的檔名 (transcript_*.txt) 不是 transcript_id，命中時會以快取的逐字稿重新存一份
+                conn.execute("UPDATE results SET transcript_id = NULL WHERE transcript_id LIKE '%.txt'")
+                print(f"[result_cache] 已將 {self.db_path} 的 transcript_filename 欄位改名為 transcript_id")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def get(self, cache_key):
+        """
+        Returns:
+            CachedResult，沒有命中或已過期時回傳 None。
+        """
+        now = time.time()
+        conn = self._conn()
+        row = conn.execute(
+            "SELECT transcript, summary, transcript_id, created_at FROM results WHERE cache_key = ?",
+            (cache_key,),
+        ).fetchone()
+        if row is not None and now - row[3] > self.ttl_seconds:
+            conn.execute("DELETE FROM results WHERE cache_key = ?", (cache_key,))
+            row = None
+        with self._stats_lock:
+            if row is None:
+                self._misses += 1
+            else:
+                self._hits += 1
+        if row is None:
+            return None
+        conn.execute(
+            "UPDATE results SET last_access = ?, hit_count = hit_count + 1 WHERE cache_key = ?",
+            (now, cache_key),
+        )
+        return CachedResult(row[0], row[1], row[2])
+
+    def put(self, cache_key, transcript, summary, transcript_id=None):
+        now = time.time()
+        size_bytes = len(transcript.encode("utf-8")) + len(summary.encode("utf-8"))
+        self._conn().execute(
+            "INSERT OR REPLACE INTO results (cache_key, transcript, summary, transcript_id, size_bytes, created_at, last_access) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (cache_key, transcript, summary, transcript_id, size_bytes, now, now),
+        )
+        self.evict()
+
+    def evict(self):
+        """淘汰過期項目，並在總大小超過上限時依最久未使用的順序淘汰。回傳淘汰的筆數。"""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            removed = conn.execute(
+                "DELETE FROM results WHERE created_at < ?", (time.time() - self.ttl_seconds,)
+            ).rowcount
+            total = conn.execute("SELECT COALESCE(SUM(size_bytes), 0) FROM results").fetchone()[0]
+            if total > self.max_bytes:
+                for cache_key, size_bytes in conn.execute(
+                    "SELECT cache_key, size_bytes FROM results ORDER BY last_access"
+                ).fetchall():
+                    if total <= self.max_bytes:
+                        break
+                    conn.execute("DELETE FROM results WHERE cache_key = ?", (cache_key,))
+                    total -= size_bytes
+                    removed += 1
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        if removed:
+            with self._stats_lock:
+                self._evictions += removed
+        return removed
+
+    def stats(self):
+        entries, total = self._conn().execute(
+            "SELECT COUNT(*), COALESCE(SUM(size_bytes), 0) FROM results"
+        ).fetchone()
+        with self._stats_lock:
+            lookups = self._hits + self._misses
+            return {
+                "entries": entries,
+                "size_bytes": total,
+                "max_bytes": self.max_bytes,
+                "hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+                "hit_ratio": (self._hits / lookups) if lookups else 0.0,
+            }
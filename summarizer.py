@@ -1,39 +1,126 @@
 import os
+import re
+import threading
+import time
 from dotenv import load_dotenv
-import google.generativeai as genai
+from summarizer_service import SummarizerService, GeminiError
 
 # 載入 .env 檔案中的環境變數
 load_dotenv()
 
 # 從環境變數中取得 Gemini API 金鑰
+# 未設定時不在 import 時就中止程式，而是在第一次摘要時才回報錯誤，讓 Web 程序仍可啟動並接收 webhook
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 
-# 配置 Gemini API
-if not GEMINI_API_KEY:
-    raise ValueError("GEMINI_API_KEY environment variable not set. Please set it in your .env file.")
-genai.configure(api_key=GEMINI_API_KEY)
-
 # 初始化 Gemini 模型
 # 選擇適合摘要的模型，gemini-1.5-flash 速度快且費用相對低廉
 # 如果需要更高品質的摘要，可以嘗試 gemini-1.5-pro
 GEMINI_MODEL_NAME = "models/gemini-1.5-flash-latest"
-model = genai.GenerativeModel(GEMINI_MODEL_NAME)
 
-def summarize_text(text: str) -> str:
+# 所有摘要請求共用同一個非同步服務：共用連線池、依配額限流、429/5xx 自動重試、合併相同的進行中請求
+# 服務在第一次摘要時才由 get_service() 建立
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_service() -> SummarizerService:
     """
-    使用 Google Gemini API 對文本進行摘要，並根據要求進行處理。
+    取得共用的 SummarizerService，第一次呼叫時才建立。
 
-    Args:
-        text: 需要摘要的原始文本。
+    Raises:
+        ValueError: 未設定 GEMINI_API_KEY。
+    """
+    global _service
+    if _service is None:
+        with _service_lock:
+            if _service is None:
+                if not GEMINI_API_KEY:
+                    raise ValueError("GEMINI_API_KEY environment variable not set. Please set it in your .env file.")
+                _service = SummarizerService(GEMINI_API_KEY, GEMINI_MODEL_NAME)
+    return _service
 
-    Returns:
-        處理後的摘要文本。
+
+# 摘要 prompt 的版本，會成為結果快取鍵的一部分；修改下方 prompt 內容時請一併更新，讓舊快取失效
+PROMPT_VERSION = "v2"
+
+# --- 長逐字稿的分段摘要 (map-reduce) ---
+# 估計超過 SUMMARY_SINGLE_CALL_MAX_TOKENS 的逐字稿會依句子切成每段不超過 SUMMARY_CHUNK_TOKENS 的區塊，
+# 各區塊平行整理重點後，再合併成最後的摘要；較短的逐字稿維持單次呼叫
+SUMMARY_SINGLE_CALL_MAX_TOKENS = int(os.getenv("SUMMARY_SINGLE_CALL_MAX_TOKENS", "8000"))
+SUMMARY_CHUNK_TOKENS = int(os.getenv("SUMMARY_CHUNK_TOKENS", "6000"))
+SUMMARY_MAX_MAP_LEVELS = int(os.getenv("SUMMARY_MAX_MAP_LEVELS", "3"))  # 分段整理重點最多幾層，之後一律直接合併
+
+_CJK_CHAR = re.compile(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff]")
+_SENTENCE_END = re.compile(r"(?<=[。！？!?；;…\n])|(?<=\.)(?=\s)")
+
+
+class SummaryResult:
     """
-    if not text.strip():
-        return "嗯...您好像沒有提供內容喔，我無法進行摘要呢！🤔"
+    摘要結果。
+
+    Attributes:
+        status: "ok"、"empty"（沒有可摘要的內容，未呼叫 Gemini）或 "error"。
+        text: 摘要內容；status 不是 ok 時是可以直接顯示給用戶的說明。
+        retryable: 錯誤是否為暫時性（配額已滿、服務暫時無法使用），稍後重試可能成功。
+        rate_limited: 是否因 Gemini 配額限制而失敗。
+        chunks: 分段摘要時的區塊數，單次呼叫為 1。
+        elapsed_seconds: 摘要耗時（秒）。
+        error: 原始的錯誤訊息。
+    """
+
+    __slots__ = ("status", "text", "retryable", "rate_limited", "chunks", "elapsed_seconds", "error")
 
+    def __init__(self, status, text="", retryable=False, rate_limited=False, chunks=0, elapsed_seconds=0.0, error=None):
+        self.status = status
+        self.text = text
+        self.retryable = retryable
+        self.rate_limited = rate_limited
+        self.chunks = chunks
+        self.elapsed_seconds = elapsed_seconds
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.status == "ok"
+
+
+def estimate_tokens(text: str) -> int:
+    """粗估 token 數：中日韓文字約一字一個 token，其他文字約四個字元一個 token。"""
+    cjk = len(_CJK_CHAR.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def split_into_chunks(text: str, max_tokens: int = SUMMARY_CHUNK_TOKENS) -> list:
+    """
+    依句子邊界把文字切成多個區塊，每個區塊估計不超過 max_tokens。
+    單一句子本身就超過上限時（例如沒有標點的轉錄結果），才會在句子中間硬切。
+    """
+    chunks, current, current_tokens = [], [], 0
+    for sentence in _SENTENCE_END.split(text):
+        if not sentence:
+            continue
+        tokens = estimate_tokens(sentence)
+        if tokens > max_tokens:
+            # 依比例換算成字元數硬切
+            step = max(1, len(sentence) * max_tokens // tokens)
+            pieces = [sentence[i:i + step] for i in range(0, len(sentence), step)]
+        else:
+            pieces = [sentence]
+        for piece in pieces:
+            piece_tokens = estimate_tokens(piece)
+            if current and current_tokens + piece_tokens > max_tokens:
+                chunks.append("".join(current).strip())
+                current, current_tokens = [], 0
+            current.append(piece)
+            current_tokens += piece_tokens
+    if current:
+        chunks.append("".join(current).strip())
+    return [c for c in chunks if c]
+
+def build_prompt(text: str) -> str:
+    """組出摘要用的提示語 (prompt)。修改內容時請一併更新 PROMPT_VERSION。"""
     # 設計一個更詳細、更友善的提示語 (prompt)
-    prompt = f"""你好呀！我是一個聰明又樂於助人的 AI 小助手 🤖。請你幫我分析一下這段從語音轉錄過來的文字：
+    return f"""你好呀！我是一個聰明又樂於助人的 AI 小助手 🤖。請你幫我分析一下這段從語音轉錄過來的文字：
 
     '''
     {text}
@@ -53,25 +140,117 @@ def summarize_text(text: str) -> str:
 
     請用親切友善幽默的語氣呈現結果，謝謝你啦！😊
     """
+
+def build_map_prompt(chunk: str, index: int, total: int) -> str:
+    """分段摘要 (map) 用的提示語：整理單一區塊的重點，供最後合併使用。"""
+    return f"""以下是一段很長的語音轉錄文字中的第 {index}/{total} 段：
+
+    '''
+    {chunk}
+    '''
+
+    請用繁體中文把這一段的重點條列整理出來（約 150~300 字），保留人名、數字、日期、決議與待辦事項等關鍵資訊，
+    不需要開場白或結語。第一行請寫出這段文字最可能的原始語言，格式為「原始語言：英文」。
+    輸出請使用純文字 (plain text)，不要包含任何 Markdown 格式的標記。
+    """
+
+def build_reduce_prompt(partial_summaries: list) -> str:
+    """合併 (reduce) 用的提示語：把各段重點整理成與單次摘要相同格式的最終結果。"""
+    notes = "\n\n".join(f"【第 {i} 段重點】\n{s}" for i, s in enumerate(partial_summaries, 1))
+    return f"""你好呀！我是一個聰明又樂於助人的 AI 小助手 🤖。下面是一段很長的語音轉錄文字，已經依序分段整理出的重點筆記：
+
+    '''
+    {notes}
+    '''
+
+    請你根據這些筆記，按照下面的步驟來幫我整理：
+
+    1.  語言判斷：根據各段標示的原始語言，用繁體中文告訴我這段語音最可能是用哪一種語言說的，例如：「這段語音的原始語言聽起來像是：英文」。
+
+    3.  重點摘要 (繁體中文)：
+        請把整段內容整理成一個簡潔的重點大綱或摘要。
+        目標是讓我能快速抓住核心資訊，所以請幫我把重點條理分明地列出來，或者用一段流暢的話總結。
+        摘要的長度請盡量控制在 100~200 字左右就好。
+        為了讓內容看起來更活潑，可以在摘要中穿插 1 到 2 個相關的表情符號 (emoji) 喔！😉
+        輸出格式：請確保最終的摘要是純文字 (plain text)，不要包含任何 Markdown 格式的標記 (例如 `*`、`#`、`-`、`[]()` 等)，讓輸出看起來乾淨整潔。
+
+
+    請用親切友善幽默的語氣呈現結果，謝謝你啦！😊
+    """
+
+def _summarize_map_reduce(chunks: list) -> str:
+    """
+    長逐字稿的階層式摘要：平行整理各塊（split_into_chunks 的結果）重點；若各塊重點合起來仍然太長，
+    就把重點再切塊整理一層，最後以 build_reduce_prompt 產生最終摘要。
+
+    最多整理 SUMMARY_MAX_MAP_LEVELS 層；某一層的重點沒有比輸入更短時（模型沒有收斂）也不再往下整理，
+    直接以這一層的重點做最後的合併，避免無止盡地消耗配額。
+    """
+    service = get_service()
+    input_tokens = sum(estimate_tokens(chunk) for chunk in chunks)
+    level = 0
+    while True:
+        level += 1
+        print(f"長文摘要：第 {level} 層，共 {len(chunks)} 段平行整理")
+        prompts = [build_map_prompt(chunk, i, len(chunks)) for i, chunk in enumerate(chunks, 1)]
+        partials = [p.strip() for p in service.gather_sync(prompts)]
+        layer_text = "\n\n".join(partials)
+        layer_tokens = estimate_tokens(layer_text)
+        if len(partials) == 1 or layer_tokens <= SUMMARY_SINGLE_CALL_MAX_TOKENS:
+            break
+        if layer_tokens >= input_tokens:
+            print(f"長文摘要：第 {level} 層的重點 ({layer_tokens} tokens) 沒有比輸入 ({input_tokens} tokens) 短，直接合併")
+            break
+        if level >= SUMMARY_MAX_MAP_LEVELS:
+            print(f"長文摘要：已整理 {level} 層，重點仍有 {layer_tokens} tokens，直接合併")
+            break
+        input_tokens = layer_tokens
+        chunks = split_into_chunks(layer_text, SUMMARY_CHUNK_TOKENS)
+    return service.generate_sync(build_reduce_prompt(partials))
+
+def summarize_text(text: str) -> SummaryResult:
+    """
+    使用 Google Gemini API 對文本進行摘要，並根據要求進行處理。
+
+    Args:
+        text: 需要摘要的原始文本。
+
+    Returns:
+        SummaryResult；失敗時 text 為給用戶看的說明，不會拋出例外。
+    """
+    if not text.strip():
+        return SummaryResult("empty", "嗯...您好像沒有提供內容喔，我無法進行摘要呢！🤔")
+
+    start_time = time.time()
+    chunks = 1
     try:
-        response = model.generate_content(prompt,
-                                          safety_settings={'HARASSMENT': 'BLOCK_NONE',
-                                                           'HATE': 'BLOCK_NONE',
-                                                           'SEXUAL': 'BLOCK_NONE',
-                                                           'DANGEROUS': 'BLOCK_NONE'})
-        
-        # 檢查是否有回應內容
-        if response.candidates and response.candidates[0].content.parts:
-            summary = response.candidates[0].content.parts[0].text
-            return summary.strip()
+        if estimate_tokens(text) <= SUMMARY_SINGLE_CALL_MAX_TOKENS:
+            summary = get_service().generate_sync(build_prompt(text))
         else:
-            # 如果沒有候選，可能發生了內容過濾或其他問題
-            print(f"Gemini API 沒有產生回應，可能的原因：{response.prompt_feedback}")
-            return "哎呀，我好像有點轉不過來，摘要服務暫時無法提供，請稍後再試試看。😥"
+            text_chunks = split_into_chunks(text, SUMMARY_CHUNK_TOKENS)
+            chunks = len(text_chunks)
+            summary = _summarize_map_reduce(text_chunks)
+        return SummaryResult("ok", summary.strip(), chunks=chunks, elapsed_seconds=time.time() - start_time)
 
+    except GeminiError as e:
+        elapsed = time.time() - start_time
+        if e.rate_limited:
+            # 重試多次後仍然超過配額
+            print(f"Gemini API 配額已滿，重試後仍失敗: {e}")
+            return SummaryResult("error", "目前使用的人有點多，摘要服務暫時無法提供，請稍後再試試看。⏳",
+                                 retryable=True, rate_limited=True, chunks=chunks, elapsed_seconds=elapsed, error=str(e))
+        if not e.retryable and e.status is None:
+            # 如果沒有候選，可能發生了內容過濾或其他問題
+            print(f"Gemini API 沒有產生回應: {e}")
+            return SummaryResult("error", "哎呀，我好像有點轉不過來，摘要服務暫時無法提供，請稍後再試試看。😥",
+                                 chunks=chunks, elapsed_seconds=elapsed, error=str(e))
+        print(f"調用 Gemini API 時發生錯誤: {e}")
+        return SummaryResult("error", "糟糕！摘要服務好像出了點小問題，麻煩稍後再試一次，或聯絡管理員喔。🛠️",
+                             retryable=e.retryable, chunks=chunks, elapsed_seconds=elapsed, error=str(e))
     except Exception as e:
         print(f"調用 Gemini API 時發生錯誤: {e}")
-        return "糟糕！摘要服務好像出了點小問題，麻煩稍後再試一次，或聯絡管理員喔。🛠️"
+        return SummaryResult("error", "糟糕！摘要服務好像出了點小問題，麻煩稍後再試一次，或聯絡管理員喔。🛠️",
+                             chunks=chunks, elapsed_seconds=time.time() - start_time, error=str(e))
 
 # 測試用 (可選)
 if __name__ == "__main__":
@@ -82,10 +261,10 @@ if __name__ == "__main__":
     test_text_empty = ""
 
     print(f"原始文本 (短): {test_text_short}")
-    print(f"摘要 (短): {summarize_text(test_text_short)}\n")
+    print(f"摘要 (短): {summarize_text(test_text_short).text}\n")
 
     print(f"原始文本 (長): {test_text_long}")
-    print(f"摘要 (長): {summarize_text(test_text_long)}\n")
+    print(f"摘要 (長): {summarize_text(test_text_long).text}\n")
 
     print(f"原始文本 (空): {test_text_empty}")
-    print(f"摘要 (空): {summarize_text(test_text_empty)}\n")
\ No newline at end of file
+    print(f"摘要 (空): {summarize_text(test_text_empty).text}\n")
\ No newline at end of file
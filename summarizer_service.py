@@ -0,0 +1,261 @@
+import asyncio
+import hashlib
+import os
+import random
+import threading
+import time
+
+import aiohttp
+
+# 可以指向本機的 tools/fake_gemini.py 做離線測試
+GEMINI_API_BASE_URL = os.getenv("GEMINI_API_BASE_URL", "https://generativelanguage.googleapis.com").rstrip('/')
+GEMINI_REQUESTS_PER_MINUTE = float(os.getenv("GEMINI_REQUESTS_PER_MINUTE", "15"))  # 依 Gemini 配額設定
+GEMINI_BURST = int(os.getenv("GEMINI_BURST", "3"))
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "4"))
+GEMINI_MAX_RETRIES = int(os.getenv("GEMINI_MAX_RETRIES", "4"))
+GEMINI_TIMEOUT_SECONDS = float(os.getenv("GEMINI_TIMEOUT_SECONDS", "120"))
+
+SAFETY_SETTINGS = [
+    {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_NONE"},
+    {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_NONE"},
+    {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_NONE"},
+    {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_NONE"},
+]
+
+
+class GeminiError(Exception):
+    """
+    Gemini 呼叫失敗。
+
+    Attributes:
+        status: HTTP 狀態碼，連線錯誤時為 None。
+        retryable: 是否為暫時性錯誤（429、5xx、連線錯誤）。
+        rate_limited: 是否為 429 配額限制。
+    """
+
+    def __init__(self, message, status=None, retryable=False, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.retryable = retryable
+        self.retry_after = retry_after
+
+    @property
+    def rate_limited(self):
+        return self.status == 429
+
+
+class TokenBucket:
+    """
+    權杖桶限流器：平均每秒補充 rate 個權杖，最多累積 capacity 個。
+
+    收到 429 時可以呼叫 pause() 讓所有呼叫端一起暫停，避免繼續撞配額。
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = max(1, capacity)
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def pause(self, seconds):
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0.0
+
+
+class SummarizerService:
+    """
+    以 asyncio 實作的 Gemini 呼叫服務，在自己的背景執行緒中跑 event loop。
+
+    - 所有請求共用一個 aiohttp.ClientSession（連線池）。
+    - 以 TokenBucket 控制每分鐘請求數，以 Semaphore 控制同時進行中的請求數。
+    - 429 / 5xx / 連線錯誤以指數退避 + 抖動重試，429 時遵守 Retry-After 並暫停整個限流器。
+    - 內容完全相同、且仍在進行中的請求會合併成一次呼叫，共用同一個結果。
+
+    同步程式碼（例如工作執行緒）可以透過 generate_sync() 呼叫。
+    """
+
+    def __init__(self, api_key, model_name, base_url=GEMINI_API_BASE_URL,
+                 requests_per_minute=GEMINI_REQUESTS_PER_MINUTE, burst=GEMINI_BURST,
+                 max_concurrency=GEMINI_MAX_CONCURRENCY, max_retries=GEMINI_MAX_RETRIES,
+                 timeout_seconds=GEMINI_TIMEOUT_SECONDS):
+        self.api_key = api_key
+        self.model_name = model_name if model_name.startswith("models/") else f"models/{model_name}"
+        self.base_url = base_url.rstrip('/')
+        self.requests_per_minute = requests_per_minute
+        self.burst = burst
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.timeout_seconds = timeout_seconds
+
+        self._loop = None
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._session = None
+        self._bucket = None
+        self._semaphore = None
+        self._inflight = {}  # prompt 雜湊 -> asyncio.Future
+
+        # 統計數據
+        self.calls = 0
+        self.coalesced = 0
+        self.retries = 0
+        self.rate_limited = 0
+
+    # --- event loop 管理 ---
+
+    def _ensure_started(self):
+        with self._start_lock:
+            if self._loop is not None:
+                return
+            ready = threading.Event()
+
+            def run():
+                self._loop = asyncio.new_event_loop()
+                asyncio.set_event_loop(self._loop)
+                self._bucket = TokenBucket(self.requests_per_minute / 60.0, self.burst)
+                self._semaphore = asyncio.Semaphore(self.max_concurrency)
+                ready.set()
+                self._loop.run_forever()
+
+            self._thread = threading.Thread(target=run, name="summarizer-loop", daemon=True)
+            self._thread.start()
+            ready.wait()
+
+    def generate_sync(self, prompt, timeout=None):
+        """在呼叫端的執行緒中同步等待 generate() 的結果。"""
+        self._ensure_started()
+        future = asyncio.run_coroutine_threadsafe(self.generate(prompt), self._loop)
+        return future.result(timeout)
+
+    def gather_sync(self, prompts, timeout=None):
+        """同時送出多個 prompt 並依序回傳結果（仍受限流與同時請求數限制）。"""
+        self._ensure_started()
+
+        async def run_all():
+            return await asyncio.gather(*(self.generate(p) for p in prompts))
+
+        return asyncio.run_coroutine_threadsafe(run_all(), self._loop).result(timeout)
+
+    def close(self):
+        if self._loop is None:
+            return
+        if self._session is not None:
+            asyncio.run_coroutine_threadsafe(self._session.close(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop = None
+
+    # --- 非同步 API ---
+
+    async def _get_session(self):
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                timeout=aiohttp.ClientTimeout(total=self.timeout_seconds),
+                connector=aiohttp.TCPConnector(limit=self.max_concurrency),
+            )
+        return self._session
+
+    async def generate(self, prompt):
+        """
+        送出 prompt 並回傳 Gemini 產生的文字；相同內容的進行中請求會共用結果。
+
+        Raises:
+            GeminiError: 重試用盡或遇到不可重試的錯誤。
+        """
+        key = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self.coalesced += 1
+            return await asyncio.shield(inflight)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            result = await self._generate_with_retry(prompt)
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # 沒有其他人在等時避免 "exception was never retrieved" 警告
+            future.exception()
+            raise
+        finally:
+            del self._inflight[key]
+
+    async def _generate_with_retry(self, prompt):
+        attempt = 0
+        while True:
+            try:
+                async with self._semaphore:
+                    await self._bucket.acquire()
+                    return await self._call(prompt)
+            except GeminiError as e:
+                if e.rate_limited:
+                    self.rate_limited += 1
+                if not e.retryable or attempt >= self.max_retries:
+                    raise
+                delay = e.retry_after if e.retry_after else random.uniform(1, min(60, 2 ** (attempt + 1)))
+                if e.rate_limited:
+                    self._bucket.pause(delay)
+                attempt += 1
+                self.retries += 1
+                print(f"Gemini 呼叫失敗 ({e})，{delay:.1f} 秒後進行第 {attempt} 次重試")
+                await asyncio.sleep(delay)
+
+    async def _call(self, prompt):
+        self.calls += 1
+        url = f"{self.base_url}/v1beta/{self.model_name}:generateContent"
+        body = {
+            "contents": [{"role": "user", "parts": [{"text": prompt}]}],
+            "safetySettings": SAFETY_SETTINGS,
+        }
+        session = await self._get_session()
+        try:
+            async with session.post(url, params={"key": self.api_key}, json=body) as response:
+                if response.status != 200:
+                    text = await response.text()
+                    retry_after = response.headers.get("Retry-After")
+                    raise GeminiError(
+                        f"HTTP {response.status}: {text[:200]}",
+                        status=response.status,
+                        retryable=response.status == 429 or response.status >= 500,
+                        retry_after=float(retry_after) if retry_after and retry_after.isdigit() else None,
+                    )
+                data = await response.json()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise GeminiError(f"連線 Gemini 失敗: {e!r}", retryable=True) from e
+
+        candidates = data.get("candidates") or []
+        parts = candidates[0].get("content", {}).get("parts", []) if candidates else []
+        if not parts:
+            # 沒有候選內容，通常是被內容過濾擋下，重試也沒有用
+            raise GeminiError(f"Gemini API 沒有產生回應：{data.get('promptFeedback')}")
+        return "".join(part.get("text", "") for part in parts)
+
+    def stats(self):
+        return {
+            "calls": self.calls,
+            "coalesced": self.coalesced,
+            "retries": self.retries,
+            "rate_limited": self.rate_limited,
+            "inflight": len(self._inflight),
+        }
@@ -0,0 +1,137 @@
+import io
+import sys
+
+import numpy as np
+import pytest
+
+import audio_utils
+from audio_utils import AudioDecodeError, AudioDecodeTimeout
+
+
+def _box(box_type, payload=b""):
+    return (8 + len(payload)).to_bytes(4, "big") + box_type + payload
+
+
+def test_run_ffmpeg_drains_large_stderr_before_stdout():
+    # 先寫 200 KB 到 stderr（超過管線緩衝區）才輸出 PCM；沒有同時讀 stderr 時兩邊會互相等待
+    script = (
+        "import sys\n"
+        "sys.stderr.write('x' * 200000)\n"
+        "sys.stderr.flush()\n"
+        "sys.stdout.buffer.write(b'\\x00' * 16)\n"
+    )
+    audio = audio_utils._run_ffmpeg([sys.executable, "-c", script], timeout=30)
+    assert audio.dtype == np.float32
+    assert len(audio) == 4
+
+
+def test_run_ffmpeg_feeds_stdin_chunks():
+    script = "import sys\nsys.stdout.buffer.write(sys.stdin.buffer.read())\n"
+    samples = np.arange(6, dtype=np.float32)
+    chunks = [samples[:3].tobytes(), samples[3:].tobytes()]
+    audio = audio_utils._run_ffmpeg([sys.executable, "-c", script], chunks, timeout=30)
+    np.testing.assert_array_equal(audio, samples)
+
+
+def test_run_ffmpeg_reports_failure_with_stderr():
+    script = "import sys\nsys.stderr.write('bad frame')\nsys.exit(3)\n"
+    with pytest.raises(AudioDecodeError, match="bad frame"):
+        audio_utils._run_ffmpeg([sys.executable, "-c", script], timeout=30)
+
+
+def test_run_ffmpeg_kills_hung_process():
+    with pytest.raises(AudioDecodeTimeout):
+        audio_utils._run_ffmpeg([sys.executable, "-c", "import time\ntime.sleep(60)\n"], timeout=0.5)
+
+
+def test_needs_random_access_detects_moov_after_mdat():
+    moov_at_end = _box(b"ftyp", b"M4A \x00\x00\x00\x00") + _box(b"mdat", b"\x00" * 64) + _box(b"moov", b"\x00" * 8)
+    moov_first = _box(b"ftyp", b"M4A \x00\x00\x00\x00") + _box(b"moov", b"\x00" * 8) + _box(b"mdat", b"\x00" * 64)
+    assert audio_utils._needs_random_access(io.BytesIO(moov_at_end))
+    assert not audio_utils._needs_random_access(io.BytesIO(moov_first))
+    assert not audio_utils._needs_random_access(io.BytesIO(b"#!AMR\n" + b"\x00" * 32))
+    assert not audio_utils._needs_random_access(io.BytesIO(b""))
+
+
+def test_decode_fileobj_uses_temp_file_directly_for_moov_at_end(monkeypatch):
+    calls = []
+    monkeypatch.setattr(audio_utils, "decode_audio_stream", lambda chunks, rate: calls.append("pipe"))
+    monkeypatch.setattr(audio_utils, "decode_audio_file",
+                        lambda path, rate: calls.append("file") or np.zeros(1, dtype=np.float32))
+    data = _box(b"ftyp", b"M4A \x00\x00\x00\x00") + _box(b"mdat", b"\x00" * 64) + _box(b"moov")
+    audio_utils.decode_audio_bytes(data)
+    assert calls == ["file"]
+
+
+def test_decode_fileobj_falls_back_to_temp_file_after_pipe_error(monkeypatch):
+    calls = []
+
+    def failing_stream(chunks, rate):
+        calls.append("pipe")
+        raise AudioDecodeError("pipe not supported")
+
+    monkeypatch.setattr(audio_utils, "decode_audio_stream", failing_stream)
+    monkeypatch.setattr(audio_utils, "decode_audio_file",
+                        lambda path, rate: calls.append("file") or np.zeros(1, dtype=np.float32))
+    audio_utils.decode_audio_bytes(b"RIFF" + b"\x00" * 40, suffix=".wav")
+    assert calls == ["pipe", "file"]
+
+
+def test_decode_fileobj_does_not_retry_after_timeout(monkeypatch):
+    def hung_stream(chunks, rate):
+        raise AudioDecodeTimeout("timed out")
+
+    monkeypatch.setattr(audio_utils, "decode_audio_stream", hung_stream)
+    monkeypatch.setattr(audio_utils, "decode_audio_file", lambda path, rate: pytest.fail("不應再以暫存檔重試"))
+    with pytest.raises(AudioDecodeTimeout):
+        audio_utils.decode_audio_bytes(b"RIFF" + b"\x00" * 40, suffix=".wav")
+
+
+def _tone(seconds, amplitude=0.3):
+    t = np.arange(int(seconds * audio_utils.SAMPLE_RATE)) / audio_utils.SAMPLE_RATE
+    return (amplitude * np.sin(2 * np.pi * 220 * t)).astype(np.float32)
+
+
+def _silence(seconds):
+    rng = np.random.default_rng(0)
+    return (rng.standard_normal(int(seconds * audio_utils.SAMPLE_RATE)) * 1e-4).astype(np.float32)
+
+
+def test_speech_timeline_maps_back_to_original_time():
+    rate = audio_utils.SAMPLE_RATE
+    timeline = audio_utils.SpeechTimeline([(1 * rate, 2 * rate), (5 * rate, 6 * rate)], 8 * rate)
+    assert timeline.speech_seconds == 2.0
+    assert timeline.original_seconds == 8.0
+    assert timeline.to_original(0.5) == pytest.approx(1.5)
+    assert timeline.to_original(1.5) == pytest.approx(5.5)
+    np.testing.assert_allclose(timeline.to_original(np.array([0.0, 1.0, 2.0])), [1.0, 5.0, 6.0])
+
+
+def test_empty_timeline_maps_to_zero():
+    timeline = audio_utils.SpeechTimeline([], 1000)
+    assert timeline.to_original(3.0) == 0.0
+    np.testing.assert_array_equal(timeline.to_original(np.array([1.0, 2.0])), [0.0, 0.0])
+
+
+def test_trim_silence_removes_long_gap():
+    audio = np.concatenate([_silence(1), _tone(2), _silence(5), _tone(2), _silence(1)])
+    trimmed, timeline = audio_utils.trim_silence(audio)
+    # 兩段語音各 2 秒，前後各保留約 0.2 秒
+    assert 4.0 <= timeline.speech_seconds <= 5.0
+    assert len(trimmed) == timeline.offsets[-1]
+    # 去除靜音後的第 3 秒落在第二段語音中（原始錄音的 8～10 秒）
+    assert 8.0 <= timeline.to_original(3.0) <= 10.0
+    assert 1.0 <= timeline.to_original(0.5) <= 2.0
+
+
+def test_trim_silence_keeps_continuous_speech_untouched():
+    audio = _tone(3)
+    trimmed, timeline = audio_utils.trim_silence(audio)
+    assert trimmed is audio
+    assert timeline.to_original(1.25) == pytest.approx(1.25)
+
+
+def test_trim_silence_on_silence_returns_empty():
+    trimmed, timeline = audio_utils.trim_silence(np.zeros(audio_utils.SAMPLE_RATE * 3, dtype=np.float32))
+    assert len(trimmed) == 0
+    assert timeline.speech_seconds == 0.0
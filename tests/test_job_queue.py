@@ -0,0 +1,98 @@
+import threading
+import time
+
+import pytest
+
+from job_queue import JobScheduler, QueueFullError, RecentIds, RetryLater
+
+
+def wait_until(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise AssertionError("等待逾時")
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def scheduler():
+    schedulers = []
+
+    def make(**kwargs):
+        s = JobScheduler(**kwargs)
+        schedulers.append(s)
+        return s
+
+    yield make
+    for s in schedulers:
+        s.shutdown()
+
+
+def test_round_robin_between_users(scheduler):
+    s = scheduler(num_workers=1)
+    order = []
+    for user_id, n in (("alice", 1), ("alice", 2), ("alice", 3), ("bob", 1)):
+        s.submit(user_id, order.append, f"{user_id}{n}")
+    s.start()
+    wait_until(lambda: s.stats()["completed"] == 4)
+    assert order == ["alice1", "bob1", "alice2", "alice3"]
+
+
+def test_queue_and_per_user_caps(scheduler):
+    s = scheduler(num_workers=1, max_queue_size=3, max_per_user=2)
+    s.submit("alice", lambda: None)
+    s.submit("alice", lambda: None)
+    with pytest.raises(QueueFullError):
+        s.submit("alice", lambda: None)
+    s.submit("bob", lambda: None)
+    with pytest.raises(QueueFullError):
+        s.submit("carol", lambda: None)
+    assert s.stats()["rejected"] == 2
+
+
+def test_retry_later_requeues_and_waits_are_counted_once(scheduler):
+    s = scheduler(num_workers=1)
+    calls = []
+    release = threading.Event()
+
+    def slow():
+        release.wait(0.3)
+
+    def flaky():
+        calls.append(time.monotonic())
+        if len(calls) == 1:
+            s.submit("bob", slow)
+            raise RetryLater(0.01, "內容尚未準備好")
+
+    s.start()
+    s.submit("alice", flaky)
+    wait_until(lambda: s.stats()["completed"] == 2)
+
+    stats = s.stats()
+    assert len(calls) == 2
+    assert stats["failed"] == 0 and stats["delayed"] == 0
+    # 第二次取出 alice 的工作前等了 bob 的 0.3 秒，這段只算在 retry_wait，不拉高一般的排隊等待
+    assert stats["avg_wait_seconds"] < 0.1
+    assert stats["avg_retry_wait_seconds"] >= 0.2
+
+
+def test_failed_job_does_not_stop_worker(scheduler):
+    s = scheduler(num_workers=1)
+    s.start()
+    s.submit("alice", lambda: 1 / 0)
+    s.submit("alice", lambda: None)
+    wait_until(lambda: s.stats()["completed"] == 1)
+    assert s.stats()["failed"] == 1
+
+
+def test_recent_ids_ttl_and_discard():
+    ids = RecentIds(ttl_seconds=0.05, max_size=2)
+    assert ids.add("a")
+    assert not ids.add("a")
+    ids.discard("a")
+    assert ids.add("a")
+    time.sleep(0.06)
+    assert ids.add("a")
+    assert ids.add("b")
+    assert ids.add("c")  # 超過 max_size，最舊的 a 被丟棄
+    assert ids.add("a")
@@ -0,0 +1,96 @@
+import time
+
+import pytest
+
+from job_queue import QueueFullError
+from job_store import JobStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    return JobStore(str(tmp_path / "jobs.sqlite3"), lease_seconds=60, max_attempts=2)
+
+
+def expire_running(store):
+    store._conn().execute("UPDATE jobs SET lease_until = ? WHERE status = 'running'", (time.time() - 1,))
+
+
+def test_duplicate_message_id_is_ignored_even_when_queue_is_full(store):
+    assert store.enqueue("m1", "u1", {"n": 1}, max_pending=1) == 1
+    # 重送的事件不新增工作，也不會因為佇列已滿而被拒絕
+    assert store.enqueue("m1", "u1", {"n": 2}, max_pending=1) == 1
+    with pytest.raises(QueueFullError):
+        store.enqueue("m2", "u2", {}, max_pending=1)
+    job = store.claim("w-1-0")
+    assert job.payload == {"n": 1}
+    assert store.claim("w-1-0") is None
+
+
+def test_per_user_cap(store):
+    store.enqueue("m1", "u1", {}, max_per_user=1)
+    with pytest.raises(QueueFullError):
+        store.enqueue("m2", "u1", {}, max_per_user=1)
+    assert store.enqueue("m3", "u2", {}, max_per_user=1) == 2
+
+
+def test_claim_prefers_user_with_fewest_running_jobs(store):
+    store.enqueue("a1", "alice", {})
+    store.enqueue("a2", "alice", {})
+    store.enqueue("b1", "bob", {})
+    assert store.claim("w-1-0").message_id == "a1"
+    assert store.claim("w-1-1").message_id == "b1"
+    assert store.claim("w-1-2").message_id == "a2"
+
+
+def test_requeue_stale_retries_then_fails(store):
+    store.enqueue("m1", "u1", {})
+    store.claim("w-1-0")
+    expire_running(store)
+    assert store.requeue_stale() == (1, [])
+
+    job = store.claim("w-1-0")
+    assert job.attempts == 2
+    expire_running(store)
+    requeued, failed = store.requeue_stale()
+    assert requeued == 0
+    assert [(j.message_id, j.user_id) for j in failed] == [("m1", "u1")]
+    assert store.stats()["failed"] == 1
+
+
+def test_heartbeat_keeps_job_from_being_requeued(store):
+    store.enqueue("m1", "u1", {})
+    store.claim("w-1-0")
+    expire_running(store)
+    store.heartbeat("m1", "w-1-0")
+    assert store.requeue_stale() == (0, [])
+
+
+def test_expire_leases_only_touches_matching_worker(store):
+    store.enqueue("m1", "u1", {})
+    store.enqueue("m2", "u2", {})
+    store.claim("host-a-12-0")
+    store.claim("host-a-123-0")
+    assert store.running_worker_ids() == {"host-a-12-0", "host-a-123-0"}
+    assert store.expire_leases("host-a-12-") == 1
+    assert store.requeue_stale() == (1, [])
+    assert store.running_worker_ids() == {"host-a-123-0"}
+
+
+def test_fail_reports_final_failure(store):
+    store.enqueue("m1", "u1", {})
+    store.claim("w-1-0")
+    assert store.fail("m1", RuntimeError("boom"), retry_delay=0) is False
+    store.claim("w-1-0")
+    assert store.fail("m1", RuntimeError("boom"), retry_delay=0) is True
+
+
+def test_purge_finished_keeps_recent_and_unfinished_jobs(store):
+    for message_id in ("old", "new", "pending"):
+        store.enqueue(message_id, "u1", {})
+    for message_id in ("old", "new"):
+        store.claim("w-1-0")
+        store.complete(message_id)
+    store._conn().execute("UPDATE jobs SET updated_at = ? WHERE message_id = 'old'", (time.time() - 3600,))
+    assert store.purge_finished(older_than_seconds=60) == 1
+    assert store.stats()["completed"] == 1
+    assert store.stats()["queue_depth"] == 1
@@ -0,0 +1,71 @@
+import sqlite3
+import time
+
+import pytest
+
+from result_cache import ResultCache, make_cache_key
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return ResultCache(str(tmp_path / "result_cache.sqlite3"))
+
+
+def test_cache_key_depends_on_model_and_prompt_version():
+    keys = {
+        make_cache_key("abc", "medium", "v1"),
+        make_cache_key("abc", "small", "v1"),
+        make_cache_key("abc", "medium", "v2"),
+    }
+    assert len(keys) == 3
+
+
+def test_hit_and_miss(cache):
+    assert cache.get("k") is None
+    cache.put("k", "逐字稿", "摘要", transcript_id="t1")
+    hit = cache.get("k")
+    assert (hit.transcript, hit.summary, hit.transcript_id) == ("逐字稿", "摘要", "t1")
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+
+def test_expired_entry_is_a_miss(cache):
+    cache.put("k", "逐字稿", "摘要")
+    cache._conn().execute("UPDATE results SET created_at = ?", (time.time() - cache.ttl_seconds - 1,))
+    assert cache.get("k") is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_size_cap_evicts_least_recently_used(cache):
+    cache.put("a", "x" * 10, "")
+    cache.put("b", "x" * 10, "")
+    cache._conn().execute("UPDATE results SET last_access = ? WHERE cache_key = 'a'", (time.time() - 100,))
+    cache._conn().execute("UPDATE results SET last_access = ? WHERE cache_key = 'b'", (time.time() - 200,))
+    cache.get("b")  # b 剛被使用過，a 變成最久未使用
+    cache.max_bytes = 25
+    cache.put("c", "x" * 10, "")
+    assert cache.get("a") is None
+    assert cache.get("b") is not None and cache.get("c") is not None
+    assert cache.stats()["evictions"] == 1
+
+
+def test_migrates_transcript_filename_column(tmp_path):
+    db_path = str(tmp_path / "legacy.sqlite3")
+    conn = sqlite3.connect(db_path)
+    conn.executescript("""
+        CREATE TABLE results (
+            cache_key TEXT PRIMARY KEY, transcript TEXT NOT NULL, summary TEXT NOT NULL,
+            transcript_filename TEXT, size_bytes INTEGER NOT NULL, created_at REAL NOT NULL,
+            last_access REAL NOT NULL, hit_count INTEGER NOT NULL DEFAULT 0
+        );
+    """)
+    now = time.time()
+    conn.executemany(
+        "INSERT INTO results VALUES (?, 't', 's', ?, 2, ?, ?, 0)",
+        [("old", "transcript_abc.txt", now, now), ("new", "abc123", now, now)],
+    )
+    conn.commit()
+    conn.close()
+
+    cache = ResultCache(db_path)
+    assert cache.get("old").transcript_id is None
+    assert cache.get("new").transcript_id == "abc123"
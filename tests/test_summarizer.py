@@ -0,0 +1,91 @@
+import pytest
+
+pytest.importorskip("aiohttp")
+
+import summarizer  # noqa: E402
+from summarizer import estimate_tokens, split_into_chunks  # noqa: E402
+
+
+class FakeService:
+    """代替 SummarizerService：記錄每一層平行送出的 prompt 數，回傳固定長度的重點。"""
+
+    def __init__(self, partial_text):
+        self.partial_text = partial_text
+        self.layers = []
+        self.generated = []
+
+    def gather_sync(self, prompts):
+        self.layers.append(len(prompts))
+        return [self.partial_text(prompt) for prompt in prompts]
+
+    def generate_sync(self, prompt):
+        self.generated.append(prompt)
+        return " 最終摘要 "
+
+
+@pytest.fixture
+def service(monkeypatch):
+    def install(partial_text):
+        fake = FakeService(partial_text)
+        monkeypatch.setattr(summarizer, "_service", fake)
+        return fake
+
+    monkeypatch.setattr(summarizer, "SUMMARY_SINGLE_CALL_MAX_TOKENS", 100)
+    monkeypatch.setattr(summarizer, "SUMMARY_CHUNK_TOKENS", 60)
+    monkeypatch.setattr(summarizer, "SUMMARY_MAX_MAP_LEVELS", 3)
+    return install
+
+
+def test_estimate_tokens_counts_cjk_per_character():
+    assert estimate_tokens("你好世界") == 4
+    assert estimate_tokens("abcdefgh") == 2
+    assert estimate_tokens("") == 0
+
+
+def test_split_into_chunks_keeps_sentences_and_limit():
+    text = "".join(f"這是第{i}句話。" for i in range(40))
+    chunks = split_into_chunks(text, max_tokens=30)
+    assert len(chunks) > 1
+    assert all(estimate_tokens(chunk) <= 30 for chunk in chunks)
+    assert all(chunk.endswith("。") for chunk in chunks)
+    assert "".join(chunks) == text
+
+
+def test_split_into_chunks_hard_splits_unpunctuated_text():
+    text = "沒" * 250
+    chunks = split_into_chunks(text, max_tokens=100)
+    assert [len(chunk) for chunk in chunks] == [100, 100, 50]
+
+
+def test_short_text_uses_single_call(service):
+    fake = service(lambda prompt: "重點")
+    result = summarizer.summarize_text("短短的內容。")
+    assert result.ok and result.text == "最終摘要" and result.chunks == 1
+    assert fake.layers == [] and len(fake.generated) == 1
+
+
+def test_long_text_maps_once_then_reduces(service):
+    fake = service(lambda prompt: "重點。")
+    text = "".join(f"這是第{i}句話。" for i in range(60))
+    result = summarizer.summarize_text(text)
+    assert result.ok and result.chunks == len(split_into_chunks(text, 60))
+    assert fake.layers == [result.chunks]
+    assert len(fake.generated) == 1
+
+
+def test_map_levels_are_bounded(service):
+    # 每層的重點只比輸入短一成，三層後仍然超過單次呼叫的上限
+    fake = service(lambda prompt: "點" * int(estimate_tokens(prompt.split("'''")[1].strip()) * 0.9) + "。")
+    text = "".join(f"這是第{i}句比較長的話，內容很多。" for i in range(60))
+    summarizer.summarize_text(text)
+    assert len(fake.layers) == summarizer.SUMMARY_MAX_MAP_LEVELS
+    assert len(fake.generated) == 1
+
+
+def test_map_stops_when_partials_do_not_shrink(service):
+    # 重點比原文還長：第一層之後就直接合併
+    fake = service(lambda prompt: "點" * 200 + "。")
+    text = "".join(f"這是第{i}句話。" for i in range(60))
+    summarizer.summarize_text(text)
+    assert len(fake.layers) == 1
+    assert len(fake.generated) == 1
@@ -0,0 +1,123 @@
+import gzip
+import sqlite3
+import time
+
+import pytest
+
+import transcript_store
+from transcript_store import LocalBlobBackend, TranscriptStore
+
+
+class RecordingBackend(LocalBlobBackend):
+    def __init__(self, root):
+        super().__init__(root)
+        self.puts = []
+        self.deletes = []
+        self.on_put = None
+
+    def put(self, key, data):
+        if self.on_put is not None:
+            self.on_put(key)
+        self.puts.append(key)
+        super().put(key, data)
+
+    def delete(self, key):
+        self.deletes.append(key)
+        super().delete(key)
+
+
+@pytest.fixture
+def backend(tmp_path):
+    return RecordingBackend(str(tmp_path / "blobs"))
+
+
+@pytest.fixture
+def store(tmp_path, backend):
+    return TranscriptStore(str(tmp_path / "transcripts.sqlite3"), backend, str(tmp_path / "drafts"))
+
+
+def set_created(store, table, created_at, **where):
+    column, value = next(iter(where.items()))
+    store._conn().execute(f"UPDATE {table} SET created_at = ? WHERE {column} = ?", (created_at, value))
+
+
+def read_text(store, transcript_id):
+    stored = store.fetch(transcript_id)
+    return gzip.decompress(stored.gzip_data).decode("utf-8") if stored is not None else None
+
+
+def test_identical_text_is_stored_once(store, backend):
+    sha_a = store.put("a", "同一份內容")
+    sha_b = store.put("b", "同一份內容")
+    assert sha_a == sha_b
+    assert len(backend.puts) == 1
+    assert read_text(store, "a") == read_text(store, "b") == "同一份內容"
+    assert store.stats()["transcripts"] == 2 and store.stats()["blobs"] == 1
+
+
+def test_put_replaces_draft(store):
+    with store.open_draft("a") as f:
+        f.write("草稿")
+    assert store.fetch("a").draft_path is not None
+    store.put("a", "完成")
+    assert read_text(store, "a") == "完成"
+
+
+def test_upload_does_not_hold_the_write_lock(store, backend, tmp_path):
+    def try_write(key):
+        other = sqlite3.connect(str(tmp_path / "transcripts.sqlite3"), timeout=0, isolation_level=None)
+        other.execute("BEGIN IMMEDIATE")
+        other.execute("ROLLBACK")
+        other.close()
+
+    backend.on_put = try_write
+    store.put("a", "內容")
+    assert read_text(store, "a") == "內容"
+
+
+def test_failed_upload_is_retried_by_next_put(store, backend):
+    def fail(key):
+        raise OSError("upload failed")
+
+    backend.on_put = fail
+    with pytest.raises(OSError):
+        store.put("a", "內容")
+    assert not store.exists("a")
+    backend.on_put = None
+    store.put("b", "內容")
+    assert read_text(store, "b") == "內容"
+
+
+def test_sweep_removes_expired_transcripts_and_their_blobs(store, backend):
+    store.put("old", "舊的")
+    store.put("new", "新的")
+    set_created(store, "transcripts", time.time() - store.ttl_seconds - 10, transcript_id="old")
+    set_created(store, "blobs", time.time() - store.ttl_seconds - 10, sha256=store.fetch("old").sha256)
+    assert store.sweep() == (1, 1)
+    assert store.fetch("old") is None
+    assert read_text(store, "new") == "新的"
+    assert len(backend.deletes) == 1
+
+
+def test_size_eviction_follows_newest_reference(store):
+    old_sha = store.put("first", "很早就存在、最近又被用到的內容" * 20)
+    store.put("middle", "中間的內容" * 40)
+    set_created(store, "blobs", time.time() - 1000, sha256=old_sha)
+    set_created(store, "transcripts", time.time() - 1000, transcript_id="first")
+    set_created(store, "transcripts", time.time() - 500, transcript_id="middle")
+    store.put("recent", "很早就存在、最近又被用到的內容" * 20)  # 與 first 相同內容
+    store.max_bytes = store.stats()["stored_bytes"] - 1
+
+    store.sweep()
+    assert store.fetch("middle") is None
+    assert read_text(store, "recent") is not None
+    assert read_text(store, "first") is not None
+
+
+def test_unreferenced_blob_is_kept_during_grace_period(store, backend):
+    sha256 = store.put("a", "內容")
+    store._conn().execute("DELETE FROM transcripts")
+    assert store.sweep() == (0, 0)
+    set_created(store, "blobs", time.time() - transcript_store.ORPHAN_GRACE_SECONDS - 1, sha256=sha256)
+    assert store.sweep() == (0, 1)
+    assert backend.deletes == [transcript_store._blob_key(sha256)]
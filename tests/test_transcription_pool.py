@@ -0,0 +1,93 @@
+"""
+transcription_pool：以不需下載的小型隨機權重 Whisper 模型啟動 2 個轉錄程序。
+"""
+import pickle
+
+import numpy as np
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("whisper")
+
+from whisper.model import ModelDimensions, Whisper  # noqa: E402
+
+import transcription_pool  # noqa: E402
+import whisper_helper  # noqa: E402
+from transcription_pool import PoolWorkerError, TranscriptionPool  # noqa: E402
+from whisper_helper import SAMPLE_RATE, WhisperBackend  # noqa: E402
+
+# 文字長度很短，隨機權重的解碼很快就會結束
+TINY_DIMS = ModelDimensions(
+    n_mels=80, n_audio_ctx=1500, n_audio_state=32, n_audio_head=2, n_audio_layer=1,
+    n_vocab=51865, n_text_ctx=16, n_text_state=32, n_text_head=2, n_text_layer=1,
+)
+
+
+def tiny_backend(quantize_int8=False):
+    torch.manual_seed(0)
+    model = Whisper(TINY_DIMS)
+    torch.nn.init.normal_(model.decoder.positional_embedding, std=0.02)  # whisper 以 torch.empty 建立，未初始化
+    if quantize_int8:
+        whisper_helper._swap_to_plain_linear(model)
+        model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    model.eval()
+    backend = WhisperBackend("tiny-test", quantize_int8)
+    backend._model = model
+    backend.status = "loaded"
+    return backend
+
+
+@pytest.fixture
+def pool_of(request):
+    pools = []
+
+    def start(backend):
+        pool = TranscriptionPool(backend, 2, threads_per_process=1)
+        pools.append(pool)
+        pool.start()
+        return pool
+
+    yield start
+    for pool in pools:
+        pool.close()
+
+
+@pytest.mark.parametrize("quantize_int8", [False, True], ids=["fp32", "int8"])
+def test_two_process_pool_transcribes_tiny_model(pool_of, quantize_int8):
+    backend = tiny_backend(quantize_int8)
+    pool = pool_of(backend)
+
+    # 稀疏的 alignment_heads 不能放進共享記憶體，其餘密集權重都要共享
+    model = backend.get_model()
+    assert model.alignment_heads.is_sparse
+    assert all(t.is_shared() for t in model.parameters())
+
+    futures = [pool.submit(np.zeros(SAMPLE_RATE, dtype=np.float32)) for _ in range(2)]
+    for future in futures:
+        output = future.result(timeout=300)
+        assert set(output) == {"text", "segments", "language"}
+    assert all(process.is_alive() for process in pool._processes)
+    assert not pool.broken
+
+
+def test_worker_exception_is_classified_in_child(pool_of):
+    pool = pool_of(tiny_backend())
+    # 二維波形會讓 transcribe 在轉錄程序中失敗
+    future = pool.submit(np.zeros((2, SAMPLE_RATE), dtype=np.float32))
+    with pytest.raises(PoolWorkerError) as excinfo:
+        future.result(timeout=300)
+    assert excinfo.value.transient is False
+    assert excinfo.value.error_type in str(excinfo.value)
+    assert not pool.broken
+
+
+def test_pool_worker_error_round_trips_and_drives_transient_check(monkeypatch):
+    monkeypatch.setattr(whisper_helper, "WHISPER_POOL_PROCESSES", 2)
+    error = pickle.loads(pickle.dumps(PoolWorkerError(
+        "RuntimeError: [enforce fail at alloc_cpu.cpp:119] DefaultCPUAllocator: can't allocate memory",
+        "RuntimeError", True,
+    )))
+    assert (error.error_type, error.transient) == ("RuntimeError", True)
+    assert whisper_helper.is_transient_error(error)
+    assert not whisper_helper.is_transient_error(PoolWorkerError("ValueError: bad input", "ValueError", False))
+    assert whisper_helper.is_transient_error(transcription_pool.PoolWorkerLost("轉錄程序意外結束"))
@@ -0,0 +1,110 @@
+"""
+transcribe_audio 與 summarize_text 回傳的 TranscriptionResult / SummaryResult：呼叫端只看 status，不再比對字串。
+"""
+import numpy as np
+import pytest
+
+
+def _tone(seconds, amplitude=0.3):
+    t = np.arange(int(seconds * 16000)) / 16000
+    return (amplitude * np.sin(2 * np.pi * 220 * t)).astype(np.float32)
+
+
+@pytest.fixture
+def whisper_helper(monkeypatch):
+    pytest.importorskip("torch")
+    pytest.importorskip("whisper")
+    import whisper_helper
+
+    monkeypatch.setattr(whisper_helper, "WHISPER_VAD", True)
+    monkeypatch.setattr(whisper_helper, "degraded_backend", None)
+    monkeypatch.setattr(whisper_helper, "_get_pool", lambda: None)
+    return whisper_helper
+
+
+def test_silence_is_no_speech_without_running_the_model(whisper_helper, monkeypatch):
+    monkeypatch.setattr(whisper_helper, "_transcribe_default", lambda audio, duration: pytest.fail("不應執行模型"))
+    result = whisper_helper.transcribe_audio(np.zeros(16000 * 3, dtype=np.float32))
+    assert result.status == "no_speech" and not result.ok
+    assert result.audio_seconds == 3.0
+
+
+def test_segments_are_mapped_back_to_original_time(whisper_helper, monkeypatch):
+    def fake_default(audio, duration):
+        return {"text": "你好", "segments": [{"start": 2.5, "end": 3.0, "text": "你好"}], "language": "zh"}, "fake"
+
+    monkeypatch.setattr(whisper_helper, "_transcribe_default", fake_default)
+    audio = np.concatenate([_tone(2), np.zeros(16000 * 5, dtype=np.float32), _tone(2)])
+    result = whisper_helper.transcribe_audio(audio)
+    assert result.ok and result.text == "你好" and result.model == "fake"
+    assert result.speech_seconds < result.audio_seconds
+    # 去除靜音後的 2.5 秒落在第二段語音（原始錄音 7～9 秒）
+    assert 7.0 <= result.segments[0]["start"] <= 9.0
+
+
+def test_transient_errors_fall_back_then_report_retryable(whisper_helper, monkeypatch):
+    attempts = []
+
+    def out_of_memory(*args):
+        attempts.append(args)
+        raise RuntimeError("DefaultCPUAllocator: can't allocate memory: you tried to allocate 1 bytes")
+
+    monkeypatch.setattr(whisper_helper, "_transcribe_default", out_of_memory)
+    monkeypatch.setattr(whisper_helper, "_transcribe_chunked", out_of_memory)
+    result = whisper_helper.transcribe_audio(_tone(2))
+    assert len(attempts) == 2
+    assert result.status == "error" and result.retryable
+    assert "can't allocate memory" in result.error
+
+
+def test_permanent_error_is_not_retried(whisper_helper, monkeypatch):
+    attempts = []
+
+    def broken(*args):
+        attempts.append(args)
+        raise ValueError("bad input")
+
+    monkeypatch.setattr(whisper_helper, "_transcribe_default", broken)
+    monkeypatch.setattr(whisper_helper, "_transcribe_chunked", broken)
+    result = whisper_helper.transcribe_audio(_tone(2))
+    assert len(attempts) == 1
+    assert result.status == "error" and not result.retryable
+
+
+@pytest.fixture
+def summarizer():
+    pytest.importorskip("aiohttp")
+    import summarizer
+    return summarizer
+
+
+def failing_service(error):
+    class FailingService:
+        def generate_sync(self, prompt):
+            raise error
+
+    return FailingService()
+
+
+def test_empty_text_does_not_call_gemini(summarizer, monkeypatch):
+    monkeypatch.setattr(summarizer, "get_service", lambda: pytest.fail("不應呼叫 Gemini"))
+    result = summarizer.summarize_text("   ")
+    assert result.status == "empty" and not result.ok
+
+
+def test_rate_limited_summary_is_retryable(summarizer, monkeypatch):
+    from summarizer_service import GeminiError
+
+    monkeypatch.setattr(summarizer, "_service", failing_service(GeminiError("quota", status=429, retryable=True)))
+    result = summarizer.summarize_text("內容。")
+    assert result.status == "error"
+    assert result.retryable and result.rate_limited
+
+
+def test_blocked_summary_is_not_retryable(summarizer, monkeypatch):
+    from summarizer_service import GeminiError
+
+    monkeypatch.setattr(summarizer, "_service", failing_service(GeminiError("no candidates")))
+    result = summarizer.summarize_text("內容。")
+    assert result.status == "error"
+    assert not result.retryable and not result.rate_limited
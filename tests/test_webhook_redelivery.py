@@ -0,0 +1,96 @@
+"""
+/callback 的重複事件判斷：排入佇列失敗時不能留下紀錄，否則 LINE 重送的事件會被當成重複而丟掉。
+"""
+import base64
+import hashlib
+import hmac
+import importlib
+import json
+import os
+import sqlite3
+import sys
+import time
+
+import pytest
+
+pytest.importorskip("flask")
+pytest.importorskip("linebot")
+
+CHANNEL_SECRET = "test-channel-secret"
+
+
+@pytest.fixture(scope="module")
+def app_module(tmp_path_factory):
+    data_dir = tmp_path_factory.mktemp("app_data")
+    env = {
+        "LINE_CHANNEL_SECRET": CHANNEL_SECRET,
+        "LINE_CHANNEL_ACCESS_TOKEN": "test-access-token",
+        "JOB_BACKEND": "memory",
+        "WHISPER_WARMUP": "0",
+        "TRANSCRIPT_SWEEP_INTERVAL_SECONDS": "0",
+        "JOB_DB_PATH": str(data_dir / "jobs.sqlite3"),
+        "RESULT_CACHE_DB_PATH": str(data_dir / "result_cache.sqlite3"),
+        "TRANSCRIPT_STORE_DIR": str(data_dir / "transcripts"),
+        "TRANSCRIPT_DB_PATH": str(data_dir / "transcripts.sqlite3"),
+    }
+    saved = {key: os.environ.get(key) for key in env}
+    os.environ.update(env)
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    try:
+        sys.modules.pop("app", None)
+        yield importlib.import_module("app")
+    finally:
+        sys.modules.pop("app", None)
+        for key, value in saved.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+
+
+def post_audio_event(client, message_id, event_id, redelivery=False):
+    body = json.dumps({
+        "destination": "Utest-destination",
+        "events": [{
+            "type": "message",
+            "mode": "active",
+            "timestamp": int(time.time() * 1000),
+            "source": {"type": "user", "userId": "Utest-user"},
+            "webhookEventId": event_id,
+            "deliveryContext": {"isRedelivery": redelivery},
+            "replyToken": "test-reply-token",
+            "message": {"id": message_id, "type": "audio", "contentProvider": {"type": "line"}},
+        }],
+    }).encode("utf-8")
+    signature = base64.b64encode(hmac.new(CHANNEL_SECRET.encode("utf-8"), body, hashlib.sha256).digest()).decode("ascii")
+    return client.post("/callback", data=body, headers={"Content-Type": "application/json", "X-Line-Signature": signature})
+
+
+def test_redelivery_after_failed_enqueue_is_accepted(app_module, monkeypatch):
+    enqueued = []
+    replies = []
+
+    def flaky_enqueue(event_data):
+        if not enqueued:
+            enqueued.append(None)
+            raise sqlite3.OperationalError("database is locked")
+        enqueued.append(event_data["message"]["id"])
+        return 1
+
+    monkeypatch.setattr(app_module, "enqueue_audio_job", flaky_enqueue)
+    monkeypatch.setattr(app_module, "reply_text_in_background", lambda token, text, user_id, description: replies.append(text))
+    client = app_module.app.test_client()
+
+    first = post_audio_event(client, "100001", "01TESTEVENT0000000000000001")
+    assert first.status_code != 200
+    assert replies == []
+
+    redelivered = post_audio_event(client, "100001", "01TESTEVENT0000000000000001", redelivery=True)
+    assert redelivered.status_code == 200
+    assert enqueued == [None, "100001"]
+    assert len(replies) == 1 and app_module.QUEUE_FULL_MESSAGE not in replies[0]
+
+    # 成功排入後，再次重送的事件仍然會被忽略
+    again = post_audio_event(client, "100001", "01TESTEVENT0000000000000001", redelivery=True)
+    assert again.status_code == 200
+    assert enqueued == [None, "100001"]
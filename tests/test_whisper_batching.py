@@ -0,0 +1,94 @@
+import threading
+
+import numpy as np
+import pytest
+
+torch = pytest.importorskip("torch")
+whisper = pytest.importorskip("whisper")
+
+import whisper_helper  # noqa: E402
+from whisper_helper import N_SAMPLES, SAMPLE_RATE, WhisperBackend, WhisperBatcher  # noqa: E402
+
+
+class FakeBackend(WhisperBackend):
+    def __init__(self):
+        super().__init__("fake")
+        self.calls = 0
+
+    def transcribe(self, audio, **kwargs):
+        self.calls += 1
+        return {"text": " 直接轉錄 ", "segments": [], "language": "zh"}
+
+
+def test_batch_duration_cap_fits_one_whisper_window():
+    assert whisper_helper.WHISPER_BATCH_MAX_AUDIO_SECONDS <= N_SAMPLES / SAMPLE_RATE
+
+
+def test_batched_log_mel_matches_per_clip():
+    backend = WhisperBackend("tiny-test")
+    backend._model = whisper.model.Whisper(whisper.model.ModelDimensions(
+        n_mels=80, n_audio_ctx=1500, n_audio_state=32, n_audio_head=2, n_audio_layer=1,
+        n_vocab=51865, n_text_ctx=16, n_text_state=32, n_text_head=2, n_text_layer=1,
+    ))
+    rng = np.random.default_rng(0)
+    quiet = (rng.standard_normal(SAMPLE_RATE * 3) * 0.01).astype(np.float32)
+    loud = (rng.standard_normal(SAMPLE_RATE * 5) * 0.5).astype(np.float32)
+    batch = np.stack([whisper.pad_or_trim(quiet), whisper.pad_or_trim(loud)])
+
+    mels = backend.log_mel(batch)
+    for i, clip in enumerate((quiet, loud)):
+        expected = whisper.log_mel_spectrogram(whisper.pad_or_trim(clip), 80)
+        torch.testing.assert_close(mels[i], expected, atol=1e-4, rtol=1e-4)
+
+
+def test_batcher_merges_requests_within_window(monkeypatch):
+    batches = []
+
+    def fake_batch(audios, backend):
+        batches.append(len(audios))
+        return [{"text": str(len(a))} for a in audios]
+
+    monkeypatch.setattr(whisper_helper, "_transcribe_batch_detailed", fake_batch)
+    batcher = WhisperBatcher(FakeBackend(), max_batch_size=2, window_seconds=0.2)
+    start = threading.Barrier(3)
+    futures = [None] * 3
+
+    def submit(i):
+        start.wait()
+        futures[i] = batcher.submit(np.zeros(SAMPLE_RATE * (i + 1), dtype=np.float32))
+
+    threads = [threading.Thread(target=submit, args=(i,)) for i in range(3)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    results = sorted(future.result(timeout=5)["text"] for future in futures)
+    assert results == [str(SAMPLE_RATE * n) for n in (1, 2, 3)]
+    assert batches == [2, 1]
+
+
+def test_transcribe_with_batches_only_short_clips_with_several_workers(monkeypatch):
+    backend = FakeBackend()
+    submitted = []
+
+    class RecordingBatcher:
+        def submit(self, audio):
+            submitted.append(len(audio))
+            future = whisper_helper.Future()
+            future.set_result({"text": "批次", "avg_logprob": 0.0, "segments": [], "language": "zh"})
+            return future
+
+    short = np.zeros(SAMPLE_RATE * 5, dtype=np.float32)
+    long = np.zeros(SAMPLE_RATE * 60, dtype=np.float32)
+
+    monkeypatch.setattr(whisper_helper, "_transcribe_workers", 1)
+    assert not whisper_helper.batching_enabled()
+    assert whisper_helper._transcribe_with(backend, RecordingBatcher(), short, 5)["text"] == "直接轉錄"
+
+    monkeypatch.setattr(whisper_helper, "_transcribe_workers", 4)
+    monkeypatch.setattr(whisper_helper, "WHISPER_BATCH_MAX_SIZE", 8)
+    assert whisper_helper.batching_enabled()
+    assert whisper_helper._transcribe_with(backend, RecordingBatcher(), short, 5)["text"] == "批次"
+    assert whisper_helper._transcribe_with(backend, RecordingBatcher(), long, 60)["text"] == "直接轉錄"
+    assert submitted == [len(short)]
+    assert backend.calls == 2
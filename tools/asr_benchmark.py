@@ -0,0 +1,235 @@
+"""
+比較不同 Whisper 設定（模型大小、int8 量化、執行緒數、快速模型分流）的轉錄速度與準確度。
+
+語料資料夾中每個音訊檔都要有同名的 .txt 參考逐字稿，例如 corpus/memo01.m4a 與 corpus/memo01.txt：
+
+    python tools/asr_benchmark.py corpus/ --config medium --config medium:int8 --config small:int8/medium:int8 \\
+        --threads 4 --threads 8 --json results.json
+
+--config 的格式為「模型[:int8]」，或以「快速模型/主模型」表示短語音先用快速模型、信心不足時改用主模型。
+輸出每個設定的即時率 (RTF，處理秒數 / 音訊秒數，越小越快)、字詞錯誤率 (WER) 與字元錯誤率 (CER，適合中文)。
+
+每個設定以兩種模式量測（可用 --mode 只選其中一種）：
+- backend：直接呼叫模型的 transcribe，只比較模型本身。
+- pipeline：把設定套用到 whisper_helper 後呼叫 transcribe_audio，與正式環境走同一條路徑
+  （靜音去除、快速模型分流、批次推論與多程序轉錄）；以 --concurrency 個執行緒同時送出，模擬 TRANSCRIBE_WORKERS。
+  RTF 以整批的實際經過時間計算。降級重試 (WHISPER_DEGRADED_MODEL) 在量測時停用，發生暫時性錯誤時直接記為失敗，
+  不會混入其他模型的結果。
+
+同一個模型設定（例如 medium:int8）在不同的 --config、--mode 與 --threads 之間共用同一份已載入的模型，只載入一次。
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np  # noqa: E402
+import torch  # noqa: E402
+
+import whisper_helper  # noqa: E402
+from whisper_helper import SAMPLE_RATE, WhisperBackend  # noqa: E402
+
+AUDIO_EXTENSIONS = ('.m4a', '.mp3', '.wav', '.aac', '.amr', '.flac', '.ogg')
+_PUNCTUATION = re.compile(r"[^\w\s]")
+_backends = {}  # "small:int8" -> WhisperBackend，各設定共用
+
+
+def load_corpus(corpus_dir):
+    """回傳 [(名稱, 波形, 參考逐字稿)]，沒有參考逐字稿的音訊會被略過。"""
+    items = []
+    for filename in sorted(os.listdir(corpus_dir)):
+        stem, ext = os.path.splitext(filename)
+        if ext.lower() not in AUDIO_EXTENSIONS:
+            continue
+        reference_path = os.path.join(corpus_dir, stem + ".txt")
+        if not os.path.exists(reference_path):
+            print(f"略過 {filename}：找不到參考逐字稿 {stem}.txt")
+            continue
+        with open(reference_path, encoding="utf-8") as f:
+            reference = f.read()
+        items.append((filename, whisper_helper.load_audio(os.path.join(corpus_dir, filename)), reference))
+    return items
+
+
+def edit_distance(reference, hypothesis):
+    """兩個序列之間的 Levenshtein 距離。"""
+    previous = list(range(len(hypothesis) + 1))
+    for i, ref_item in enumerate(reference, 1):
+        current = [i] + [0] * len(hypothesis)
+        for j, hyp_item in enumerate(hypothesis, 1):
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ref_item != hyp_item))
+        previous = current
+    return previous[-1]
+
+
+def normalize(text):
+    return " ".join(_PUNCTUATION.sub(" ", text.lower()).split())
+
+
+def parse_config(spec):
+    """把 "small:int8/medium" 轉成 (快速模型 WhisperBackend 或 None, 主模型 WhisperBackend)；相同的模型設定回傳同一個 backend。"""
+    def backend(part):
+        if part not in _backends:
+            name, _, option = part.partition(":")
+            _backends[part] = WhisperBackend(name, quantize_int8=option == "int8")
+        return _backends[part]
+
+    if "/" in spec:
+        fast, main = spec.split("/", 1)
+        return backend(fast), backend(main)
+    return None, backend(spec)
+
+
+def transcribe(backend, audio):
+    result = backend.transcribe(audio)
+    logprobs = [s["avg_logprob"] for s in result.get("segments", [])]
+    return result["text"].strip(), float(np.mean(logprobs)) if logprobs else 0.0
+
+
+def use_backends(fast_backend, main_backend, fast_max_seconds, fast_min_logprob):
+    """把 whisper_helper 的模型設定換成指定的 backend，之後的 transcribe_audio 都會使用這組設定。"""
+    whisper_helper.main_backend = main_backend
+    whisper_helper.fast_backend = fast_backend
+    whisper_helper.degraded_backend = None  # 量測的是這組設定本身，不改用其他模型重試
+    whisper_helper.batcher = whisper_helper.WhisperBatcher(main_backend)
+    whisper_helper.fast_batcher = whisper_helper.WhisperBatcher(fast_backend) if fast_backend is not None else None
+    whisper_helper.WHISPER_FAST_MAX_SECONDS = fast_max_seconds
+    whisper_helper.WHISPER_FAST_MIN_LOGPROB = fast_min_logprob
+    pool_module = sys.modules.get("transcription_pool")
+    if pool_module is not None and pool_module._pool is not None and pool_module._pool.backend is not main_backend:
+        # 轉錄程序池綁定建立時的主模型，換主模型後重新建立
+        pool_module._pool.close()
+        pool_module._pool = None
+
+
+def backend_hypotheses(fast_backend, main_backend, corpus, fast_max_seconds, fast_min_logprob):
+    """backend 模式：逐一直接呼叫模型。回傳 ([(名稱, 轉錄文字, 耗時)], 總耗時, 改用主模型的次數)。"""
+    outputs, fallbacks = [], 0
+    for name, audio, _ in corpus:
+        duration = len(audio) / SAMPLE_RATE
+        start = time.time()
+        hypothesis = None
+        if fast_backend is not None and duration <= fast_max_seconds:
+            hypothesis, logprob = transcribe(fast_backend, audio)
+            if logprob < fast_min_logprob:
+                hypothesis = None
+                fallbacks += 1
+        if hypothesis is None:
+            hypothesis, _ = transcribe(main_backend, audio)
+        outputs.append((name, hypothesis, time.time() - start))
+    return outputs, sum(elapsed for _, _, elapsed in outputs), fallbacks
+
+
+def pipeline_hypotheses(fast_backend, corpus, fast_max_seconds, concurrency):
+    """pipeline 模式：以 concurrency 個執行緒同時呼叫 transcribe_audio。回傳格式同 backend_hypotheses。"""
+    whisper_helper.set_transcribe_workers(concurrency)
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(whisper_helper.transcribe_audio, [audio for _, audio, _ in corpus]))
+    wall_seconds = time.time() - start
+
+    outputs, fallbacks = [], 0
+    for (name, _, _), result in zip(corpus, results):
+        if result.status == "error":
+            print(f"  {name} 轉錄失敗: {result.error}")
+        if fast_backend is not None and result.speech_seconds <= fast_max_seconds and result.model != fast_backend.name:
+            fallbacks += 1
+        outputs.append((name, result.text if result.ok else "", result.elapsed_seconds))
+    return outputs, wall_seconds, fallbacks
+
+
+def run_config(spec, threads, corpus, fast_max_seconds, fast_min_logprob, mode="backend", concurrency=1):
+    torch.set_num_threads(threads)
+    fast_backend, main_backend = parse_config(spec)
+
+    # 先載入並暖機，載入時間不計入 RTF
+    load_start = time.time()
+    if mode == "pipeline":
+        use_backends(fast_backend, main_backend, fast_max_seconds, fast_min_logprob)
+        whisper_helper.warm_up()
+    else:
+        for backend in (fast_backend, main_backend):
+            if backend is not None:
+                backend.transcribe(np.zeros(SAMPLE_RATE, dtype=np.float32))
+    load_seconds = time.time() - load_start
+
+    if mode == "pipeline":
+        outputs, process_seconds, fallbacks = pipeline_hypotheses(fast_backend, corpus, fast_max_seconds, concurrency)
+    else:
+        outputs, process_seconds, fallbacks = backend_hypotheses(
+            fast_backend, main_backend, corpus, fast_max_seconds, fast_min_logprob
+        )
+
+    audio_seconds = 0.0
+    word_errors = word_total = char_errors = char_total = 0
+    for (name, audio, reference), (_, hypothesis, elapsed) in zip(corpus, outputs):
+        duration = len(audio) / SAMPLE_RATE
+        ref_norm, hyp_norm = normalize(reference), normalize(hypothesis)
+        w_err = edit_distance(ref_norm.split(), hyp_norm.split())
+        c_err = edit_distance(ref_norm.replace(" ", ""), hyp_norm.replace(" ", ""))
+        audio_seconds += duration
+        word_errors += w_err
+        word_total += len(ref_norm.split())
+        char_errors += c_err
+        char_total += len(ref_norm.replace(" ", ""))
+        print(f"  [{spec} / {mode} / {threads} 執行緒] {name}: {duration:.1f} 秒音訊，耗時 {elapsed:.1f} 秒，"
+              f"CER {c_err / max(1, len(ref_norm.replace(' ', ''))):.3f}")
+
+    return {
+        "config": spec,
+        "mode": mode,
+        "threads": threads,
+        "concurrency": concurrency if mode == "pipeline" else 1,
+        "files": len(corpus),
+        "audio_seconds": round(audio_seconds, 1),
+        "process_seconds": round(process_seconds, 1),
+        "load_seconds": round(load_seconds, 1),
+        "rtf": round(process_seconds / audio_seconds, 3) if audio_seconds else None,
+        "wer": round(word_errors / word_total, 4) if word_total else None,
+        "cer": round(char_errors / char_total, 4) if char_total else None,
+        "fast_fallbacks": fallbacks,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Whisper 轉錄設定的速度與準確度比較")
+    parser.add_argument("corpus", help="放音訊檔與同名 .txt 參考逐字稿的資料夾")
+    parser.add_argument("--config", action="append", help="要比較的設定，可重複指定，例如 medium、small:int8、small:int8/medium")
+    parser.add_argument("--threads", type=int, action="append", help="torch 執行緒數，可重複指定；預設為目前的設定")
+    parser.add_argument("--fast-max-seconds", type=float, default=whisper_helper.WHISPER_FAST_MAX_SECONDS)
+    parser.add_argument("--fast-min-logprob", type=float, default=whisper_helper.WHISPER_FAST_MIN_LOGPROB)
+    parser.add_argument("--mode", action="append", choices=("backend", "pipeline"),
+                        help="量測模式，可重複指定；預設兩種都量測")
+    parser.add_argument("--concurrency", type=int, default=whisper_helper.TRANSCRIBE_WORKERS,
+                        help="pipeline 模式同時轉錄的執行緒數，預設為 TRANSCRIBE_WORKERS")
+    parser.add_argument("--json", help="將結果另外寫入此 JSON 檔")
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus)
+    if not corpus:
+        parser.error(f"{args.corpus} 中沒有可用的音訊檔與參考逐字稿")
+
+    results = []
+    for threads in args.threads or [torch.get_num_threads()]:
+        for spec in args.config or [whisper_helper.main_backend.name.replace("-int8", ":int8")]:
+            for mode in args.mode or ["backend", "pipeline"]:
+                results.append(run_config(spec, threads, corpus, args.fast_max_seconds, args.fast_min_logprob,
+                                          mode=mode, concurrency=args.concurrency))
+
+    print(f"\n{'設定':<28}{'模式':>10}{'執行緒':>6}{'RTF':>8}{'WER':>8}{'CER':>8}{'改用主模型':>10}{'載入(秒)':>10}")
+    for r in results:
+        print(f"{r['config']:<28}{r['mode']:>10}{r['threads']:>6}{str(r['rtf']):>8}{str(r['wer']):>8}{str(r['cer']):>8}"
+              f"{r['fast_fallbacks']:>10}{r['load_seconds']:>10}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
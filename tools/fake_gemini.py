@@ -0,0 +1,138 @@
+"""
+本機的假 Gemini API，用來離線測試摘要服務的限流、重試與請求合併。
+
+    python tools/fake_gemini.py --port 8090 --latency 1.5 --rpm 10 --error-rate 0.1
+
+接著讓 Bot 指向它：
+
+    GEMINI_API_BASE_URL=http://127.0.0.1:8090 GEMINI_API_KEY=fake python app.py
+
+GET /stats 可以查看收到的請求數、回傳的 429 / 5xx 數量與最高同時請求數，POST /reset 會清除統計。
+"""
+import argparse
+import asyncio
+import random
+import time
+from collections import deque
+
+from aiohttp import web
+
+
+class FakeGemini:
+    def __init__(self, latency, jitter, rpm, error_rate, block_rate):
+        self.latency = latency
+        self.jitter = jitter
+        self.rpm = rpm
+        self.error_rate = error_rate
+        self.block_rate = block_rate
+        self.reset()
+
+    def reset(self):
+        self.requests = 0
+        self.ok = 0
+        self.rate_limited = 0
+        self.server_errors = 0
+        self.blocked = 0
+        self.concurrent = 0
+        self.max_concurrent = 0
+        self.prompt_chars = 0
+        self._recent = deque()  # 最近 60 秒內被接受的請求時間
+
+    def _over_quota(self):
+        if not self.rpm:
+            return False
+        now = time.monotonic()
+        while self._recent and now - self._recent[0] > 60:
+            self._recent.popleft()
+        if len(self._recent) >= self.rpm:
+            return True
+        self._recent.append(now)
+        return False
+
+    async def generate_content(self, request):
+        self.requests += 1
+        if not request.query.get("key"):
+            return web.json_response({"error": {"code": 400, "message": "API key not valid."}}, status=400)
+        body = await request.json()
+        prompt = "".join(
+            part.get("text", "") for content in body.get("contents", []) for part in content.get("parts", [])
+        )
+        self.prompt_chars += len(prompt)
+
+        if self._over_quota():
+            self.rate_limited += 1
+            return web.json_response(
+                {"error": {"code": 429, "message": "Resource has been exhausted (e.g. check quota).", "status": "RESOURCE_EXHAUSTED"}},
+                status=429,
+                headers={"Retry-After": "2"},
+            )
+
+        self.concurrent += 1
+        self.max_concurrent = max(self.max_concurrent, self.concurrent)
+        try:
+            await asyncio.sleep(max(0.0, self.latency + random.uniform(-self.jitter, self.jitter)))
+        finally:
+            self.concurrent -= 1
+
+        if random.random() < self.error_rate:
+            self.server_errors += 1
+            return web.json_response({"error": {"code": 503, "message": "The model is overloaded."}}, status=503)
+        if random.random() < self.block_rate:
+            self.blocked += 1
+            return web.json_response({"promptFeedback": {"blockReason": "SAFETY"}})
+
+        self.ok += 1
+        summary = (
+            "這段語音的原始語言聽起來像是：中文\n\n"
+            f"（假摘要）這是一段約 {len(prompt)} 字提示語的測試摘要，內容重點已整理完成 😊"
+        )
+        return web.json_response({
+            "candidates": [{"content": {"role": "model", "parts": [{"text": summary}]}, "finishReason": "STOP"}],
+            "usageMetadata": {"promptTokenCount": len(prompt), "candidatesTokenCount": len(summary)},
+        })
+
+    async def stats(self, request):
+        return web.json_response({
+            "requests": self.requests,
+            "ok": self.ok,
+            "rate_limited": self.rate_limited,
+            "server_errors": self.server_errors,
+            "blocked": self.blocked,
+            "max_concurrent": self.max_concurrent,
+            "prompt_chars": self.prompt_chars,
+        })
+
+    async def reset_stats(self, request):
+        self.reset()
+        return web.json_response({"ok": True})
+
+
+def create_app(latency=1.0, jitter=0.3, rpm=0, error_rate=0.0, block_rate=0.0):
+    fake = FakeGemini(latency, jitter, rpm, error_rate, block_rate)
+    app = web.Application()
+    # 路徑形如 /v1beta/models/gemini-1.5-flash-latest:generateContent
+    app.router.add_post(r"/v1beta/models/{model:[^:/]+}:generateContent", fake.generate_content)
+    app.router.add_get("/stats", fake.stats)
+    app.router.add_post("/reset", fake.reset_stats)
+    app["fake"] = fake
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="假 Gemini generateContent API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--latency", type=float, default=1.0, help="每個請求的平均延遲秒數")
+    parser.add_argument("--jitter", type=float, default=0.3, help="延遲的隨機變動範圍 (秒)")
+    parser.add_argument("--rpm", type=int, default=0, help="每分鐘請求上限，超過回傳 429；0 表示不限制")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="回傳 503 的機率")
+    parser.add_argument("--block-rate", type=float, default=0.0, help="回傳沒有候選內容 (被過濾) 的機率")
+    args = parser.parse_args()
+    web.run_app(
+        create_app(args.latency, args.jitter, args.rpm, args.error_rate, args.block_rate),
+        host=args.host, port=args.port,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+"""
+本機的假 LINE Messaging API，用來離線測試並量測 webhook → 轉錄 → 推送 的整條流程。
+
+    python tools/fake_line.py --port 8081 --corpus corpus/ --content-delay 3 --api-latency 0.05
+
+接著讓 Bot 指向它：
+
+    LINE_API_BASE_URL=http://127.0.0.1:8081 LINE_DATA_API_BASE_URL=http://127.0.0.1:8081 python app.py
+
+提供的 API：
+- GET  /v2/bot/message/{message_id}/content：訊息內容。登錄後 content_delay 秒內回傳 HTTP 202（模擬大檔案還在準備中）。
+  內容可以用 PUT /_content/{message_id} 登錄（可加 ?ready_after=秒數 覆寫延遲），
+  沒有登錄過的 message_id 會依雜湊從 --corpus 資料夾中挑一個音訊檔。
+- POST /v2/bot/message/reply、/v2/bot/message/push：記錄收到的時間與內容。
+
+GET /_records 回傳所有回覆與推送紀錄（可加 ?since=時間戳記），GET /_stats 回傳各項計數，POST /_reset 清除紀錄。
+"""
+import argparse
+import asyncio
+import hashlib
+import os
+import time
+import uuid
+
+from aiohttp import web
+
+AUDIO_EXTENSIONS = ('.m4a', '.mp3', '.wav', '.aac', '.amr', '.flac', '.ogg')
+CONTENT_TYPES = {
+    '.m4a': 'audio/x-m4a', '.mp3': 'audio/mpeg', '.wav': 'audio/wav', '.aac': 'audio/aac',
+    '.amr': 'audio/amr', '.flac': 'audio/flac', '.ogg': 'audio/ogg',
+}
+
+
+def content_type_for(filename):
+    return CONTENT_TYPES.get(os.path.splitext(filename)[1].lower(), 'application/octet-stream')
+
+
+class FakeLine:
+    def __init__(self, content_delay=0.0, api_latency=0.0, corpus_dir=None):
+        self.content_delay = content_delay
+        self.api_latency = api_latency
+        self.corpus = []
+        if corpus_dir:
+            self.corpus = [
+                os.path.join(corpus_dir, f) for f in sorted(os.listdir(corpus_dir))
+                if f.lower().endswith(AUDIO_EXTENSIONS)
+            ]
+        self.reset()
+
+    def reset(self):
+        self.contents = {}  # message_id -> (data, content_type, ready_at)
+        self.replies = []
+        self.pushes = []
+        self.content_requests = 0
+        self.not_ready = 0
+        self.not_found = 0
+
+    def add_content(self, message_id, data, content_type, ready_after=None):
+        """登錄訊息內容；ready_after 秒內下載會得到 HTTP 202。"""
+        delay = self.content_delay if ready_after is None else ready_after
+        self.contents[message_id] = (data, content_type, time.time() + delay)
+
+    def _corpus_content(self, message_id):
+        if not self.corpus:
+            return None
+        index = int(hashlib.sha256(message_id.encode()).hexdigest(), 16) % len(self.corpus)
+        path = self.corpus[index]
+        with open(path, "rb") as f:
+            self.add_content(message_id, f.read(), content_type_for(path))
+        return self.contents[message_id]
+
+    async def _simulate_latency(self):
+        if self.api_latency:
+            await asyncio.sleep(self.api_latency)
+
+    @staticmethod
+    def _authorized(request):
+        return request.headers.get("Authorization", "").startswith("Bearer ")
+
+    async def get_content(self, request):
+        self.content_requests += 1
+        if not self._authorized(request):
+            return web.json_response({"message": "Authentication failed"}, status=401)
+        await self._simulate_latency()
+        message_id = request.match_info["message_id"]
+        stored = self.contents.get(message_id) or self._corpus_content(message_id)
+        if stored is None:
+            self.not_found += 1
+            return web.json_response({"message": "Not found"}, status=404)
+        data, content_type, ready_at = stored
+        if time.time() < ready_at:
+            self.not_ready += 1
+            return web.Response(status=202)
+        return web.Response(body=data, content_type=content_type)
+
+    async def put_content(self, request):
+        ready_after = request.query.get("ready_after")
+        self.add_content(
+            request.match_info["message_id"], await request.read(),
+            request.headers.get("Content-Type", "application/octet-stream"),
+            float(ready_after) if ready_after is not None else None,
+        )
+        return web.json_response({"ok": True})
+
+    @staticmethod
+    def _sent_messages(messages):
+        return {"sentMessages": [{"id": uuid.uuid4().hex[:18], "quoteToken": uuid.uuid4().hex} for _ in messages]}
+
+    async def reply(self, request):
+        if not self._authorized(request):
+            return web.json_response({"message": "Authentication failed"}, status=401)
+        body = await request.json()
+        await self._simulate_latency()
+        self.replies.append({
+            "reply_token": body.get("replyToken"),
+            "texts": [m.get("text", "") for m in body.get("messages", [])],
+            "received_at": time.time(),
+        })
+        return web.json_response(self._sent_messages(body.get("messages", [])))
+
+    async def push(self, request):
+        if not self._authorized(request):
+            return web.json_response({"message": "Authentication failed"}, status=401)
+        body = await request.json()
+        await self._simulate_latency()
+        self.pushes.append({
+            "to": body.get("to"),
+            "texts": [m.get("text", "") for m in body.get("messages", [])],
+            "received_at": time.time(),
+        })
+        return web.json_response(self._sent_messages(body.get("messages", [])))
+
+    async def records(self, request):
+        since = float(request.query.get("since", 0))
+        return web.json_response({
+            "replies": [r for r in self.replies if r["received_at"] >= since],
+            "pushes": [p for p in self.pushes if p["received_at"] >= since],
+        })
+
+    async def stats(self, request):
+        return web.json_response({
+            "contents": len(self.contents),
+            "content_requests": self.content_requests,
+            "not_ready": self.not_ready,
+            "not_found": self.not_found,
+            "replies": len(self.replies),
+            "pushes": len(self.pushes),
+        })
+
+    async def reset_records(self, request):
+        self.reset()
+        return web.json_response({"ok": True})
+
+
+def create_app(content_delay=0.0, api_latency=0.0, corpus_dir=None):
+    fake = FakeLine(content_delay, api_latency, corpus_dir)
+    app = web.Application(client_max_size=1024 * 1024 * 1024)
+    app.router.add_get("/v2/bot/message/{message_id}/content", fake.get_content)
+    app.router.add_post("/v2/bot/message/reply", fake.reply)
+    app.router.add_post("/v2/bot/message/push", fake.push)
+    app.router.add_put("/_content/{message_id}", fake.put_content)
+    app.router.add_get("/_records", fake.records)
+    app.router.add_get("/_stats", fake.stats)
+    app.router.add_post("/_reset", fake.reset_records)
+    app["fake"] = fake
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="假 LINE Messaging API (訊息內容、回覆、推送)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--corpus", help="沒有登錄過的 message_id 從這個資料夾挑選音訊檔回傳")
+    parser.add_argument("--content-delay", type=float, default=0.0, help="內容登錄後多少秒內回傳 HTTP 202")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="每個 API 請求額外的延遲秒數")
+    args = parser.parse_args()
+    web.run_app(create_app(args.content_delay, args.api_latency, args.corpus), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""
+本機的假 S3 物件儲存，用來離線測試 TRANSCRIPT_STORE_BACKEND=s3。
+
+    python tools/fake_s3.py --port 9000
+
+接著讓 Bot 指向它（boto3 需要有任意一組金鑰）：
+
+    TRANSCRIPT_STORE_BACKEND=s3 TRANSCRIPT_S3_ENDPOINT_URL=http://127.0.0.1:9000 \\
+        AWS_ACCESS_KEY_ID=fake AWS_SECRET_ACCESS_KEY=fake TRANSCRIPT_S3_REGION=us-east-1 python app.py
+
+只支援 path-style 的 PutObject / GetObject / HeadObject / DeleteObject，不驗證簽章，
+會保存上傳時的 Content-Type 與 Content-Encoding 並在下載時原樣回傳。
+GET /_stats 可以查看物件數、總大小與各操作的次數，POST /_reset 會清除所有物件。
+"""
+import argparse
+import hashlib
+import time
+from email.utils import formatdate
+
+from aiohttp import web
+
+_NO_SUCH_KEY = (
+    '<?xml version="1.0" encoding="UTF-8"?>'
+    "<Error><Code>NoSuchKey</Code><Message>The specified key does not exist.</Message></Error>"
+)
+
+
+def decode_aws_chunked(body):
+    """
+    解開 aws-chunked 編碼（新版 botocore 上傳時附加 checksum 會使用）：
+    每段為「十六進位長度[;chunk-signature=...]\\r\\n資料\\r\\n」，長度 0 的段落之後是 trailer。
+    """
+    data = bytearray()
+    pos = 0
+    while True:
+        line_end = body.index(b"\r\n", pos)
+        size = int(body[pos:line_end].split(b";", 1)[0], 16)
+        pos = line_end + 2
+        if size == 0:
+            return bytes(data)
+        data += body[pos:pos + size]
+        pos += size + 2
+
+
+class FakeS3:
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.objects = {}  # (bucket, key) -> (data, content_type, content_encoding, last_modified)
+        self.operations = {"put": 0, "get": 0, "head": 0, "delete": 0}
+
+    @staticmethod
+    def _location(request):
+        return request.match_info["bucket"], request.match_info["key"]
+
+    def _headers(self, data, content_type, content_encoding, last_modified):
+        headers = {
+            "Content-Type": content_type,
+            "ETag": f'"{hashlib.md5(data).hexdigest()}"',
+            "Last-Modified": formatdate(last_modified, usegmt=True),
+        }
+        if content_encoding:
+            headers["Content-Encoding"] = content_encoding
+        return headers
+
+    async def put_object(self, request):
+        self.operations["put"] += 1
+        body = await request.read()
+        encodings = [e.strip() for e in request.headers.get("Content-Encoding", "").split(",") if e.strip()]
+        if "aws-chunked" in encodings or request.headers.get("x-amz-content-sha256", "").startswith("STREAMING-"):
+            body = decode_aws_chunked(body)
+            encodings = [e for e in encodings if e != "aws-chunked"]
+        content_type = request.headers.get("Content-Type", "binary/octet-stream")
+        self.objects[self._location(request)] = (body, content_type, ",".join(encodings), time.time())
+        return web.Response(headers={"ETag": f'"{hashlib.md5(body).hexdigest()}"'})
+
+    async def get_object(self, request):
+        self.operations["get"] += 1
+        stored = self.objects.get(self._location(request))
+        if stored is None:
+            return web.Response(status=404, text=_NO_SUCH_KEY, content_type="application/xml")
+        data, content_type, content_encoding, last_modified = stored
+        return web.Response(body=data, headers=self._headers(data, content_type, content_encoding, last_modified))
+
+    async def head_object(self, request):
+        self.operations["head"] += 1
+        stored = self.objects.get(self._location(request))
+        if stored is None:
+            return web.Response(status=404)
+        data, content_type, content_encoding, last_modified = stored
+        headers = self._headers(data, content_type, content_encoding, last_modified)
+        headers["Content-Length"] = str(len(data))
+        return web.Response(headers=headers)
+
+    async def delete_object(self, request):
+        self.operations["delete"] += 1
+        self.objects.pop(self._location(request), None)
+        return web.Response(status=204)
+
+    async def create_bucket(self, request):
+        return web.Response()
+
+    async def stats(self, request):
+        return web.json_response({
+            "objects": len(self.objects),
+            "bytes": sum(len(stored[0]) for stored in self.objects.values()),
+            "operations": self.operations,
+        })
+
+    async def reset_objects(self, request):
+        self.reset()
+        return web.json_response({"ok": True})
+
+
+def create_app():
+    fake = FakeS3()
+    app = web.Application(client_max_size=1024 * 1024 * 1024)
+    app.router.add_get("/_stats", fake.stats)
+    app.router.add_post("/_reset", fake.reset_objects)
+    app.router.add_put("/{bucket}", fake.create_bucket)
+    # HEAD 由 head_object 回傳 Content-Length，GET 不另外自動註冊 HEAD
+    app.router.add_route("HEAD", "/{bucket}/{key:.+}", fake.head_object)
+    app.router.add_put("/{bucket}/{key:.+}", fake.put_object)
+    app.router.add_get("/{bucket}/{key:.+}", fake.get_object, allow_head=False)
+    app.router.add_delete("/{bucket}/{key:.+}", fake.delete_object)
+    app["fake"] = fake
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="假 S3 相容物件儲存 (path-style)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    args = parser.parse_args()
+    web.run_app(create_app(), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,496 @@
+"""
+端到端壓力測試：以假 LINE 平台與假 Gemini 重播簽章過的 webhook，量測 /callback → 背景轉錄 → 推送結果 的吞吐量與延遲。
+
+語料資料夾放幾個長度不同的音訊檔，每個工作依序輪流使用其中一個：
+
+    python tools/load_test.py corpus/ --spawn-bot --jobs 40 --events-per-webhook 4 --webhooks-per-second 2 \\
+        --env TRANSCRIBE_WORKERS=2 --json run.json --baseline baseline.json
+
+- 假 LINE (tools/fake_line.py) 與假 Gemini (tools/fake_gemini.py) 在本程序內啟動；
+  也可以用 --line-url / --gemini-url 指向另外啟動的服務。
+- --spawn-bot 會以乾淨的暫存資料夾 (工作佇列、結果快取、逐字稿) 啟動 app.py，預設停用結果快取，
+  讓重複使用的語料也會真的轉錄；--spawn-workers N 則改用 JOB_BACKEND=sqlite 並另外啟動 worker.py。
+  不使用 --spawn-bot 時，請自行以 LINE_API_BASE_URL、LINE_DATA_API_BASE_URL、GEMINI_API_BASE_URL 指向假服務，
+  並以 --pid 指定要量測資源用量的程序。
+- 正式量測前先送 --warmup-jobs 個工作並等待結果，模型載入時間不計入結果。
+
+輸出每分鐘完成的工作數、webhook 回應時間、收到「處理中」確認回覆 (ack) 與收到最終結果的 p50/p95/p99，
+以及 Bot 程序 (含子程序) 的最高 RSS 與 CPU 使用量。指定 --baseline 時會列出與先前結果的差異。
+"""
+import argparse
+import asyncio
+import base64
+import hashlib
+import hmac
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+from aiohttp import ClientSession, ClientTimeout, web
+
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(TOOLS_DIR)
+sys.path.insert(0, TOOLS_DIR)
+
+import fake_gemini  # noqa: E402
+import fake_line  # noqa: E402
+
+PROGRESS_PREFIX = "逐字稿進度"
+QUEUE_FULL_MARKER = "排隊處理的音訊太多"
+CACHED_MARKER = "之前分析過"
+ERROR_PREFIXES = ("抱歉", "哎呀", "語音轉錄完成，但摘要服務")
+
+# 以不使用 reloader 的方式啟動 Flask，量測到的 PID 就是實際處理請求的程序
+BOT_SCRIPT = (
+    "import os\n"
+    "from app import app\n"
+    "app.run(host='127.0.0.1', port=int(os.environ['PORT']), threaded=True)\n"
+)
+
+# 與 baseline 比較時列出的項目
+COMPARE_KEYS = (
+    "jobs_per_minute", "callback_p95", "ack_p50", "ack_p95", "ack_p99",
+    "result_p50", "result_p95", "result_p99", "peak_rss_mb", "cpu_seconds", "avg_cpu_cores",
+)
+
+
+def percentile(values, p):
+    """最近秩 (nearest-rank) 百分位數，沒有資料時回傳 None。"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+def sign(body, channel_secret):
+    digest = hmac.new(channel_secret.encode("utf-8"), body, hashlib.sha256).digest()
+    return base64.b64encode(digest).decode("ascii")
+
+
+class Job:
+    __slots__ = ("message_id", "user_id", "reply_token", "event_id", "clip", "sent_at", "callback_seconds",
+                 "callback_status", "ack_at", "ack_text", "result_at", "result_text", "results")
+
+    def __init__(self, index, run_id, clip):
+        self.message_id = f"{run_id}{index:06d}"
+        self.user_id = "U" + uuid.uuid4().hex
+        self.reply_token = uuid.uuid4().hex
+        self.event_id = "01" + uuid.uuid4().hex[:24].upper()
+        self.clip = clip
+        self.sent_at = None
+        self.callback_seconds = None
+        self.callback_status = None
+        self.ack_at = None
+        self.ack_text = None
+        self.result_at = None
+        self.result_text = None
+        self.results = 0
+
+    def event(self, redelivery=False):
+        return {
+            "type": "message",
+            "mode": "active",
+            "timestamp": int(time.time() * 1000),
+            "source": {"type": "user", "userId": self.user_id},
+            "webhookEventId": self.event_id,
+            "deliveryContext": {"isRedelivery": redelivery},
+            "replyToken": self.reply_token,
+            "message": {"id": self.message_id, "type": "audio", "contentProvider": {"type": "line"}},
+        }
+
+    @property
+    def rejected(self):
+        return self.ack_text is not None and QUEUE_FULL_MARKER in self.ack_text
+
+    @property
+    def done(self):
+        return self.result_at is not None or self.rejected
+
+
+class ResourceSampler:
+    """定期讀取 /proc，統計指定程序及其所有子程序的 RSS 與 CPU 時間。"""
+
+    def __init__(self, pids, interval=0.5):
+        self.root_pids = list(pids)
+        self.interval = interval
+        self.peak_rss_bytes = 0
+        self._ticks_first = {}
+        self._ticks_last = {}
+        self._clock_ticks = os.sysconf("SC_CLK_TCK")
+        self._task = None
+        self._started_at = None
+        self._stopped_at = None
+
+    @staticmethod
+    def _children(pid):
+        children = []
+        try:
+            for tid in os.listdir(f"/proc/{pid}/task"):
+                with open(f"/proc/{pid}/task/{tid}/children") as f:
+                    children.extend(int(c) for c in f.read().split())
+        except OSError:
+            pass
+        return children
+
+    def _all_pids(self):
+        pids, pending = set(), list(self.root_pids)
+        while pending:
+            pid = pending.pop()
+            if pid not in pids:
+                pids.add(pid)
+                pending.extend(self._children(pid))
+        return pids
+
+    def sample(self):
+        rss_bytes = 0
+        for pid in self._all_pids():
+            try:
+                with open(f"/proc/{pid}/status") as f:
+                    for line in f:
+                        if line.startswith("VmRSS:"):
+                            rss_bytes += int(line.split()[1]) * 1024
+                            break
+                with open(f"/proc/{pid}/stat") as f:
+                    fields = f.read().rsplit(")", 1)[1].split()
+            except (OSError, IndexError):
+                continue  # 程序已結束
+            ticks = int(fields[11]) + int(fields[12])  # utime + stime
+            self._ticks_first.setdefault(pid, ticks)
+            self._ticks_last[pid] = ticks
+        self.peak_rss_bytes = max(self.peak_rss_bytes, rss_bytes)
+
+    async def _run(self):
+        while True:
+            self.sample()
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if not self.root_pids:
+            return
+        self._started_at = time.time()
+        self._task = asyncio.ensure_future(self._run())
+
+    def stop(self):
+        if self._task is None:
+            return {}
+        self._task.cancel()
+        self.sample()
+        self._stopped_at = time.time()
+        cpu_seconds = sum(self._ticks_last[pid] - self._ticks_first[pid] for pid in self._ticks_last) / self._clock_ticks
+        wall = max(1e-9, self._stopped_at - self._started_at)
+        return {
+            "peak_rss_mb": round(self.peak_rss_bytes / 1024 / 1024, 1),
+            "cpu_seconds": round(cpu_seconds, 1),
+            "avg_cpu_cores": round(cpu_seconds / wall, 2),
+        }
+
+
+def load_corpus(corpus_dir):
+    clips = []
+    for filename in sorted(os.listdir(corpus_dir)):
+        if filename.lower().endswith(fake_line.AUDIO_EXTENSIONS):
+            with open(os.path.join(corpus_dir, filename), "rb") as f:
+                clips.append((filename, f.read(), fake_line.content_type_for(filename)))
+    return clips
+
+
+async def start_fake(app, port):
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    return runner
+
+
+def spawn_bot(args, line_url, gemini_url, data_dir):
+    env = dict(os.environ)
+    env.update({
+        "PORT": str(args.bot_port),
+        "LINE_CHANNEL_SECRET": args.channel_secret,
+        "LINE_CHANNEL_ACCESS_TOKEN": "fake-access-token",
+        "LINE_API_BASE_URL": line_url,
+        "LINE_DATA_API_BASE_URL": line_url,
+        "GEMINI_API_BASE_URL": gemini_url,
+        "GEMINI_API_KEY": "fake",
+        "YOUR_PUBLIC_BASE_URL": f"http://127.0.0.1:{args.bot_port}",
+        "JOB_DB_PATH": os.path.join(data_dir, "jobs.sqlite3"),
+        "RESULT_CACHE_DB_PATH": os.path.join(data_dir, "result_cache.sqlite3"),
+        "TRANSCRIPT_STORE_DIR": os.path.join(data_dir, "transcripts"),
+        "TRANSCRIPT_DB_PATH": os.path.join(data_dir, "transcripts.sqlite3"),
+    })
+    if not args.allow_cache:
+        env["RESULT_CACHE_TTL_DAYS"] = "0"
+    if args.spawn_workers:
+        env["JOB_BACKEND"] = "sqlite"
+    for item in args.env or []:
+        key, _, value = item.partition("=")
+        env[key] = value
+
+    log = open(os.path.join(data_dir, "bot.log"), "wb")
+    processes = [subprocess.Popen([sys.executable, "-c", BOT_SCRIPT], cwd=REPO_DIR, env=env,
+                                  stdout=log, stderr=subprocess.STDOUT)]
+    if args.spawn_workers:
+        processes.append(subprocess.Popen(
+            [sys.executable, "worker.py", "--processes", str(args.spawn_workers)],
+            cwd=REPO_DIR, env=env, stdout=log, stderr=subprocess.STDOUT,
+        ))
+    print(f"已啟動 Bot (PID {processes[0].pid})，輸出記錄在 {log.name}")
+    return processes
+
+
+async def wait_until_up(session, bot_url, processes, timeout=120):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if any(p.poll() is not None for p in processes):
+            raise RuntimeError("Bot 程序啟動失敗，請查看 bot.log")
+        try:
+            async with session.get(f"{bot_url}/healthz") as response:
+                if response.status == 200:
+                    return
+        except Exception:
+            pass
+        await asyncio.sleep(0.5)
+    raise RuntimeError(f"Bot 在 {timeout} 秒內沒有回應 /healthz")
+
+
+async def register_content(session, line_url, jobs, content_delay):
+    for job in jobs:
+        _, data, content_type = job.clip
+        url = f"{line_url}/_content/{job.message_id}"
+        params = {"ready_after": str(content_delay)} if content_delay is not None else {}
+        async with session.put(url, data=data, params=params, headers={"Content-Type": content_type}) as response:
+            response.raise_for_status()
+
+
+async def post_webhook(session, bot_url, channel_secret, jobs, redelivery=False):
+    body = json.dumps({
+        "destination": "Ufake-destination",
+        "events": [job.event(redelivery) for job in jobs],
+    }, ensure_ascii=False).encode("utf-8")
+    headers = {"Content-Type": "application/json", "X-Line-Signature": sign(body, channel_secret)}
+    start = time.time()
+    async with session.post(f"{bot_url}/callback", data=body, headers=headers) as response:
+        await response.read()
+        return response.status, time.time() - start, start
+
+
+async def send_jobs(session, args, bot_url, jobs):
+    """依 --events-per-webhook 分批、--webhooks-per-second 的速率送出 webhook；部分批次會以重送的形式再送一次。"""
+    batches = [jobs[i:i + args.events_per_webhook] for i in range(0, len(jobs), args.events_per_webhook)]
+    redeliveries = []
+
+    async def send(batch, delay):
+        await asyncio.sleep(delay)
+        status, seconds, sent_at = await post_webhook(session, bot_url, args.channel_secret, batch)
+        for job in batch:
+            job.sent_at, job.callback_seconds, job.callback_status = sent_at, seconds, status
+        if random.random() < args.redelivery_rate:
+            await asyncio.sleep(args.redelivery_delay)
+            await post_webhook(session, bot_url, args.channel_secret, batch, redelivery=True)
+            redeliveries.append(len(batch))
+
+    interval = 1.0 / args.webhooks_per_second if args.webhooks_per_second > 0 else 0.0
+    await asyncio.gather(*(send(batch, i * interval) for i, batch in enumerate(batches)))
+    return sum(redeliveries)
+
+
+async def collect_records(session, line_url, jobs, since):
+    async with session.get(f"{line_url}/_records", params={"since": str(since)}) as response:
+        records = await response.json()
+    by_token = {job.reply_token: job for job in jobs}
+    by_user = {job.user_id: job for job in jobs}
+    for job in jobs:
+        job.results = 0
+    for reply in records["replies"]:
+        job = by_token.get(reply["reply_token"])
+        if job is not None and job.ack_at is None:
+            job.ack_at, job.ack_text = reply["received_at"], "\n".join(reply["texts"])
+    for push in sorted(records["pushes"], key=lambda p: p["received_at"]):
+        job = by_user.get(push["to"])
+        text = "\n".join(push["texts"])
+        if job is None or text.startswith(PROGRESS_PREFIX):
+            continue
+        job.results += 1
+        if job.result_at is None:
+            job.result_at, job.result_text = push["received_at"], text
+
+
+async def wait_for_results(session, line_url, jobs, since, timeout):
+    deadline = time.time() + timeout
+    while True:
+        await collect_records(session, line_url, jobs, since)
+        if all(job.done for job in jobs) or time.time() > deadline:
+            return
+        await asyncio.sleep(0.5)
+
+
+def summarize(jobs, redelivered_events, resources):
+    completed = [job for job in jobs if job.result_at is not None]
+    first_sent = min((job.sent_at for job in jobs if job.sent_at), default=None)
+    last_result = max((job.result_at for job in completed), default=None)
+    span = (last_result - first_sent) if completed and first_sent else None
+
+    def stat(values, p):
+        value = percentile(values, p)
+        return round(value, 3) if value is not None else None
+
+    callback = [job.callback_seconds for job in jobs if job.callback_seconds is not None]
+    ack = [job.ack_at - job.sent_at for job in jobs if job.ack_at and job.sent_at]
+    result = [job.result_at - job.sent_at for job in completed if job.sent_at]
+    errors = [job for job in completed if job.result_text.startswith(ERROR_PREFIXES)]
+    summary = {
+        "jobs": len(jobs),
+        "completed": len(completed),
+        "rejected": sum(1 for job in jobs if job.rejected),
+        "timed_out": sum(1 for job in jobs if not job.done),
+        "errors": len(errors),
+        "cached": sum(1 for job in completed if CACHED_MARKER in job.result_text),
+        "callback_failures": sum(1 for job in jobs if job.callback_status not in (None, 200)),
+        "redelivered_events": redelivered_events,
+        "duplicate_results": sum(max(0, job.results - 1) for job in jobs),
+        "duration_seconds": round(span, 1) if span else None,
+        "jobs_per_minute": round(len(completed) / span * 60, 2) if span else None,
+    }
+    for name, values in (("callback", callback), ("ack", ack), ("result", result)):
+        for p in (50, 95, 99):
+            summary[f"{name}_p{p}"] = stat(values, p)
+    summary.update(resources)
+    return summary
+
+
+def print_summary(summary, baseline=None):
+    print(f"\n工作數 {summary['jobs']}：完成 {summary['completed']}、佇列已滿被拒 {summary['rejected']}、"
+          f"逾時 {summary['timed_out']}、錯誤 {summary['errors']}、命中快取 {summary['cached']}")
+    print(f"重送事件 {summary['redelivered_events']} 個，重複推送的結果 {summary['duplicate_results']} 個，"
+          f"webhook 失敗 {summary['callback_failures']} 次")
+    print(f"\n{'項目':<18}{'本次':>12}" + (f"{'baseline':>12}{'變化':>10}" if baseline else ""))
+    for key in ("duration_seconds",) + COMPARE_KEYS + ("callback_p50", "callback_p99"):
+        value = summary.get(key)
+        line = f"{key:<18}{str(value):>12}"
+        if baseline:
+            base = baseline.get(key)
+            change = f"{(value - base) / base * 100:+.1f}%" if value is not None and base else ""
+            line += f"{str(base):>12}{change:>10}"
+        print(line)
+
+
+async def run(args):
+    clips = load_corpus(args.corpus)
+    if not clips:
+        raise SystemExit(f"{args.corpus} 中沒有音訊檔")
+
+    runners = []
+    line_url, gemini_url = args.line_url, args.gemini_url
+    if not line_url:
+        runners.append(await start_fake(fake_line.create_app(args.content_delay, args.api_latency), args.fake_line_port))
+        line_url = f"http://127.0.0.1:{args.fake_line_port}"
+    if not gemini_url:
+        runners.append(await start_fake(
+            fake_gemini.create_app(latency=args.gemini_latency, jitter=0.0, rpm=args.gemini_rpm), args.fake_gemini_port
+        ))
+        gemini_url = f"http://127.0.0.1:{args.fake_gemini_port}"
+
+    processes = []
+    data_dir = tempfile.mkdtemp(prefix="linebot_load_test_")
+    bot_url = args.bot_url
+    pids = list(args.pid or [])
+    random.seed(args.seed)
+    try:
+        async with ClientSession(timeout=ClientTimeout(total=60)) as session:
+            if args.spawn_bot:
+                processes = spawn_bot(args, line_url, gemini_url, data_dir)
+                bot_url = f"http://127.0.0.1:{args.bot_port}"
+                pids = [p.pid for p in processes]
+                await wait_until_up(session, bot_url, processes)
+
+            run_id = str(int(time.time()))
+            if args.warmup_jobs:
+                warmup = [Job(i, run_id + "9", clips[i % len(clips)]) for i in range(args.warmup_jobs)]
+                print(f"暖機：送出 {len(warmup)} 個工作並等待結果...")
+                since = time.time()
+                await register_content(session, line_url, warmup, 0.0)
+                await post_webhook(session, bot_url, args.channel_secret, warmup)
+                await wait_for_results(session, line_url, warmup, since, args.timeout)
+
+            jobs = [Job(i, run_id + "0", clips[i % len(clips)]) for i in range(args.jobs)]
+            await register_content(session, line_url, jobs, args.content_delay)
+            sampler = ResourceSampler(pids)
+            sampler.start()
+            since = time.time()
+            print(f"送出 {len(jobs)} 個工作 (每個 webhook {args.events_per_webhook} 個事件)...")
+            redelivered = await send_jobs(session, args, bot_url, jobs)
+            await wait_for_results(session, line_url, jobs, since, args.timeout)
+            resources = sampler.stop()
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        for runner in runners:
+            await runner.cleanup()
+
+    summary = summarize(jobs, redelivered, resources)
+    summary["config"] = {
+        "corpus": [name for name, _, _ in clips],
+        "jobs": args.jobs,
+        "events_per_webhook": args.events_per_webhook,
+        "webhooks_per_second": args.webhooks_per_second,
+        "content_delay": args.content_delay,
+        "gemini_latency": args.gemini_latency,
+        "env": args.env or [],
+    }
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="以假 LINE / Gemini 重播 webhook 的端到端壓力測試")
+    parser.add_argument("corpus", help="放測試音訊檔的資料夾")
+    parser.add_argument("--jobs", type=int, default=20, help="要送出的音訊工作數")
+    parser.add_argument("--events-per-webhook", type=int, default=1, help="每個 webhook 請求包含的事件數")
+    parser.add_argument("--webhooks-per-second", type=float, default=0.0, help="webhook 的送出速率；0 表示一次全部送出")
+    parser.add_argument("--redelivery-rate", type=float, default=0.0, help="被再送一次 (isRedelivery=true) 的 webhook 比例")
+    parser.add_argument("--redelivery-delay", type=float, default=1.0)
+    parser.add_argument("--warmup-jobs", type=int, default=1, help="正式量測前先完成的工作數，不計入結果")
+    parser.add_argument("--timeout", type=float, default=1800, help="送出後最多等待結果的秒數")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--channel-secret", default="load-test-secret")
+    parser.add_argument("--bot-url", default="http://127.0.0.1:5000", help="未使用 --spawn-bot 時 Bot 的位址")
+    parser.add_argument("--pid", type=int, action="append", help="未使用 --spawn-bot 時要量測資源用量的程序 (含子程序)")
+    parser.add_argument("--spawn-bot", action="store_true", help="以乾淨的暫存資料啟動 app.py")
+    parser.add_argument("--spawn-workers", type=int, default=0, help="搭配 --spawn-bot，改用 JOB_BACKEND=sqlite 並啟動這麼多個 worker 程序")
+    parser.add_argument("--bot-port", type=int, default=5055)
+    parser.add_argument("--env", action="append", help="傳給 Bot 的環境變數，例如 TRANSCRIBE_WORKERS=2，可重複指定")
+    parser.add_argument("--allow-cache", action="store_true", help="不停用結果快取")
+    parser.add_argument("--line-url", help="使用另外啟動的假 LINE API")
+    parser.add_argument("--gemini-url", help="使用另外啟動的假 Gemini API")
+    parser.add_argument("--fake-line-port", type=int, default=8081)
+    parser.add_argument("--fake-gemini-port", type=int, default=8090)
+    parser.add_argument("--content-delay", type=float, default=0.0, help="假 LINE 回傳 HTTP 202 的秒數")
+    parser.add_argument("--api-latency", type=float, default=0.05, help="假 LINE 每個 API 請求的延遲秒數")
+    parser.add_argument("--gemini-latency", type=float, default=1.0, help="假 Gemini 每個請求的延遲秒數")
+    parser.add_argument("--gemini-rpm", type=int, default=0, help="假 Gemini 每分鐘請求上限；0 表示不限制")
+    parser.add_argument("--json", help="將結果寫入此 JSON 檔")
+    parser.add_argument("--baseline", help="與先前 --json 輸出的結果比較")
+    args = parser.parse_args()
+
+    summary = asyncio.run(run(args))
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_summary(summary, baseline)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,368 @@
+"""
+逐字稿儲存：以 gzip 壓縮、依內容雜湊分層存放並去除重複，支援本機資料夾與 S3 相容的物件儲存。
+
+每份逐字稿有一個對外的 transcript_id（放在下載連結中），索引記錄在 SQLite，
+實際內容以 SHA-256 為鍵存成 `ab/cd/<sha256>.txt.gz`，內容相同的逐字稿共用同一個物件。
+背景的清理執行緒會刪除超過保存期限的逐字稿，總大小超過上限時從最久沒有新逐字稿參照的內容開始刪除。
+"""
+import gzip
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS transcripts (
+    transcript_id TEXT PRIMARY KEY,
+    sha256        TEXT NOT NULL,
+    created_at    REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_transcripts_created ON transcripts (created_at);
+CREATE INDEX IF NOT EXISTS idx_transcripts_sha256 ON transcripts (sha256);
+CREATE TABLE IF NOT EXISTS blobs (
+    sha256       TEXT PRIMARY KEY,
+    stored_bytes INTEGER NOT NULL,
+    text_bytes   INTEGER NOT NULL,
+    created_at   REAL NOT NULL
+);
+"""
+
+CONTENT_TYPE = "text/plain; charset=utf-8"
+# put() 先記錄內容物件、上傳完成後才寫入逐字稿索引；這段期間物件沒有任何參照，sweep() 不能把它當成孤兒刪除
+ORPHAN_GRACE_SECONDS = 3600
+
+
+def _blob_key(sha256):
+    # 分兩層子資料夾，避免單一資料夾中有數十萬個檔案
+    return f"{sha256[:2]}/{sha256[2:4]}/{sha256}.txt.gz"
+
+
+class LocalBlobBackend:
+    """把壓縮後的逐字稿存在本機資料夾。"""
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.root, *key.split("/"))
+
+    def put(self, key, data):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # 先寫暫存檔再改名，讀取端不會讀到寫到一半的檔案
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def get(self, key):
+        try:
+            with open(self._path(key), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def url(self, key, expires_seconds):
+        return None  # 由 Flask 路由直接回傳檔案內容
+
+
+class S3BlobBackend:
+    """
+    把壓縮後的逐字稿存在 S3 相容的物件儲存（AWS S3、MinIO、R2 等）。
+
+    物件以 Content-Encoding: gzip 上傳，下載連結使用預先簽署的網址，由物件儲存直接提供內容。
+    需要另外安裝 boto3；本機測試可以搭配 tools/fake_s3.py。
+    """
+
+    def __init__(self, bucket, prefix="transcripts/", endpoint_url=None, region_name=None):
+        try:
+            import boto3
+            from botocore.config import Config
+        except ImportError as e:
+            raise RuntimeError("使用 S3 儲存逐字稿需要安裝 boto3：pip install boto3") from e
+
+        try:
+            # 新版 botocore 預設以 aws-chunked 上傳並附加 checksum，部分 S3 相容服務不支援
+            config = Config(s3={"addressing_style": "path"}, request_checksum_calculation="when_required",
+                            response_checksum_validation="when_required")
+        except TypeError:
+            config = Config(s3={"addressing_style": "path"})
+        self.bucket = bucket
+        self.prefix = prefix
+        self._client = boto3.client("s3", endpoint_url=endpoint_url, region_name=region_name, config=config)
+
+    def put(self, key, data):
+        self._client.put_object(
+            Bucket=self.bucket, Key=self.prefix + key, Body=data,
+            ContentType=CONTENT_TYPE, ContentEncoding="gzip",
+        )
+
+    def get(self, key):
+        try:
+            response = self._client.get_object(Bucket=self.bucket, Key=self.prefix + key)
+        except self._client.exceptions.NoSuchKey:
+            return None
+        return response["Body"].read()
+
+    def delete(self, key):
+        self._client.delete_object(Bucket=self.bucket, Key=self.prefix + key)
+
+    def url(self, key, expires_seconds):
+        return self._client.generate_presigned_url(
+            "get_object", Params={"Bucket": self.bucket, "Key": self.prefix + key}, ExpiresIn=int(expires_seconds),
+        )
+
+
+class StoredTranscript:
+    __slots__ = ("transcript_id", "sha256", "gzip_data", "redirect_url", "draft_path")
+
+    def __init__(self, transcript_id, sha256=None, gzip_data=None, redirect_url=None, draft_path=None):
+        self.transcript_id = transcript_id
+        self.sha256 = sha256
+        self.gzip_data = gzip_data
+        self.redirect_url = redirect_url
+        self.draft_path = draft_path
+
+
+class TranscriptStore:
+    """
+    逐字稿儲存（SQLite 索引 + LocalBlobBackend 或 S3BlobBackend）。
+
+    - put() 以 gzip 壓縮後依內容雜湊存放，內容相同的逐字稿只存一份。
+    - 串流轉錄時可以先用 open_draft() 寫入未壓縮的草稿，讓用戶在轉錄途中就能查看，
+      完成後再以 put() 寫入正式內容並刪除草稿，下載連結不變。
+    - sweep() 刪除超過 ttl_seconds 的逐字稿與草稿，總大小超過 max_bytes 時從最久沒有新逐字稿參照的內容物件開始刪除，
+      沒有任何逐字稿參照（且超過 ORPHAN_GRACE_SECONDS）的內容物件也會一併刪除。
+    - legacy_dir：舊版直接存放在 static/transcripts 的未壓縮逐字稿，超過 ttl_seconds 後同樣刪除。
+    """
+
+    def __init__(self, db_path, backend, drafts_dir, max_bytes=1024 * 1024 * 1024, ttl_seconds=90 * 24 * 3600,
+                 compress_level=6, legacy_dir=None):
+        self.db_path = db_path
+        self.backend = backend
+        self.drafts_dir = drafts_dir
+        self.legacy_dir = legacy_dir
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.compress_level = compress_level
+        self._local = threading.local()
+        self._sweeper = None
+
+        db_dir = os.path.dirname(os.path.abspath(db_path))
+        if not os.path.exists(db_dir):
+            os.makedirs(db_dir)
+        os.makedirs(drafts_dir, exist_ok=True)
+        self._conn().executescript(_SCHEMA)
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def _draft_path(self, transcript_id):
+        return os.path.join(self.drafts_dir, f"{transcript_id}.txt")
+
+    def open_draft(self, transcript_id):
+        """開啟（覆寫）一份未壓縮的草稿，回傳文字模式的檔案物件。"""
+        return open(self._draft_path(transcript_id), "w", encoding="utf-8")
+
+    def discard_draft(self, transcript_id):
+        """刪除草稿（轉錄失敗或沒有語音時），已儲存的正式內容不受影響。"""
+        try:
+            os.remove(self._draft_path(transcript_id))
+        except FileNotFoundError:
+            pass
+
+    def put(self, transcript_id, text):
+        """
+        儲存逐字稿並刪除同 id 的草稿。
+
+        Returns:
+            內容的 SHA-256。
+        """
+        raw = text.encode("utf-8")
+        sha256 = hashlib.sha256(raw).hexdigest()
+        # mtime=0 讓相同內容壓縮出完全相同的 bytes
+        data = gzip.compress(raw, compresslevel=self.compress_level, mtime=0)
+        conn = self._conn()
+        # 先在短交易中記錄內容物件（之後 sweep() 在 ORPHAN_GRACE_SECONDS 內不會刪除它）；內容已存在時在同一個交易中
+        # 寫入逐字稿索引，sweep() 不會在這中間刪除它。上傳不持有資料庫的寫入鎖，上傳完成後才寫入逐字稿索引
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            inserted = conn.execute(
+                "INSERT OR IGNORE INTO blobs (sha256, stored_bytes, text_bytes, created_at) VALUES (?, ?, ?, ?)",
+                (sha256, len(data), len(raw), time.time()),
+            ).rowcount
+            if not inserted:
+                self._index(conn, transcript_id, sha256)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        if inserted:
+            try:
+                self.backend.put(_blob_key(sha256), data)
+            except Exception:
+                # 上傳失敗時撤回紀錄，否則之後相同內容的逐字稿會以為物件已存在而不上傳
+                conn.execute(
+                    "DELETE FROM blobs WHERE sha256 = ? AND sha256 NOT IN (SELECT sha256 FROM transcripts)", (sha256,)
+                )
+                raise
+            self._index(conn, transcript_id, sha256)
+        else:
+            print(f"[transcript_store] 逐字稿 {transcript_id} 與既有內容相同，共用同一份檔案")
+        self.discard_draft(transcript_id)
+        return sha256
+
+    @staticmethod
+    def _index(conn, transcript_id, sha256):
+        conn.execute(
+            "INSERT OR REPLACE INTO transcripts (transcript_id, sha256, created_at) VALUES (?, ?, ?)",
+            (transcript_id, sha256, time.time()),
+        )
+
+    def exists(self, transcript_id):
+        row = self._conn().execute(
+            "SELECT 1 FROM transcripts WHERE transcript_id = ?", (transcript_id,)
+        ).fetchone()
+        return row is not None or os.path.exists(self._draft_path(transcript_id))
+
+    def fetch(self, transcript_id, url_expires_seconds=3600):
+        """
+        取得提供下載所需的資訊。
+
+        Returns:
+            StoredTranscript（gzip_data、redirect_url 或 draft_path 其中之一有值），找不到時回傳 None。
+        """
+        row = self._conn().execute(
+            "SELECT sha256 FROM transcripts WHERE transcript_id = ?", (transcript_id,)
+        ).fetchone()
+        if row is None:
+            draft_path = self._draft_path(transcript_id)
+            if os.path.exists(draft_path):
+                return StoredTranscript(transcript_id, draft_path=draft_path)
+            return None
+        key = _blob_key(row[0])
+        url = self.backend.url(key, url_expires_seconds)
+        if url:
+            return StoredTranscript(transcript_id, row[0], redirect_url=url)
+        data = self.backend.get(key)
+        if data is None:
+            return None
+        return StoredTranscript(transcript_id, row[0], gzip_data=data)
+
+    def sweep(self):
+        """
+        刪除過期與超過大小上限的逐字稿，以及沒有被參照的內容物件與過期草稿。
+
+        Returns:
+            (刪除的逐字稿數, 刪除的內容物件數)
+        """
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            removed = conn.execute(
+                "DELETE FROM transcripts WHERE created_at < ?", (now - self.ttl_seconds,)
+            ).rowcount
+            total = conn.execute("SELECT COALESCE(SUM(stored_bytes), 0) FROM blobs").fetchone()[0]
+            evicted = []
+            if total > self.max_bytes:
+                # 依「最新一份參照它的逐字稿」排序，從最久沒有被用到的內容物件開始，連同參照它的逐字稿一起刪除；
+                # 仍在上傳中、還沒有參照的內容物件不在此列
+                for sha256, stored_bytes in conn.execute(
+                    "SELECT b.sha256, b.stored_bytes FROM blobs b JOIN transcripts t ON t.sha256 = b.sha256 "
+                    "GROUP BY b.sha256 ORDER BY MAX(t.created_at)"
+                ).fetchall():
+                    if total <= self.max_bytes:
+                        break
+                    removed += conn.execute("DELETE FROM transcripts WHERE sha256 = ?", (sha256,)).rowcount
+                    evicted.append(sha256)
+                    total -= stored_bytes
+            orphans = evicted + [r[0] for r in conn.execute(
+                "SELECT sha256 FROM blobs WHERE created_at < ? AND sha256 NOT IN (SELECT sha256 FROM transcripts)",
+                (now - ORPHAN_GRACE_SECONDS,),
+            ).fetchall() if r[0] not in evicted]
+            conn.executemany("DELETE FROM blobs WHERE sha256 = ?", [(sha,) for sha in orphans])
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+        # 索引已提交後才刪除實際內容；刪除失敗的物件只會佔空間，不會被讀到。
+        # 刪除時持有寫入鎖並再確認一次：put() 在這之前重新記錄了相同內容時不刪除；之後才記錄的會在刪除後重新上傳
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for sha256 in orphans:
+                if conn.execute("SELECT 1 FROM blobs WHERE sha256 = ?", (sha256,)).fetchone() is not None:
+                    continue
+                try:
+                    self.backend.delete(_blob_key(sha256))
+                except Exception as e:
+                    print(f"[transcript_store] 刪除內容物件 {sha256} 失敗: {e}")
+        finally:
+            conn.execute("COMMIT")
+        for directory in (self.drafts_dir, self.legacy_dir):
+            if directory:
+                removed += self._remove_expired_files(directory, now)
+        return removed, len(orphans)
+
+    def _remove_expired_files(self, directory, now):
+        removed = 0
+        try:
+            filenames = os.listdir(directory)
+        except FileNotFoundError:
+            return 0
+        for filename in filenames:
+            path = os.path.join(directory, filename)
+            try:
+                if os.path.isfile(path) and now - os.path.getmtime(path) > self.ttl_seconds:
+                    os.remove(path)
+                    removed += 1
+            except FileNotFoundError:
+                pass
+        return removed
+
+    def start_sweeper(self, interval_seconds=3600):
+        """啟動背景清理執行緒，每 interval_seconds 執行一次 sweep()。"""
+        if self._sweeper is not None:
+            return
+
+        def run():
+            while True:
+                time.sleep(interval_seconds)
+                try:
+                    removed, blobs = self.sweep()
+                    if removed or blobs:
+                        print(f"[transcript_store] 清理完成：刪除 {removed} 份逐字稿、{blobs} 個內容物件")
+                except Exception as e:
+                    print(f"[transcript_store] 清理逐字稿失敗: {e}")
+
+        self._sweeper = threading.Thread(target=run, name="transcript-sweeper", daemon=True)
+        self._sweeper.start()
+
+    def stats(self):
+        conn = self._conn()
+        transcripts = conn.execute("SELECT COUNT(*) FROM transcripts").fetchone()[0]
+        blobs, stored, text = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(stored_bytes), 0), COALESCE(SUM(text_bytes), 0) FROM blobs"
+        ).fetchone()
+        return {
+            "transcripts": transcripts,
+            "blobs": blobs,
+            "stored_bytes": stored,
+            "text_bytes": text,
+            "compression_ratio": (text / stored) if stored else 0.0,
+            "max_bytes": self.max_bytes,
+        }
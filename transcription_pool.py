@@ -0,0 +1,284 @@
+"""
+多程序轉錄：主程序載入一次 Whisper 模型後啟動多個轉錄程序，fp32 權重由所有程序共用，不會每個程序各佔一份記憶體。
+
+- 轉錄程序以 spawn 啟動，不繼承主程序的執行緒、鎖或 OpenMP 執行緒池；主程序在載入模型或已有其他執行緒時啟動也是安全的。
+- 密集的權重與 buffer 先以 share_memory_() 移到共享記憶體，再透過 torch.multiprocessing 只把共享記憶體的 handle 傳給轉錄程序。
+  稀疏 tensor（例如 alignment_heads）無法放進共享記憶體，隨模型複製一份給各程序（很小）。
+- int8 量化的 Linear 權重「不會」共享：主程序量化一次後以 torch.save 序列化傳給轉錄程序，每個程序各保存一份
+  （大小約為 fp32 的四分之一）。轉錄程序不需要再從磁碟載入 fp32 模型並量化。
+- 每個轉錄程序綁定一組 CPU 核心 (sched_setaffinity) 並各自設定 torch 執行緒數，程序之間不會搶同一批核心，也沒有 GIL 競爭。
+- 長錄音依安靜處切成多段分給各程序平行轉錄，結果依原本的順序合併。
+- 有轉錄程序意外結束時，下一次 get_pool() 會關閉整個程序池並重新啟動；啟動失敗時等 POOL_RETRY_SECONDS 秒後再試。
+
+以 WHISPER_POOL_PROCESSES 啟用（只支援 CPU 推論）。spawn 出的程序會以 __mp_main__ 重新 import 啟動的主程式
+（例如 python app.py），主程式在這種情況下不能啟動背景服務或載入模型。
+"""
+import atexit
+import itertools
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+import torch
+import torch.multiprocessing  # 註冊 tensor 的 pickle 方式：傳給轉錄程序時只傳共享記憶體的 handle
+
+import whisper_helper
+from audio_utils import find_split_points
+from whisper_helper import SAMPLE_RATE, WHISPER_POOL_PROCESSES, WHISPER_POOL_THREADS
+
+
+POOL_PROCESS_NAME_PREFIX = "whisper-pool-"
+POOL_RETRY_SECONDS = 300  # 程序池啟動失敗後，隔多久再嘗試啟動
+
+
+class PoolWorkerLost(RuntimeError):
+    """轉錄程序意外結束（例如被系統以記憶體不足終止）；whisper_helper.is_transient_error 視為暫時性錯誤，讓呼叫端可以降級重試。"""
+
+
+class PoolWorkerError(RuntimeError):
+    """
+    轉錄程序中發生的例外。torch 的例外不一定能 pickle，因此只傳回原本的型別名稱與訊息，
+    並在轉錄程序中先以 whisper_helper.is_transient_error 判斷好是否為暫時性錯誤 (transient)。
+    """
+
+    def __init__(self, message, error_type="RuntimeError", transient=False):
+        super().__init__(message)
+        self.error_type = error_type
+        self.transient = transient
+
+    def __reduce__(self):
+        return type(self), (str(self), self.error_type, self.transient)
+
+
+def _share_dense_tensors(model):
+    """把模型中密集的權重與 buffer 移到共享記憶體；稀疏 tensor（alignment_heads）不支援，保持原樣。"""
+    for tensor in itertools.chain(model.parameters(), model.buffers()):
+        if not tensor.is_sparse:
+            tensor.share_memory_()
+
+
+def _cpu_groups(num_processes):
+    """把目前可用的 CPU 核心平均分成 num_processes 組；無法取得時回傳 None（不綁定核心）。"""
+    if not hasattr(os, "sched_getaffinity"):
+        return None
+    cpus = sorted(os.sched_getaffinity(0))
+    if len(cpus) < num_processes:
+        return [[cpus[i % len(cpus)]] for i in range(num_processes)]
+    size, extra = divmod(len(cpus), num_processes)
+    groups, start = [], 0
+    for i in range(num_processes):
+        end = start + size + (1 if i < extra else 0)
+        groups.append(cpus[start:end])
+        start = end
+    return groups
+
+
+def _worker_main(backend, index, cpus, num_threads, tasks, results):
+    """轉錄程序的主迴圈（在 spawn 出的子程序中執行）。"""
+    if cpus is not None:
+        os.sched_setaffinity(0, cpus)
+    torch.set_num_threads(num_threads)
+    # 模型已由主程序傳入（fp32 權重在共享記憶體中）；先跑一次空白推論完成初始化
+    backend.transcribe(np.zeros(SAMPLE_RATE, dtype=np.float32))
+    print(f"[transcription_pool] 轉錄程序 {index} (PID {os.getpid()}) 已就緒，"
+          f"CPU: {cpus if cpus is not None else '不限'}，torch 執行緒數: {num_threads}")
+
+    while True:
+        task = tasks.get()
+        if task is None:
+            return
+        task_id, audio, initial_prompt = task
+        try:
+            result = backend.transcribe(audio, initial_prompt=initial_prompt)
+            output = {
+                "text": result["text"].strip(),
+                "segments": [
+                    {"start": seg["start"], "end": seg["end"], "text": seg["text"].strip()}
+                    for seg in result.get("segments", [])
+                ],
+                "language": result.get("language"),
+            }
+            results.put((task_id, output, None))
+        except Exception as e:
+            error = PoolWorkerError(f"{type(e).__name__}: {e}", type(e).__name__, whisper_helper.is_transient_error(e))
+            results.put((task_id, None, error))
+
+
+class TranscriptionPool:
+    """
+    共用同一份 Whisper 模型權重的轉錄程序池。
+
+    submit() 回傳 Future，可以在任意執行緒中等待；transcribe_chunks() 把一段長波形切段後平行轉錄，
+    並依原本的順序逐段產出結果。
+    """
+
+    def __init__(self, backend, num_processes, threads_per_process=0):
+        self.backend = backend
+        self.num_processes = max(1, int(num_processes))
+        self.threads_per_process = threads_per_process
+        self.broken = False  # 有轉錄程序意外結束，get_pool() 會重新建立程序池
+        self._processes = []
+        self._tasks = None
+        self._results = None
+        self._futures = {}
+        self._lock = threading.Lock()
+        self._task_ids = itertools.count()
+        self._dispatcher = None
+
+    def start(self):
+        if torch.cuda.is_available():
+            raise RuntimeError("多程序轉錄模式只支援 CPU 推論，使用 GPU 時請不要設定 WHISPER_POOL_PROCESSES")
+        start_time = time.time()
+        _share_dense_tensors(self.backend.get_model())
+
+        ctx = multiprocessing.get_context("spawn")
+        self._tasks = ctx.Queue()
+        self._results = ctx.Queue()
+        groups = _cpu_groups(self.num_processes)
+        for i in range(self.num_processes):
+            cpus = groups[i] if groups is not None else None
+            num_threads = self.threads_per_process or (len(cpus) if cpus else max(1, torch.get_num_threads() // self.num_processes))
+            process = ctx.Process(
+                target=_worker_main, name=f"{POOL_PROCESS_NAME_PREFIX}{i}",
+                args=(self.backend, i, cpus, num_threads, self._tasks, self._results), daemon=True,
+            )
+            process.start()
+            self._processes.append(process)
+
+        self._dispatcher = threading.Thread(target=self._dispatch_results, name="whisper-pool-results", daemon=True)
+        self._dispatcher.start()
+        atexit.register(self.close)
+        print(f"[transcription_pool] 已啟動 {self.num_processes} 個轉錄程序 ({self.backend.name})，"
+              f"耗時 {time.time() - start_time:.1f} 秒")
+
+    def _dispatch_results(self):
+        while True:
+            try:
+                task_id, output, error = self._results.get(timeout=1.0)
+            except queue.Empty:
+                if not self._processes:
+                    return  # 已關閉
+                dead = [p for p in self._processes if not p.is_alive()]
+                if dead and not self.broken:
+                    self._fail_all(PoolWorkerLost(
+                        f"轉錄程序 {', '.join(p.name for p in dead)} 意外結束 (exit code {dead[0].exitcode})"
+                    ))
+                continue
+            with self._lock:
+                future = self._futures.pop(task_id, None)
+            if future is None:
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(output)
+
+    def _fail_all(self, error):
+        # 有程序結束後，佇列中的工作可能永遠不會被處理（結束的程序可能還持有佇列的鎖）；
+        # 讓等待中的呼叫端降級重試，下一次 get_pool() 再重新建立程序池
+        print(f"[transcription_pool] {error}，將重新啟動轉錄程序")
+        with self._lock:
+            self.broken = True
+            futures, self._futures = list(self._futures.values()), {}
+        for future in futures:
+            future.set_exception(error)
+
+    def submit(self, audio, initial_prompt=None) -> Future:
+        """
+        把一段波形交給轉錄程序。
+
+        Returns:
+            Future，結果為含 text、segments（時間相對於這段波形）、language 的 dict。
+        """
+        future = Future()
+        with self._lock:
+            if self.broken:
+                raise PoolWorkerLost("轉錄程序池已無法使用")
+            task_id = next(self._task_ids)
+            self._futures[task_id] = future
+        self._tasks.put((task_id, np.ascontiguousarray(audio, dtype=np.float32), initial_prompt))
+        return future
+
+    def transcribe_chunks(self, waveform, chunk_seconds):
+        """
+        與 whisper_helper._transcribe_chunks 相同：把波形切成對齊安靜處的片段，但所有片段同時送給轉錄程序平行處理。
+        平行處理時無法把前一段的文字當作 initial_prompt。
+
+        Yields:
+            (該段的轉錄結果 dict，segments 時間已加上片段起點, 片段終點的取樣位置)，順序與原始錄音相同。
+        """
+        points = find_split_points(waveform, chunk_seconds)
+        spans = list(zip(points[:-1], points[1:]))
+        futures = [self.submit(waveform[start:end]) for start, end in spans]
+        try:
+            for (start, end), future in zip(spans, futures):
+                output = future.result()
+                offset = start / SAMPLE_RATE
+                output["segments"] = [
+                    {"start": seg["start"] + offset, "end": seg["end"] + offset, "text": seg["text"]}
+                    for seg in output["segments"]
+                ]
+                yield output, end
+        finally:
+            # 呼叫端提前結束時不再等待剩下的片段；已送出的片段仍會被轉錄，結果直接丟棄
+            with self._lock:
+                for task_id, future in list(self._futures.items()):
+                    if future in futures and not future.done():
+                        del self._futures[task_id]
+
+    def close(self):
+        if self._tasks is None:
+            return
+        processes, self._processes = self._processes, []
+        if self.broken:
+            # 佇列可能已經卡住，不等待剩下的程序自行結束
+            for process in processes:
+                process.terminate()
+            for process in processes:
+                process.join(timeout=10)
+            return
+        for _ in processes:
+            self._tasks.put(None)
+        for process in processes:
+            process.join(timeout=10)
+            if process.is_alive():
+                process.terminate()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+_pool_retry_at = 0.0  # 啟動失敗後，在這個時間 (time.monotonic()) 之前不再嘗試
+
+
+def get_pool():
+    """
+    取得轉錄程序池；未設定 WHISPER_POOL_PROCESSES 或啟動失敗時回傳 None。
+
+    第一次呼叫時載入模型並啟動轉錄程序；有轉錄程序意外結束時，關閉原本的程序池並重新啟動。
+    啟動失敗後 POOL_RETRY_SECONDS 秒內改在主程序中轉錄，之後再嘗試啟動。
+    """
+    global _pool, _pool_retry_at
+    if WHISPER_POOL_PROCESSES <= 1 or time.monotonic() < _pool_retry_at:
+        return None
+    if multiprocessing.current_process().name.startswith(POOL_PROCESS_NAME_PREFIX):
+        return None  # 轉錄程序重新 import 主程式時，不再建立自己的程序池
+    if _pool is None or _pool.broken:
+        with _pool_lock:
+            if _pool is not None and _pool.broken:
+                _pool.close()
+                _pool = None
+            if _pool is None and time.monotonic() >= _pool_retry_at:
+                pool = TranscriptionPool(whisper_helper.main_backend, WHISPER_POOL_PROCESSES, WHISPER_POOL_THREADS)
+                try:
+                    pool.start()
+                except Exception as e:
+                    _pool_retry_at = time.monotonic() + POOL_RETRY_SECONDS
+                    pool.close()
+                    print(f"[transcription_pool] 無法啟動多程序轉錄，{POOL_RETRY_SECONDS} 秒內改在主程序中轉錄: {e}")
+                    return None
+                _pool = pool
+    return _pool
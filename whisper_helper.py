@@ -1,24 +1,707 @@
+import io
+import os
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+import torch
 import whisper
+from audio_utils import decode_audio_bytes, decode_audio_file, decode_audio_fileobj, find_split_points, trim_silence
+from whisper.audio import HOP_LENGTH, N_FFT, N_SAMPLES, SAMPLE_RATE, mel_filters
 # 如果你想使用 OpenAI API 的 Whisper 服務，則需要 from openai import OpenAI
 
-# 載入 Whisper 模型 (本地運行)
-# 只在文件最頂層載入一次，避免每次調用函式都重新載入
-model = whisper.load_model("medium") # 或其他模型大小如 "small", "medium", "large"
+# Whisper 模型 (本地運行)
+# 不在 import 時載入，而是第一次需要時才由對應的 WhisperBackend 載入一次並共用，讓 Web 程序可以快速啟動
+WHISPER_MODEL_NAME = os.getenv("WHISPER_MODEL", "medium") # 或其他模型大小如 "small", "medium", "large"
+
+# --- 推論硬體設定 ---
+# 在只有 CPU 的主機上，將 Linear 層動態量化成 int8 可以明顯加快推論，準確度通常只有些微差異
+WHISPER_QUANTIZE_INT8 = os.getenv("WHISPER_QUANTIZE_INT8", "0") == "1"
+WHISPER_NUM_THREADS = int(os.getenv("WHISPER_NUM_THREADS", "0"))  # torch 的 intra-op 執行緒數，0 表示使用 torch 預設值
+
+# --- 快速模型 ---
+# 設定 WHISPER_FAST_MODEL (例如 "small") 後，不超過 WHISPER_FAST_MAX_SECONDS 秒的短語音先用快速模型轉錄，
+# 平均 log 機率低於 WHISPER_FAST_MIN_LOGPROB（信心不足）時再交給主模型重新轉錄
+WHISPER_FAST_MODEL = os.getenv("WHISPER_FAST_MODEL", "")
+WHISPER_FAST_MAX_SECONDS = float(os.getenv("WHISPER_FAST_MAX_SECONDS", "30"))
+WHISPER_FAST_MIN_LOGPROB = float(os.getenv("WHISPER_FAST_MIN_LOGPROB", "-0.7"))
+
+# --- 批次推論設定 ---
+# 短時間內陸續到達的短語音會被收集成一個批次，一次跑 encoder/decoder
+WHISPER_BATCH_MAX_SIZE = int(os.getenv("WHISPER_BATCH_MAX_SIZE", "8"))  # 每批最多幾段音訊，設為 1 則停用批次
+WHISPER_BATCH_WINDOW_MS = int(os.getenv("WHISPER_BATCH_WINDOW_MS", "200"))  # 第一個請求到達後最多等待多久收集同批請求
+# 超過此長度的音訊改走一般 transcribe。批次推論每段只解碼一個 30 秒視窗（沒有前文與時間戳接續），上限不能超過 30 秒
+WHISPER_BATCH_MAX_AUDIO_SECONDS = min(float(os.getenv("WHISPER_BATCH_MAX_AUDIO_SECONDS", "30")), N_SAMPLES / SAMPLE_RATE)
+# 批次需要多條工作執行緒同時送出請求；只有一條時每批只會有一段音訊，收集窗口只會增加延遲，因此不啟用批次
+TRANSCRIBE_WORKERS = int(os.getenv("TRANSCRIBE_WORKERS", "1"))
+
+# 與 whisper.transcribe 相同的品質判斷門檻，超過時以較高 temperature 重新解碼
+COMPRESSION_RATIO_THRESHOLD = 2.4
+LOGPROB_THRESHOLD = -1.0
+NO_SPEECH_THRESHOLD = 0.6
+FALLBACK_TEMPERATURE = 0.2
+
+# --- 靜音去除 ---
+# 推論前以能量偵測語音區段，長於 WHISPER_VAD_MIN_SILENCE_SECONDS 的靜音 / 空白不送進模型；整段沒有語音時直接略過模型
+WHISPER_VAD = os.getenv("WHISPER_VAD", "1") == "1"
+WHISPER_VAD_MIN_SILENCE_SECONDS = float(os.getenv("WHISPER_VAD_MIN_SILENCE_SECONDS", "1.0"))
+WHISPER_VAD_PADDING_SECONDS = float(os.getenv("WHISPER_VAD_PADDING_SECONDS", "0.2"))
+
+# --- 降級重試 ---
+# 轉錄遇到暫時性錯誤（例如長檔案造成記憶體不足）時，先以切成 WHISPER_DEGRADED_CHUNK_SECONDS 秒的分段模式重試，
+# 仍失敗時再改用較小的 WHISPER_DEGRADED_MODEL 分段轉錄；設為空字串則不改用較小的模型
+WHISPER_DEGRADED_CHUNK_SECONDS = float(os.getenv("WHISPER_DEGRADED_CHUNK_SECONDS", "30"))
+WHISPER_DEGRADED_MODEL = os.getenv("WHISPER_DEGRADED_MODEL", "small")
+
+# --- 多程序轉錄 (transcription_pool.py) ---
+# WHISPER_POOL_PROCESSES 大於 1 時，主程序載入模型後啟動這麼多個共用權重的轉錄程序（只支援 CPU），
+# 每個程序綁定一組 CPU 核心，使用 WHISPER_POOL_THREADS 條 torch 執行緒（0 表示依分到的核心數）。
+# 去除靜音後超過 WHISPER_POOL_MIN_SECONDS 秒的錄音會依安靜處切段平行轉錄，每段至少 WHISPER_POOL_MIN_SHARD_SECONDS 秒
+WHISPER_POOL_PROCESSES = int(os.getenv("WHISPER_POOL_PROCESSES", "0"))
+WHISPER_POOL_THREADS = int(os.getenv("WHISPER_POOL_THREADS", "0"))
+WHISPER_POOL_MIN_SECONDS = float(os.getenv("WHISPER_POOL_MIN_SECONDS", "120"))
+WHISPER_POOL_MIN_SHARD_SECONDS = float(os.getenv("WHISPER_POOL_MIN_SHARD_SECONDS", "30"))
+
+# --- 長音訊串流轉錄設定 ---
+WHISPER_STREAM_CHUNK_SECONDS = float(os.getenv("WHISPER_STREAM_CHUNK_SECONDS", "120"))  # 每段的目標長度，切點會對齊到安靜處
+PROMPT_CONTEXT_CHARS = 200  # 傳給下一段作為 initial_prompt 的前文長度，讓斷句與用字前後一致
+
+if WHISPER_NUM_THREADS > 0:
+    torch.set_num_threads(WHISPER_NUM_THREADS)
+
+
+def _swap_to_plain_linear(module: torch.nn.Module):
+    """
+    將 whisper 自訂的 Linear 子類別換成一般的 torch.nn.Linear（共用同一組權重）。
+
+    quantize_dynamic 只會比對模組的確切型別，whisper.model.Linear 不會被量化，所以要先換掉。
+    """
+    for name, child in module.named_children():
+        if isinstance(child, torch.nn.Linear) and type(child) is not torch.nn.Linear:
+            plain = torch.nn.Linear(child.in_features, child.out_features, bias=child.bias is not None)
+            plain.weight = child.weight
+            plain.bias = child.bias
+            setattr(module, name, plain)
+        else:
+            _swap_to_plain_linear(child)
+
+
+class WhisperBackend:
+    """
+    一組 Whisper 推論設定（模型大小、是否 int8 量化），模型在第一次使用時才載入。
+
+    多條工作執行緒同時呼叫 get_model() 時只會載入一次，其餘呼叫端會等待載入完成。
+    """
+
+    def __init__(self, model_name, quantize_int8=False):
+        self.model_name = model_name
+        self.quantize_int8 = quantize_int8
+        self.status = "not_loaded"  # not_loaded / loading / loaded / failed
+        self._model = None
+        self._lock = threading.Lock()
+
+    @property
+    def name(self):
+        return f"{self.model_name}-int8" if self.quantize_int8 else self.model_name
+
+    def __getstate__(self):
+        # 傳給 transcription_pool 的轉錄程序時使用：已載入的模型一起傳過去，轉錄程序不需要重新載入。
+        # fp32 權重在共享記憶體中；int8 量化的權重無法透過共享記憶體傳遞，先以 torch.save 序列化後複製一份
+        state = self.__dict__.copy()
+        del state["_lock"]
+        if self._model is None:
+            state["status"] = "not_loaded"
+        elif self.quantize_int8:
+            buffer = io.BytesIO()
+            torch.save(self._model, buffer)
+            state["_model"] = buffer.getvalue()
+        return state
+
+    def __setstate__(self, state):
+        if isinstance(state["_model"], bytes):
+            state["_model"] = torch.load(io.BytesIO(state["_model"]), weights_only=False)
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def get_model(self):
+        if self._model is not None:
+            return self._model
+        with self._lock:
+            if self._model is None:
+                self.status = "loading"
+                start_time = time.time()
+                print(f"開始載入 Whisper 模型 {self.name}...")
+                try:
+                    if self.quantize_int8:
+                        # 動態量化只支援 CPU
+                        model = whisper.load_model(self.model_name, device="cpu")
+                        _swap_to_plain_linear(model)
+                        model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+                    else:
+                        model = whisper.load_model(self.model_name)
+                    model.eval()
+                except Exception:
+                    self.status = "failed"
+                    raise
+                self._model = model
+                self.status = "loaded"
+                print(f"Whisper 模型 {self.name} 載入完成，耗時 {time.time() - start_time:.1f} 秒 "
+                      f"(torch 執行緒數: {torch.get_num_threads()})")
+        return self._model
+
+    @property
+    def fp16(self):
+        return self.get_model().device.type == "cuda"
+
+    def log_mel(self, batch: np.ndarray) -> torch.Tensor:
+        """
+        對 (N, N_SAMPLES) 的波形批次一次計算 log-mel 頻譜。
+
+        與 whisper.log_mel_spectrogram 的計算相同，但動態範圍的截斷以「每個片段各自的最大值」為準，
+        因此批次結果與逐一計算一致。
+
+        Returns:
+            形狀為 (N, n_mels, 3000) 的 tensor。
+        """
+        model = self.get_model()
+        audio = torch.from_numpy(batch).to(model.device)
+        window = torch.hann_window(N_FFT).to(audio.device)
+        stft = torch.stft(audio, N_FFT, HOP_LENGTH, window=window, return_complex=True)
+        magnitudes = stft[..., :-1].abs() ** 2
+        mel_spec = mel_filters(audio.device, model.dims.n_mels) @ magnitudes
+        log_spec = torch.clamp(mel_spec, min=1e-10).log10()
+        log_spec = torch.maximum(log_spec, log_spec.amax(dim=(-2, -1), keepdim=True) - 8.0)
+        return (log_spec + 4.0) / 4.0
+
+    def decode(self, mels, temperature=0.0):
+        options = whisper.DecodingOptions(
+            temperature=temperature,
+            without_timestamps=True,
+            fp16=self.fp16,
+        )
+        with torch.inference_mode():
+            return whisper.decode(self.get_model(), mels, options)
+
+    def transcribe(self, audio, **kwargs):
+        """呼叫 whisper 的 transcribe，回傳與 model.transcribe 相同格式的 dict。"""
+        return self.get_model().transcribe(audio, fp16=self.fp16, **kwargs)
+
+
+main_backend = WhisperBackend(WHISPER_MODEL_NAME, WHISPER_QUANTIZE_INT8)
+fast_backend = WhisperBackend(WHISPER_FAST_MODEL, WHISPER_QUANTIZE_INT8) if WHISPER_FAST_MODEL else None
+
+# 目前的轉錄設定，會成為結果快取鍵的一部分；換模型或量化設定後舊的快取不會被誤用
+ASR_CONFIG_ID = main_backend.name + (
+    f"+{fast_backend.name}<{WHISPER_FAST_MAX_SECONDS:g}s" if fast_backend is not None else ""
+) + ("+vad" if WHISPER_VAD else "")
+
+if not WHISPER_DEGRADED_MODEL or WHISPER_DEGRADED_MODEL == WHISPER_MODEL_NAME:
+    degraded_backend = None
+elif fast_backend is not None and fast_backend.model_name == WHISPER_DEGRADED_MODEL:
+    degraded_backend = fast_backend
+else:
+    degraded_backend = WhisperBackend(WHISPER_DEGRADED_MODEL, WHISPER_QUANTIZE_INT8)
+
+_warmup_status = None  # None / warming_up / ready / failed
+_transcribe_workers = TRANSCRIBE_WORKERS
+
 
-def transcribe_audio(filepath: str) -> str:
+class TranscriptionResult:
     """
-    使用本地 Whisper 模型將音訊檔案轉錄為文字。
+    轉錄結果。
+
+    Attributes:
+        status: "ok"、"no_speech"（沒有偵測到語音，未執行模型）或 "error"。
+        text: 轉錄文字；status 為 error 時是可以直接顯示給用戶的錯誤說明。
+        segments: [{"start": 秒, "end": 秒, "text": 文字}]，時間以原始錄音為準。
+        language: 偵測到的語言代碼（例如 "zh"），無法判斷時為 None。
+        audio_seconds: 原始錄音長度（秒）。
+        speech_seconds: 去除靜音後實際送進模型的長度（秒）。
+        elapsed_seconds: 轉錄耗時（秒）。
+        model: 實際產生結果的模型設定，降級重試時會與預設不同。
+        retryable: 錯誤是否為暫時性（例如記憶體不足），稍後重試可能成功。
+        error: 原始的錯誤訊息。
+    """
+
+    __slots__ = ("status", "text", "segments", "language", "audio_seconds", "speech_seconds",
+                 "elapsed_seconds", "model", "retryable", "error")
+
+    def __init__(self, status, text="", segments=None, language=None, audio_seconds=0.0, speech_seconds=0.0,
+                 elapsed_seconds=0.0, model=None, retryable=False, error=None):
+        self.status = status
+        self.text = text
+        self.segments = segments or []
+        self.language = language
+        self.audio_seconds = audio_seconds
+        self.speech_seconds = speech_seconds
+        self.elapsed_seconds = elapsed_seconds
+        self.model = model
+        self.retryable = retryable
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.status == "ok"
+
+
+def is_transient_error(error) -> bool:
+    """
+    判斷轉錄錯誤是否為暫時性（記憶體不足、長音訊造成的注意力長度錯誤、轉錄程序意外結束），
+    換個較省資源的設定可能成功。
+    """
+    if isinstance(error, MemoryError):
+        return True
+    if WHISPER_POOL_PROCESSES > 1:
+        import transcription_pool
+        if isinstance(error, transcription_pool.PoolWorkerLost):
+            return True
+        if isinstance(error, transcription_pool.PoolWorkerError):
+            return error.transient  # 轉錄程序中已依原本的例外判斷過
+    cuda_oom = getattr(torch.cuda, "OutOfMemoryError", None)
+    if cuda_oom is not None and isinstance(error, cuda_oom):
+        return True
+    message = str(error)
+    return ("out of memory" in message.lower() or "can't allocate memory" in message or "Expected key.size" in message
+            or "Key and Value must have the same sequence length" in message)
+
+
+def _release_memory():
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+
+def get_model():
+    """取得主模型，第一次呼叫時才載入。"""
+    return main_backend.get_model()
+
+
+def _get_pool():
+    """有設定 WHISPER_POOL_PROCESSES 時取得（必要時啟動）轉錄程序池，否則回傳 None。"""
+    if WHISPER_POOL_PROCESSES <= 1:
+        return None
+    import transcription_pool
+    return transcription_pool.get_pool()
+
+
+def set_transcribe_workers(num_workers):
+    """設定會同時呼叫 transcribe_audio 的工作執行緒數（worker.py 以 --threads 指定時使用），決定是否啟用批次推論。"""
+    global _transcribe_workers
+    _transcribe_workers = max(1, int(num_workers))
+
+
+def batching_enabled() -> bool:
+    return WHISPER_BATCH_MAX_SIZE > 1 and _transcribe_workers > 1
+
+
+def model_status() -> str:
+    """目前模型的狀態：not_loaded、loading、loaded、warming_up、ready 或 failed。"""
+    return _warmup_status or main_backend.status
+
+
+def warm_up():
+    """
+    載入模型並以一秒的靜音跑一次推論，讓第一個真正的請求不必承擔載入與初始化的延遲。
+    有設定快速模型時也會一併暖機；有設定 WHISPER_POOL_PROCESSES 時，也會一併啟動轉錄程序。
+
+    Raises:
+        載入或推論失敗時直接拋出，狀態會標記為 failed。
+    """
+    global _warmup_status
+    _warmup_status = "warming_up"
+    start_time = time.time()
+    try:
+        _get_pool()
+        for backend in (main_backend, fast_backend):
+            if backend is not None:
+                transcribe_batch([np.zeros(SAMPLE_RATE, dtype=np.float32)], backend)
+    except Exception:
+        _warmup_status = "failed"
+        raise
+    _warmup_status = "ready"
+    print(f"Whisper 模型暖機完成，耗時 {time.time() - start_time:.1f} 秒")
+
+
+def _load_waveform(audio, suffix=".m4a"):
+    """將檔案路徑、記憶體中的音訊內容、檔案物件或波形統一轉成 16kHz 單聲道 float32 NumPy 陣列。"""
+    if isinstance(audio, str):
+        return decode_audio_file(audio)
+    if isinstance(audio, (bytes, bytearray, memoryview)):
+        return decode_audio_bytes(audio, suffix=suffix)
+    if hasattr(audio, "read"):
+        return decode_audio_fileobj(audio, suffix=suffix)
+    return np.asarray(audio, dtype=np.float32)
+
+
+def load_audio(audio, suffix=".m4a"):
+    """
+    載入音訊，回傳 16kHz 單聲道 float32 NumPy 陣列。
 
     Args:
-        filepath: 音訊檔案的路徑。
+        audio: 檔案路徑、下載得到的音訊 bytes 或檔案物件，或已解碼的波形。
+        suffix: 音訊內容無法從管線解碼、需要退回暫存檔時使用的副檔名。
+    """
+    return _load_waveform(audio, suffix)
+
+
+def remove_silence(waveform):
+    """
+    去除波形中的長時間靜音（WHISPER_VAD=0 時原樣回傳）。
 
     Returns:
-        轉錄後的文字。
+        (只含語音區段的波形, SpeechTimeline 或 None)；SpeechTimeline 可把時間換算回原始錄音。
     """
+    if not WHISPER_VAD:
+        return waveform, None
+    start_time = time.time()
+    speech, timeline = trim_silence(
+        waveform,
+        min_silence_seconds=WHISPER_VAD_MIN_SILENCE_SECONDS,
+        padding_seconds=WHISPER_VAD_PADDING_SECONDS,
+    )
+    if len(speech) < len(waveform):
+        print(f"靜音去除：{timeline.original_seconds:.1f} 秒 -> {timeline.speech_seconds:.1f} 秒語音 "
+              f"(耗時 {time.time() - start_time:.2f} 秒)")
+    return speech, timeline
+
+
+def _transcribe_batch_detailed(audios, backend=None) -> list:
+    """
+    transcribe_batch 的實作，另外回傳每段音訊的平均 log 機率、分段與語言。
+
+    超過 30 秒的音訊會在固定的 30 秒處切開、各自解碼，切點上的字可能被切斷；
+    transcribe_audio 只把不超過 WHISPER_BATCH_MAX_AUDIO_SECONDS（最多 30 秒）的音訊交給批次推論。
+
+    Returns:
+        與 audios 順序相同的 dict list，欄位為 text、avg_logprob（沒有任何語音時為 0）、
+        segments（以 30 秒片段為單位，時間相對於該段音訊）與 language。
+    """
+    backend = backend or main_backend
+    waveforms = [_load_waveform(a) for a in audios]
+
+    owners = []  # 每個片段屬於第幾段音訊
+    spans = []   # 每個片段在原始波形中的 (起點, 終點)
+    for index, waveform in enumerate(waveforms):
+        for start in range(0, max(len(waveform), 1), N_SAMPLES):
+            owners.append(index)
+            spans.append((start, min(start + N_SAMPLES, len(waveform))))
+
+    batch = np.zeros((len(spans), N_SAMPLES), dtype=np.float32)
+    for row, (owner, (start, end)) in enumerate(zip(owners, spans)):
+        batch[row, :end - start] = waveforms[owner][start:end]
+
+    mels = backend.log_mel(batch)
+    results = backend.decode(mels)
+
+    # 品質不佳（重複輸出或信心過低）的片段再以較高的 temperature 重新解碼一次
+    retry_rows = [
+        row for row, r in enumerate(results)
+        if r.compression_ratio > COMPRESSION_RATIO_THRESHOLD or r.avg_logprob < LOGPROB_THRESHOLD
+    ]
+    if retry_rows:
+        for row, r in zip(retry_rows, backend.decode(mels[retry_rows], temperature=FALLBACK_TEMPERATURE)):
+            if r.avg_logprob > results[row].avg_logprob:
+                results[row] = r
+
+    outputs = [{"segments": [], "logprobs": [], "language": None} for _ in waveforms]
+    for owner, (start, end), r in zip(owners, spans, results):
+        # 與 whisper.transcribe 相同：判定為無語音的片段（例如補零的尾段）不輸出文字
+        is_silence = r.no_speech_prob > NO_SPEECH_THRESHOLD and r.avg_logprob < LOGPROB_THRESHOLD
+        if is_silence:
+            continue
+        output = outputs[owner]
+        output["language"] = output["language"] or r.language
+        output["logprobs"].append(r.avg_logprob)
+        if r.text.strip():
+            output["segments"].append({"start": start / SAMPLE_RATE, "end": end / SAMPLE_RATE, "text": r.text.strip()})
+    return [
+        {
+            "text": " ".join(seg["text"] for seg in o["segments"]),
+            "avg_logprob": float(np.mean(o["logprobs"])) if o["logprobs"] else 0.0,
+            "segments": o["segments"],
+            "language": o["language"],
+        }
+        for o in outputs
+    ]
+
+
+def transcribe_batch(audios, backend=None) -> list:
+    """
+    以批次方式轉錄多段音訊。
+
+    每段音訊切成 30 秒片段，所有片段以 NumPy 補零成同一個 (N, 480000) 陣列，
+    再一次計算 log-mel 並對整個批次執行 encoder/decoder。適合不超過 30 秒的短語音，
+    較長的音訊請改用 transcribe_audio。
+
+    Args:
+        audios: 音訊檔案路徑或 16kHz float32 波形組成的 list。
+        backend: 使用的 WhisperBackend，預設為主模型。
+
+    Returns:
+        與 audios 順序相同的轉錄文字 list。
+    """
+    return [o["text"] for o in _transcribe_batch_detailed(audios, backend)]
+
+
+class _BatchRequest:
+    __slots__ = ("audio", "future")
+
+    def __init__(self, audio):
+        self.audio = audio
+        self.future = Future()
+
+
+class WhisperBatcher:
+    """
+    把短時間內到達的轉錄請求合併成一個批次。
+
+    第一個請求到達後最多等待 window_seconds，或收集到 max_batch_size 個 30 秒片段即送出推論。
+    每個呼叫端拿到自己的 Future（結果為 _transcribe_batch_detailed 的 dict），可以在任意工作執行緒中等待結果。
+    """
+
+    def __init__(self, backend=None, max_batch_size=WHISPER_BATCH_MAX_SIZE,
+                 window_seconds=WHISPER_BATCH_WINDOW_MS / 1000.0):
+        self.backend = backend or main_backend
+        self.max_batch_size = max_batch_size
+        self.window_seconds = window_seconds
+        self._cond = threading.Condition()
+        self._pending = []
+        self._thread = None
+
+    def submit(self, audio) -> Future:
+        request = _BatchRequest(audio)
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name=f"whisper-batcher-{self.backend.name}",
+                                                daemon=True)
+                self._thread.start()
+            self._pending.append(request)
+            self._cond.notify()
+        return request.future
+
+    @staticmethod
+    def _num_segments(audio):
+        return max(1, -(-len(audio) // N_SAMPLES))
+
+    def _collect(self):
+        with self._cond:
+            while not self._pending:
+                self._cond.wait()
+            deadline = time.monotonic() + self.window_seconds
+            while True:
+                segments = sum(self._num_segments(r.audio) for r in self._pending)
+                remaining = deadline - time.monotonic()
+                if segments >= self.max_batch_size or remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            batch, segments = [], 0
+            while self._pending:
+                n = self._num_segments(self._pending[0].audio)
+                if batch and segments + n > self.max_batch_size:
+                    break
+                batch.append(self._pending.pop(0))
+                segments += n
+            return batch
+
+    def _loop(self):
+        while True:
+            batch = self._collect()
+            start_time = time.time()
+            try:
+                results = _transcribe_batch_detailed([r.audio for r in batch], self.backend)
+                for request, result in zip(batch, results):
+                    request.future.set_result(result)
+            except Exception as e:
+                for request in batch:
+                    request.future.set_exception(e)
+            print(f"Whisper 批次推論完成 ({self.backend.name})：{len(batch)} 段音訊，耗時 {time.time() - start_time:.1f} 秒")
+
+
+batcher = WhisperBatcher(main_backend)
+fast_batcher = WhisperBatcher(fast_backend) if fast_backend is not None else None
+
+
+def _transcribe_chunks(waveform, backend, chunk_seconds):
+    """
+    把波形切成對齊安靜處的片段依序轉錄，前一段的文字作為下一段的 initial_prompt。
+
+    Yields:
+        (該段的轉錄結果 dict，segments 時間已加上片段起點, 片段終點的取樣位置)
+    """
+    points = find_split_points(waveform, chunk_seconds)
+    previous_text = ""
+    for start, end in zip(points[:-1], points[1:]):
+        result = backend.transcribe(
+            waveform[start:end],
+            initial_prompt=previous_text[-PROMPT_CONTEXT_CHARS:] or None,
+        )
+        text = result["text"].strip()
+        if text:
+            previous_text = text
+        offset = start / SAMPLE_RATE
+        segments = [
+            {"start": seg["start"] + offset, "end": seg["end"] + offset, "text": seg["text"].strip()}
+            for seg in result.get("segments", [])
+        ]
+        yield {"text": text, "segments": segments, "language": result.get("language")}, end
+
+
+def transcribe_audio_stream(audio, chunk_seconds: float = WHISPER_STREAM_CHUNK_SECONDS):
+    """
+    將長音訊切成對齊安靜處的片段，逐段轉錄並即時產出結果。
+
+    Args:
+        audio: 音訊檔案路徑或 16kHz float32 波形。
+        chunk_seconds: 每段的目標長度（秒）。
+
+    Yields:
+        (該段文字, 已處理秒數, 總秒數)；秒數以原始錄音為準，靜音去除不影響進度計算。
+        整段都沒有語音時不會產出任何結果。
+
+    Raises:
+        轉錄過程中的任何錯誤都會直接拋出，由呼叫端決定如何處理已產出的部分結果。
+    """
+    pool = _get_pool()
+    waveform = _load_waveform(audio)
+    total_seconds = len(waveform) / SAMPLE_RATE
+    waveform, timeline = remove_silence(waveform)
+    if len(waveform) == 0:
+        return
+    # 有轉錄程序池時各段同時平行轉錄，仍依順序產出
+    chunks = pool.transcribe_chunks(waveform, chunk_seconds) if pool is not None else \
+        _transcribe_chunks(waveform, main_backend, chunk_seconds)
+    for output, end in chunks:
+        done_seconds = end / SAMPLE_RATE
+        if timeline is not None:
+            done_seconds = timeline.to_original(done_seconds)
+        yield output["text"], done_seconds, total_seconds
+
+
+def _transcribe_with(backend, backend_batcher, audio, duration):
+    """以指定的模型轉錄，有多條工作執行緒時短音訊走批次推論。回傳含 text、avg_logprob、segments、language 的 dict。"""
+    if batching_enabled() and duration <= WHISPER_BATCH_MAX_AUDIO_SECONDS:
+        return backend_batcher.submit(audio).result()
+    result = backend.transcribe(audio)
+    segments = result.get("segments", [])
+    return {
+        "text": result["text"].strip(),
+        "avg_logprob": float(np.mean([s["avg_logprob"] for s in segments])) if segments else 0.0,
+        "segments": [{"start": s["start"], "end": s["end"], "text": s["text"].strip()} for s in segments],
+        "language": result.get("language"),
+    }
+
+
+def _transcribe_default(audio, duration):
+    """預設設定：短語音先試快速模型，信心不足或較長的音訊交給主模型。回傳 (輸出 dict, 模型名稱)。"""
+    if fast_backend is not None and duration <= WHISPER_FAST_MAX_SECONDS:
+        output = _transcribe_with(fast_backend, fast_batcher, audio, duration)
+        if output["avg_logprob"] >= WHISPER_FAST_MIN_LOGPROB:
+            return output, fast_backend.name
+        print(f"快速模型 {fast_backend.name} 信心不足 (平均 log 機率 {output['avg_logprob']:.2f})，"
+              f"改用 {main_backend.name} 重新轉錄")
+    return _transcribe_with(main_backend, batcher, audio, duration), main_backend.name
+
+
+def _merge_chunks(chunks):
+    """依序合併 _transcribe_chunks 產出的各段結果。"""
+    texts, segments, language = [], [], None
+    for output, _ in chunks:
+        if output["text"]:
+            texts.append(output["text"])
+        segments.extend(output["segments"])
+        language = language or output["language"]
+    return {"text": " ".join(texts), "segments": segments, "language": language}
+
+
+def _transcribe_chunked(audio, backend):
+    """降級模式：切成較短的片段逐段轉錄，降低單次推論需要的記憶體。回傳 (輸出 dict, 模型名稱)。"""
+    return _merge_chunks(_transcribe_chunks(audio, backend, WHISPER_DEGRADED_CHUNK_SECONDS)), f"{backend.name} (分段)"
+
+
+def _transcribe_pooled(audio, pool):
+    """多程序模式：依安靜處切成約 (長度 / 程序數) 的片段，交給轉錄程序平行處理後依序合併。回傳 (輸出 dict, 模型名稱)。"""
+    shard_seconds = max(WHISPER_POOL_MIN_SHARD_SECONDS, len(audio) / SAMPLE_RATE / pool.num_processes)
+    output = _merge_chunks(pool.transcribe_chunks(audio, shard_seconds))
+    return output, f"{main_backend.name} (x{pool.num_processes} 程序)"
+
+
+def transcribe_audio(filepath) -> TranscriptionResult:
+    """
+    使用本地 Whisper 模型將音訊轉錄為文字。
+
+    推論前先去除長時間的靜音；有設定快速模型時，短語音先以快速模型轉錄，信心不足才交給主模型。
+    不超過 30 秒的短語音在有多條工作執行緒時會與其他同時到達的請求合併批次推論，其餘則直接呼叫模型的 transcribe；
+    有設定 WHISPER_POOL_PROCESSES 時，超過 WHISPER_POOL_MIN_SECONDS 的錄音改由多個轉錄程序分段平行轉錄。
+    遇到暫時性錯誤（例如記憶體不足）時，依序改用分段模式、較小的模型重試。
+
+    Args:
+        filepath: 音訊檔案的路徑，或已載入的 16kHz float32 波形。
+
+    Returns:
+        TranscriptionResult；整段沒有語音時不執行模型，status 為 no_speech。
+    """
+    start_time = time.time()
+    pool = _get_pool()
     try:
-        result = model.transcribe(filepath)
-        return result["text"]
+        waveform = _load_waveform(filepath)
     except Exception as e:
-        print(f"Whisper 轉錄音訊時發生錯誤: {e}")
-        # 這裡可以根據需要，返回一個錯誤訊息或重新拋出異常
-        return "語音轉文字服務暫時無法使用。"
\ No newline at end of file
+        print(f"讀取音訊時發生錯誤: {e}")
+        return TranscriptionResult("error", "無法讀取這個音訊檔案，請確認檔案格式是否正確。", error=str(e),
+                                   elapsed_seconds=time.time() - start_time)
+
+    audio_seconds = len(waveform) / SAMPLE_RATE
+    audio, timeline = remove_silence(waveform)
+    speech_seconds = len(audio) / SAMPLE_RATE
+    if len(audio) == 0:
+        print("音訊中沒有偵測到語音，略過轉錄")
+        return TranscriptionResult("no_speech", audio_seconds=audio_seconds,
+                                   elapsed_seconds=time.time() - start_time)
+
+    if pool is not None and speech_seconds >= WHISPER_POOL_MIN_SECONDS:
+        attempts = [(f"多程序模式 ({pool.num_processes} 個程序)", lambda: _transcribe_pooled(audio, pool))]
+    else:
+        attempts = [("預設設定", lambda: _transcribe_default(audio, speech_seconds))]
+    attempts.append(("分段模式", lambda: _transcribe_chunked(audio, main_backend)))
+    if degraded_backend is not None:
+        attempts.append((f"較小的模型 {degraded_backend.name}", lambda: _transcribe_chunked(audio, degraded_backend)))
+
+    last_error = None
+    for index, (label, attempt) in enumerate(attempts):
+        try:
+            output, model_name = attempt()
+            break
+        except Exception as e:
+            last_error = e
+            if not is_transient_error(e):
+                print(f"Whisper 轉錄音訊時發生錯誤: {e}")
+                return TranscriptionResult("error", "語音轉文字服務暫時無法使用。", error=str(e),
+                                           audio_seconds=audio_seconds, speech_seconds=speech_seconds,
+                                           elapsed_seconds=time.time() - start_time)
+            _release_memory()
+            if index + 1 < len(attempts):
+                print(f"Whisper 以{label}轉錄時發生暫時性錯誤 ({e})，改用{attempts[index + 1][0]}重試")
+    else:
+        print(f"Whisper 轉錄音訊時發生錯誤，降級重試也失敗: {last_error}")
+        return TranscriptionResult("error", "語音轉文字服務暫時無法使用，請稍後再試一次。", error=str(last_error),
+                                   retryable=True, audio_seconds=audio_seconds, speech_seconds=speech_seconds,
+                                   elapsed_seconds=time.time() - start_time)
+
+    if not output["text"].strip():
+        # 有聲音但模型沒有辨識出任何文字（例如只有音樂或雜音）
+        return TranscriptionResult("no_speech", audio_seconds=audio_seconds, speech_seconds=speech_seconds,
+                                   elapsed_seconds=time.time() - start_time, model=model_name)
+
+    segments = output["segments"]
+    if timeline is not None and segments:
+        starts = timeline.to_original(np.array([seg["start"] for seg in segments]))
+        ends = timeline.to_original(np.array([seg["end"] for seg in segments]))
+        segments = [
+            {"start": float(start), "end": float(end), "text": seg["text"]}
+            for seg, start, end in zip(segments, starts, ends)
+        ]
+    return TranscriptionResult(
+        "ok", output["text"], segments=segments, language=output["language"],
+        audio_seconds=audio_seconds, speech_seconds=speech_seconds,
+        elapsed_seconds=time.time() - start_time, model=model_name,
+    )
@@ -0,0 +1,246 @@
+"""
+獨立的轉錄 worker 程序：從 SQLite 工作佇列取出工作，載入 Whisper 並執行轉錄與摘要。
+
+搭配 Web 程序的 JOB_BACKEND=sqlite 使用：
+
+    python worker.py                     # 單一程序、TRANSCRIBE_WORKERS 條執行緒
+    python worker.py --processes 4       # 在同一台主機上啟動 4 個 worker 程序
+    python worker.py --metrics-port 9100 # 在 :9100/metrics 輸出本程序的監控指標（多程序時依序使用 9100、9101...）
+
+多個 worker 程序（或多次執行 worker.py）可以同時共用同一個 JOB_DB_PATH。
+--processes 的 worker 程序以 spawn 啟動，不繼承本程序已建立的 SQLite 連線與執行緒；
+收到 SIGTERM 時會轉給各 worker 程序，等執行中的工作結束後再一起退出。
+"""
+import argparse
+import multiprocessing
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+
+from dotenv import load_dotenv
+
+# app 在 JOB_BACKEND=memory 時會啟動自己的工作排程器與模型暖機，worker 用不到，所以在 import app 之前就中止
+load_dotenv()
+if os.getenv("JOB_BACKEND", "memory").lower() != "sqlite":
+    sys.exit("worker.py 只搭配 JOB_BACKEND=sqlite 使用，請設定 JOB_BACKEND=sqlite 後再啟動")
+
+from app import app, process_audio_in_background, push_text_message, JOB_DB_PATH, TRANSCRIBE_WORKERS
+from job_queue import RetryLater
+from job_store import JobStore
+import metrics
+
+POLL_INTERVAL_SECONDS = float(os.getenv("WORKER_POLL_INTERVAL", "1.0"))
+STALE_CHECK_INTERVAL_SECONDS = 30
+# 工作租約；執行中的工作每 1/3 租約時間延長一次，worker 當機後最多這麼久就會被其他 worker 接手
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "120"))
+# 已完成、已失敗的工作紀錄保留天數，以及多久清理一次
+JOB_RETENTION_DAYS = float(os.getenv("JOB_RETENTION_DAYS", "7"))
+JOB_PURGE_INTERVAL_SECONDS = int(os.getenv("JOB_PURGE_INTERVAL_SECONDS", "3600"))
+JOB_FAILED_MESSAGE = "抱歉，處理您的語音訊息時一直發生問題，重試多次仍無法完成，請稍後再傳送一次。🙏"
+
+
+def notify_failed_job(job_id, user_id):
+    """工作超過重試次數、不會再被處理時，通知用戶重新傳送；推送失敗只記錄錯誤。"""
+    try:
+        push_text_message(user_id, JOB_FAILED_MESSAGE)
+        app.logger.info(f"已通知用戶 {user_id} message_id: {job_id} 最終處理失敗")
+    except Exception as e:
+        app.logger.error(f"通知用戶 {user_id} 工作失敗 (message_id: {job_id}) 時發生錯誤: {e}", exc_info=True)
+
+
+def requeue_stale_jobs(store):
+    """把租約過期的工作放回佇列，並通知因此超過重試次數的工作的用戶。"""
+    requeued, failed_jobs = store.requeue_stale()
+    if requeued or failed_jobs:
+        app.logger.warning(f"租約過期的工作：{requeued} 筆重新排隊，{len(failed_jobs)} 筆超過重試次數標記為失敗")
+    for job in failed_jobs:
+        notify_failed_job(job.message_id, job.user_id)
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def recover_local_jobs(store):
+    """
+    啟動時檢查本機其他 worker 程序留下的 running 工作：程序已經不存在（當機後重新啟動）時，
+    不等租約過期，直接把這些工作放回佇列。worker_id 的格式為 "{hostname}-{pid}-{執行緒編號}"。
+    """
+    hostname = socket.gethostname()
+    for worker_id in store.running_worker_ids():
+        host, _, rest = worker_id.rpartition("-")[0].rpartition("-")
+        if host != hostname or not rest.isdigit():
+            continue
+        pid = int(rest)
+        if pid != os.getpid() and not _pid_alive(pid):
+            expired = store.expire_leases(f"{host}-{pid}-")
+            app.logger.warning(f"worker {host}-{pid} 已不存在，{expired} 筆執行中的工作將重新排隊")
+    requeue_stale_jobs(store)
+
+
+def purge_finished_jobs(store):
+    """刪除超過 JOB_RETENTION_DAYS 天的已完成、已失敗工作紀錄，避免 JOB_DB_PATH 無限增長。"""
+    purged = store.purge_finished(JOB_RETENTION_DAYS * 24 * 3600)
+    if purged:
+        app.logger.info(f"已清除 {purged} 筆超過 {JOB_RETENTION_DAYS:g} 天的工作紀錄")
+
+
+def _stop_on_sigterm(signum, frame):
+    # 與 Ctrl+C 相同：停止取新工作，等執行中的工作結束
+    raise KeyboardInterrupt
+
+
+def _run_job(store, job, worker_id):
+    # 轉錄長檔案時定期延長租約，避免被其他 worker 視為已當機而重新執行
+    stop_heartbeat = threading.Event()
+
+    def heartbeat():
+        while not stop_heartbeat.wait(store.lease_seconds / 3):
+            store.heartbeat(job.message_id, worker_id)
+
+    heartbeat_thread = threading.Thread(target=heartbeat, daemon=True)
+    heartbeat_thread.start()
+    metrics.ACTIVE_WORKERS.inc()
+    try:
+        process_audio_in_background(job.payload, app.app_context())
+        store.complete(job.message_id)
+        app.logger.info(f"[{worker_id}] 工作完成 message_id: {job.message_id}")
+    except RetryLater as e:
+        # 不佔用執行緒等待，交回佇列延後再取
+        store.retry_later(job.message_id, e.delay_seconds, job.payload)
+        app.logger.info(f"[{worker_id}] message_id: {job.message_id} 將在 {e.delay_seconds:.1f} 秒後重試: {e}")
+    except Exception as e:
+        app.logger.error(f"[{worker_id}] 工作失敗 message_id: {job.message_id} (第 {job.attempts} 次): {e}", exc_info=True)
+        if store.fail(job.message_id, e):
+            notify_failed_job(job.message_id, job.user_id)
+    finally:
+        metrics.ACTIVE_WORKERS.dec()
+        stop_heartbeat.set()
+        heartbeat_thread.join()
+
+
+def _worker_thread(store, worker_id, stop_event):
+    while not stop_event.is_set():
+        job = store.claim(worker_id)
+        if job is None:
+            stop_event.wait(POLL_INTERVAL_SECONDS)
+            continue
+        app.logger.info(f"[{worker_id}] 取得工作 message_id: {job.message_id} (用戶 {job.user_id}，第 {job.attempts} 次嘗試，"
+                        f"排隊 {time.time() - job.created_at:.1f} 秒)")
+        _run_job(store, job, worker_id)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = metrics.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # 不要讓每次抓取指標都寫一行 log
+
+
+def start_metrics_server(port):
+    """在背景執行緒中以 HTTP 提供本程序的 /metrics。"""
+    server = ThreadingHTTPServer(("0.0.0.0", port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    app.logger.info(f"監控指標: http://0.0.0.0:{port}/metrics")
+    return server
+
+
+def run_worker(num_threads, metrics_port=None):
+    """在目前程序中啟動 num_threads 條工作執行緒，直到收到 KeyboardInterrupt 或 SIGTERM。"""
+    signal.signal(signal.SIGTERM, _stop_on_sigterm)
+    # 本程序執行中的工作數；佇列深度沿用 app 中讀取共用 SQLite 佇列的設定
+    metrics.ACTIVE_WORKERS.set_function(None)
+    metrics.ACTIVE_WORKERS.set(0)
+    if metrics_port:
+        start_metrics_server(metrics_port)
+
+    # 在開始取工作前先載入模型並暖機，避免第一個工作承擔載入時間
+    import whisper_helper
+    whisper_helper.set_transcribe_workers(num_threads)
+    whisper_helper.warm_up()
+
+    store = JobStore(JOB_DB_PATH, lease_seconds=JOB_LEASE_SECONDS)
+    recover_local_jobs(store)
+    purge_finished_jobs(store)
+
+    worker_prefix = f"{socket.gethostname()}-{os.getpid()}"
+    stop_event = threading.Event()
+    threads = []
+    for i in range(num_threads):
+        t = threading.Thread(target=_worker_thread, args=(store, f"{worker_prefix}-{i}", stop_event), daemon=True)
+        t.start()
+        threads.append(t)
+    app.logger.info(f"worker {worker_prefix} 已啟動 {num_threads} 條工作執行緒，佇列: {JOB_DB_PATH}")
+
+    last_purge = time.monotonic()
+    try:
+        while True:
+            time.sleep(STALE_CHECK_INTERVAL_SECONDS)
+            requeue_stale_jobs(store)
+            if JOB_PURGE_INTERVAL_SECONDS > 0 and time.monotonic() - last_purge >= JOB_PURGE_INTERVAL_SECONDS:
+                last_purge = time.monotonic()
+                purge_finished_jobs(store)
+    except KeyboardInterrupt:
+        app.logger.info(f"worker {worker_prefix} 收到中斷訊號，等待執行中的工作結束...")
+        stop_event.set()
+        for t in threads:
+            t.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="LINE Bot 語音轉錄 worker")
+    parser.add_argument("--processes", type=int, default=1, help="要啟動的 worker 程序數量")
+    parser.add_argument("--threads", type=int, default=TRANSCRIBE_WORKERS, help="每個 worker 程序的工作執行緒數量")
+    parser.add_argument("--metrics-port", type=int, default=None, help="提供 /metrics 的連接埠，多程序時每個程序依序加 1")
+    args = parser.parse_args()
+
+    if args.processes <= 1:
+        run_worker(args.threads, args.metrics_port)
+        return
+
+    # 以 spawn 啟動：本程序 import app 時已建立的 SQLite 連線、背景執行緒與鎖都不會被複製到 worker 程序
+    ctx = multiprocessing.get_context("spawn")
+    processes = [
+        ctx.Process(target=run_worker, args=(args.threads, args.metrics_port + i if args.metrics_port else None))
+        for i in range(args.processes)
+    ]
+    for p in processes:
+        p.start()
+
+    def stop_processes(signum, frame):
+        app.logger.info("收到 SIGTERM，通知各 worker 程序在執行中的工作結束後退出...")
+        for p in processes:
+            if p.is_alive():
+                p.terminate()
+
+    signal.signal(signal.SIGTERM, stop_processes)
+    try:
+        for p in processes:
+            p.join()
+    except KeyboardInterrupt:
+        # Ctrl+C 也會送到各 worker 程序，由它們自行結束
+        for p in processes:
+            p.join()
+
+
+if __name__ == "__main__":
+    main()